@@ -1,7 +1,5 @@
 #!/usr/bin/python3
 
-from cassandra.cluster import Cluster
-from cassandra.auth import PlainTextAuthProvider
 from calendar import timegm
 from time import struct_time, strftime, gmtime
 from dateutil.relativedelta import relativedelta
@@ -9,7 +7,10 @@ from datetime import datetime
 import argparse
 import sys
 from pyproj import Proj
-import requests
+import resourceInventory
+import monroeFetch
+import monroeCache
+import monroeSummary
 
 ###############################################################################
 def ParseCommandLine():
@@ -18,6 +19,8 @@ def ParseCommandLine():
     parser.add_argument('-p', '--project', help = 'Project to retrieve data for', required = True)
     parser.add_argument('-s', '--startTime', help = 'Starting timestamp', required = True)
     parser.add_argument('-e', '--endTime', help = 'Ending timestamp', required = True)
+    monroeCache.AddFetchArguments(parser)
+    resourceInventory.AddInventoryArguments(parser)
     args = parser.parse_args()
 
     # Validate args
@@ -58,33 +61,31 @@ def FindUtmZone(longitude, latitude):
 if __name__ == '__main__':
     args = ParseCommandLine()
 
-    response = requests.get('https://scheduler.monroe-system.eu/v1/resources', cert=('/home/dimitris/monroe/certificate.pem', '/home/dimitris/monroe/privateKeyClear.pem'))
-
-    if response.status_code != 200:
-        # This means something went wrong.
-        print('GET /v1/resources {}'.format(response.status_code))
-        print('Response Headers: {}'.format(response.headers))
-        sys.exit()
+    # Get the node inventory (saved locally and revalidated with the scheduler, see resourceInventory.py)
+    inventory = resourceInventory.LoadInventory(('/home/dimitris/monroe/certificate.pem', '/home/dimitris/monroe/privateKeyClear.pem'), args.inventoryTtl)
         
-    authProvider = PlainTextAuthProvider(username='monroedb', password='monroedb_pass')
-    cluster = Cluster(['127.0.0.1'], 9042, auth_provider = authProvider, connect_timeout = 15)
-    session = cluster.connect('monroe')
-    
+    # Make the connection to the database (and/or open the local cache)
+    cluster, fetcher = monroeCache.OpenFetcher(args)
+
+    resources = inventory.Nodes(args.project, ('deployed', 'testing'))
+
+    # One LIMIT 1 probe per node tells whether it has GPS data, the rows themselves are not fetched
+    summaries = monroeSummary.GpsSummaries(fetcher, args.cacheDir, args.settleDelay)
+    try:
+        hasGpsByNode = summaries.HasGps([resource['id'] for resource in resources], args.startTimeStamp,
+                                        args.endTimeStamp)
+    except monroeFetch.FetchError as e:
+        sys.exit(str(e))
+
     gpsData = 0
     noGpsData = 0
-    for resource in response.json():
-        # print('{} {}'.format(resource['id'], resource['project']))
-        
-        if resource['project'] == args.project and (resource['type'] == 'deployed' or resource['type'] == 'testing'):
-            # GPS data
-            #print("SELECT nodeid, timestamp, latitude, longitude FROM monroe_meta_device_gps WHERE nodeid = '" + str(resource['id']) + "' AND timestamp >= " + str(args.startTimeStamp) + " AND timestamp <= " + str(args.endTimeStamp) + " ALLOW FILTERING")
-            gpsRows = session.execute("SELECT nodeid, timestamp, latitude, longitude FROM monroe_meta_device_gps WHERE nodeid = '" + str(resource['id']) + "' AND timestamp >= " + str(args.startTimeStamp) + " AND timestamp <= " + str(args.endTimeStamp) + " ALLOW FILTERING", timeout = 20000)
-            #gpsRows = session.execute("SELECT nodeid, timestamp, latitude, longitude FROM monroe_meta_device_gps WHERE nodeid = '491' AND timestamp >= " + str(args.startTimeStamp) + " AND timestamp <= " + str(args.endTimeStamp) + " ALLOW FILTERING", timeout = 20000)
-            if not gpsRows:
-                noGpsData += 1
-            else:
-                gpsData += 1
+    for hasGps in hasGpsByNode.values():
+        if not hasGps:
+            noGpsData += 1
+        else:
+            gpsData += 1
     
     print("Experiment: {}, Total Nodes: {}, Nodes with GPS data: {}".format(str(args.project), str(noGpsData + gpsData), str(gpsData)))
     
-    cluster.shutdown
+    if cluster is not None:
+        cluster.shutdown()
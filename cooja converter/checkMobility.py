@@ -1,7 +1,5 @@
 #!/usr/bin/python3
 
-from cassandra.cluster import Cluster
-from cassandra.auth import PlainTextAuthProvider
 from calendar import timegm
 from time import struct_time, strftime, gmtime
 from dateutil.relativedelta import relativedelta
@@ -9,7 +7,10 @@ from datetime import datetime
 import argparse
 import sys
 from pyproj import Proj
-import requests
+import resourceInventory
+import monroeFetch
+import monroeCache
+import monroeSummary
 
 ###############################################################################
 def ParseCommandLine():
@@ -20,7 +21,8 @@ def ParseCommandLine():
     parser.add_argument('-e', '--endTime', help = 'Ending timestamp', required = True)
     parser.add_argument('-c', '--certificate', help = 'Path to the client certificate used for server authentication', required = True)
     parser.add_argument('-k', '--privateKey', help = 'Path to the private key used for server authentication', required = True)
-    
+    monroeCache.AddFetchArguments(parser)
+    resourceInventory.AddInventoryArguments(parser)
     args = parser.parse_args()
 
     # Validate args
@@ -49,22 +51,20 @@ def ParseCommandLine():
 if __name__ == '__main__':
     args = ParseCommandLine()
 
-    response = requests.get('https://scheduler.monroe-system.eu/v1/resources', cert=(args.certificate, args.privateKey))
-
-    if response.status_code != 200:
-        # This means something went wrong.
-        print('GET /v1/resources {}'.format(response.status_code))
-        print('Response Headers: {}'.format(response.headers))
-        sys.exit()
+    # Get the node inventory (saved locally and revalidated with the scheduler, see resourceInventory.py)
+    inventory = resourceInventory.LoadInventory((args.certificate, args.privateKey), args.inventoryTtl)
         
-    authProvider = PlainTextAuthProvider(username='monroedb', password='monroedb_pass')
-    cluster = Cluster(['127.0.0.1'], 9042, auth_provider = authProvider, connect_timeout = 15)
-    session = cluster.connect('monroe')
-    
+    # Make the connection to the database (and/or open the local cache)
+    cluster, fetcher = monroeCache.OpenFetcher(args)
+
+    resources = inventory.Nodes(args.project, ('deployed', 'testing'))
+
+    # Days of the range
+    days = []
     runningStart = args.startDateTime
     
     while True:
-        runningEnd = datetime(runningStart.year, runningStart.month, runningStart.day + 1)
+        runningEnd = runningStart.replace(hour=0, minute=0) + relativedelta(days=1)
         if runningEnd > args.endDateTime:
             runningEnd = args.endDateTime
         
@@ -72,41 +72,37 @@ if __name__ == '__main__':
         
         runningStartTimeStamp = int((runningStart - epoch).total_seconds());
         runningEndTimeStamp = int((runningEnd - epoch).total_seconds());
+        days.append((runningStart, runningEnd, runningStartTimeStamp, runningEndTimeStamp))
+
+        runningStart = runningEnd
         
+        if runningEnd == args.endDateTime:
+            break
+
+    # Row count and bounding box of the GPS data of every node and day, all computed by the database at once
+    # (or read from the summaries saved in the cache directory): a node is mobile when its box is not a point
+    nodes = sorted(set(str(resource['id']) for resource in resources))
+    summaries = monroeSummary.GpsSummaries(fetcher, args.cacheDir, args.settleDelay)
+    try:
+        summaryByNodeDay = summaries.Summaries(nodes, [(start, end) for _, _, start, end in days])
+    except monroeFetch.FetchError as e:
+        sys.exit(str(e))
+
+    for runningStart, runningEnd, runningStartTimeStamp, runningEndTimeStamp in days:
         noGpsDataCount = 0
         noMobilityCount = 0
         mobilityCount = 0
         
-        for resource in response.json():
-            # print('{} {}'.format(resource['id'], resource['project']))
-            
-            if resource['project'] == args.project and (resource['type'] == 'deployed' or resource['type'] == 'testing'):
-                # GPS data
-                #print("SELECT nodeid, timestamp, latitude, longitude FROM monroe_meta_device_gps WHERE nodeid = '" + str(resource['id']) + "' AND timestamp >= " + str(args.startTimeStamp) + " AND timestamp <= " + str(args.endTimeStamp) + " ALLOW FILTERING")
-                gpsRows = session.execute("SELECT nodeid, timestamp, latitude, longitude FROM monroe_meta_device_gps WHERE nodeid = '" + str(resource['id']) + "' AND timestamp >= " + str(runningStartTimeStamp) + " AND timestamp <= " + str(runningEndTimeStamp) + " ALLOW FILTERING", timeout = 20000)
-                if not gpsRows:
-                    noGpsDataCount += 1
-                else:
-                    latitude = gpsRows[0].latitude
-                    longitude = gpsRows[0].longitude
-                    found = False
-                    
-                    for row in gpsRows:
-                        if row.latitude != latitude or row.longitude != longitude:
-                            # print ( "node: {}, row.latitude: {:f}, latitude: {:f}, row.longitude: {:f}, longitude: {:f} ".format(row.nodeid, row.latitude, latitude, row.longitude, longitude ) )
-                            mobilityCount += 1
-                            found = True
-                            break
-
-                    if not found:
-                        noMobilityCount += 1
+        for nodeid in nodes:
+            summary = summaryByNodeDay[(nodeid, runningStartTimeStamp, runningEndTimeStamp)]
+            if not summary['rows']:
+                noGpsDataCount += 1
+            elif monroeSummary.IsMobile(summary):
+                mobilityCount += 1
+            else:
+                noMobilityCount += 1
         
         print("Interval: {} - {}, Total Nodes: {}, No GPS data nodes: {}, Mobile nodes: {} ".format(str(runningStart), str(runningEnd),  str(noGpsDataCount + noMobilityCount + mobilityCount), str(noGpsDataCount), str(mobilityCount) ))
-
-        runningStart = runningEnd
-        
-        if runningEnd == args.endDateTime:
-            break
    
-    cluster.shutdown
-
+    if cluster is not None:
+        cluster.shutdown()
@@ -1,164 +1,195 @@
 #!/usr/bin/python3
+import argparse
+import mmap
 import os
-
-fileIn='./inFile'
-fileOut='./monroe-positions'
-
-nodePrev = 0
-nodeCur = 0
-nodeIterator = 1
-timeIterator = 0.0
-x_max = 0.0
-y_max = 0.0
-x_min = 800000
-y_min = 9000000
-temp=[]
-
-new_dimen_x = 150
-new_dimen_y = 150
+import re
+import numpy as np
+import traceFormat
+
+# Converts the output of the fetch scripts ("node: N, time: T, x: X, y: Y" lines, e.g. fetchMonroeData_George_2.py)
+# to a Cooja mobility (positions) file.
+#
+# The input is memory-mapped and parsed in chunks of lines into arrays (node, x, y) with one regular expression per
+# chunk. Inputs up to IN_MEMORY_LIMIT are read once and kept as arrays; larger ones are parsed twice (bounds, then
+# conversion) so that memory stays bounded, unless the bounds are given with --bounds (e.g. the x_min/y_min/x_max/y_max
+# printed by the fetch script) in which case the input is converted in a single streaming pass.
+# Binary traces (traceFormat.py, fetchMonroeData_George_2.py --binary) are memory-mapped as they are and their bounds
+# are taken from the header, so they are never parsed or scanned.
+
+LINE = re.compile(rb'node: (.*?), time:.*?, x: (.*?), y: (\S*)')
+
+CHUNK_SIZE = 64 * 1024 * 1024
+IN_MEMORY_LIMIT = 1024 * 1024 * 1024
+
+# only write into file stations with alot of DISTINCT movements (more than 700 s of 0.2 s steps)
+MIN_POSITIONS = 3500
+
+
+###############################################################################
+def ParseCommandLine():
+   parser = argparse.ArgumentParser(description = "Fetch output to Cooja mobility file converter")
+   parser.add_argument('-i', '--inFile', help = 'Output of the fetch script, text or binary trace (default = ./inFile)', required = False, default = './inFile')
+   parser.add_argument('-o', '--outFile', help = 'Cooja positions file to write (default = ./monroe-positions)', required = False, default = './monroe-positions')
+   parser.add_argument('-b', '--bounds', help = 'x_min y_min x_max y_max of the input, skips scanning it for them', required = False, nargs = 4, type = float)
+   parser.add_argument('--canvas', help = 'Cooja canvas dimensions (default = 150 150)', required = False, nargs = 2, default = [150, 150], type = float)
+   return parser.parse_args()
+
+
+###############################################################################
+# Parse the input in chunks of whole lines. Yields the node (bytes), x and y arrays of every chunk.
+
+def ReadChunks(fileIn):
+   size = os.path.getsize(fileIn)
+   if size == 0:
+      return
+
+   with open(fileIn, 'rb') as fp:
+      mm = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+      try:
+         start = 0
+         while start < size:
+            end = min(start + CHUNK_SIZE, size)
+            if end < size:
+               newline = mm.rfind(b'\n', start, end)
+               if newline < 0:
+                  newline = mm.find(b'\n', end)
+               end = newline + 1 if newline >= 0 else size
+
+            fields = LINE.findall(mm, start, end)
+            start = end
+            if fields:
+               fields = np.array(fields)
+               yield fields[:, 0], fields[:, 1].astype(float), fields[:, 2].astype(float)
+      finally:
+         mm.close()
+
+
+# Records of a binary trace in chunks (views of the memory-mapped file)
+def TraceChunks(trace):
+   for start in range(0, len(trace.records), CHUNK_SIZE // traceFormat.RECORD_DTYPE.itemsize):
+      records = trace.records[start:start + CHUNK_SIZE // traceFormat.RECORD_DTYPE.itemsize]
+      yield records['node'], records['x'], records['y']
 
 
 # first need to find tha relative x_min, y_min in the whole file
-with open(fileIn) as fp:
-   # these lines execute ONCE
-   line = fp.readline()
+def FindBounds(chunks):
    cnt = 0
-   # iterate through all the file lines
-   while line:
-      cnt+=1
-      
-      coordX = line.partition(', x: ')[2]
-      coordX =  coordX.partition(', y: ')[0]
-      coordY =  line.partition(', y: ')[2]
-
-      coordX = float(coordX)
-      coordY = float(coordY)
-
-      if(coordX<x_min):
-         x_min = coordX
-         #print("x_min:", x_min)
-      if(coordY<y_min):
-         y_min = coordY
-         #print("y_min:", y_min)
-
-      if(coordX>x_max):
-         x_max = coordX
-         #print("x_max:", x_min)
-      if(coordY>y_max):
-         y_max = coordY
-         #print("y_max:", y_min)
-
-      # read next line
-      line = fp.readline()
-      
+   x_min, y_min = 800000, 9000000
+   x_max, y_max = 0.0, 0.0
+   for nodes, coordX, coordY in chunks:
+      cnt += len(nodes)
+      x_min, y_min = min(x_min, coordX.min()), min(y_min, coordY.min())
+      x_max, y_max = max(x_max, coordX.max()), max(y_max, coordY.max())
+
    print("Lines read: ",cnt," Final Results:")
-   print("x_min:", x_min)
-   print("y_min:", y_min)
-   print("x_max:", x_max)
-   print("y_max:", y_max)
+   print("x_min:", float(x_min))
+   print("y_min:", float(y_min))
+   print("x_max:", float(x_max))
+   print("y_max:", float(y_max))
    print("finished min/max")
-   
-   
-def transform_x(coordX):
-   return ((coordX - x_min + 0.000001)/x_diff)*new_dimen_x
-
-def transform_y(coordY):
-   return ((coordY - y_min + 0.000001) / y_diff) * new_dimen_y
-
-
-x_diff = x_max - x_min
-y_diff = y_max - y_min
-
-fp = open(fileIn,'r')
-rp = open(fileOut, 'w')
-
-#these lines execute ONCE
-line = fp.readline()
-cnt=1
-similarityCounter = 0
-try:
-   #iterate through all the file lines
-   while line:
-      cnt += 1 #total lines counter
-      #print("round:", cnt)
-
-      #line to compare with the next
-      linePrev = line
-
-      nodePrev = line.partition('node: ')[2]
-      nodePrev = nodePrev.partition(', time:')[0]
-
-      coordX_Prev = linePrev.partition(', x: ')[2]
-      coordX_Prev = coordX_Prev.partition(', y: ')[0]
-      coordY_Prev = linePrev.partition(', y: ')[2]
-
-      coordX_Prev = float(coordX_Prev)
-      coordY_Prev = float(coordY_Prev)
-
-
-      #next line to compare
-      line = fp.readline()
-      nodeCur = line.partition('node: ')[2]
-      nodeCur = nodeCur.partition(', time:')[0]
-
-
-      coordX = line.partition(', x: ')[2]
-      coordX = coordX.partition(', y: ')[0]
-      coordY = line.partition(', y: ')[2]
-
-      coordX = float(coordX)
-      coordY = float(coordY)
-
-      if(coordX_Prev == coordX and coordY_Prev == coordY):
-         similarityCounter+=1
-         #print(similarityCounter)
-      else:
-         similarityCounter=0
-         # only the useful will be transformed for cooja dimensions (default: 150X150)
-         coordX = transform_x(coordX)
-         coordY = transform_y(coordY)
-         line2write = str(nodeIterator)+' '+str(timeIterator)+' '+str(coordX)+' '+str(coordY)+"\n"
-         timeIterator = round(timeIterator+0.2,1) # first write, then increase
-         temp.append(line2write)
-
-      #every time a new node appears, increase the node number, and reset the timer
-      if (nodeCur != nodePrev):#node number needs to be increased
-         print('station counter: ',nodeIterator,'Final time counter: ', timeIterator)
-
-         #print('next node appears, no increase yet')
-         #only write into file stations with alot of DISTINCT movements
-         if(timeIterator>700):
-            # only increase the node number if succesfuly inserted a node inot file
-            nodeIterator += 1
-            print('node increased: ',nodeIterator)
-            #print('first line to write after iter>700: ',temp[0])
-            
-            # write line to outFile
-            for item in temp:
-               rp.write(item)
-            # erase the temp list, After succesfuly writing to output file
-            temp = []
-
-         else: #erase the temp list, but DONT WRITE this node, since data are not enough
-            temp = []
-
-         #reset time for every next node, DISREGARDING the length of data provided by the previous
-         timeIterator = 0.0
-
-except Exception as e:
-   print("Error: ", e, ' line number: ', cnt)
-
-# it never reaches here ??????
-print('total lines:', str(cnt))
-
-#write to output file the total number of nodes
-#rp.seek(0,0)
-#rp.write("\n")
-
-#rp.write('#total nodes: '+str(nodeIterator)+"\n")
-
-rp.close()
-fp.close()
-
-
+   return float(x_min), float(y_min), float(x_max), float(y_max)
+
+
+###############################################################################
+# Writes the positions of every node that moved. A line is written when its position differs from the previous line
+# (of any node), as "station time x y" with the coordinates transformed to the Cooja canvas and the time advanced by
+# 0.2 s per written line. When the node changes the station is kept only if it has more than MIN_POSITIONS lines (the
+# first line of the next node is still counted in the previous station); the last node of the file is not written.
+
+class CoojaWriter:
+   def __init__(self, rp, bounds, canvas):
+      self.rp = rp
+      self.x_min, self.y_min, x_max, y_max = bounds
+      self.x_diff = x_max - self.x_min
+      self.y_diff = y_max - self.y_min
+      self.new_dimen_x, self.new_dimen_y = canvas
+
+      self.prev = None
+      self.nodeIterator = 1
+      self.count = 0
+      # Lines of the current station not written yet and where the station starts in the output
+      self.pending = []
+      self.stationStart = rp.tell()
+
+   def Feed(self, nodes, coordX, coordY):
+      if self.prev is None:
+         self.prev = (nodes[:1], coordX[:1], coordY[:1])
+         nodes, coordX, coordY = nodes[1:], coordX[1:], coordY[1:]
+
+      allNodes = np.concatenate((self.prev[0], nodes))
+      allX = np.concatenate((self.prev[1], coordX))
+      allY = np.concatenate((self.prev[2], coordY))
+      moved = (allX[1:] != allX[:-1]) | (allY[1:] != allY[:-1])
+      changed = np.flatnonzero(allNodes[1:] != allNodes[:-1])
+      self.prev = (allNodes[-1:], allX[-1:], allY[-1:])
+
+      # every time a new node appears, increase the node number, and reset the timer
+      start = 0
+      for end in changed.tolist():
+         self.Write(coordX[start:end + 1][moved[start:end + 1]], coordY[start:end + 1][moved[start:end + 1]])
+         self.NextStation()
+         start = end + 1
+      self.Write(coordX[start:][moved[start:]], coordY[start:][moved[start:]])
+
+   # only the useful will be transformed for cooja dimensions (default: 150X150)
+   def Write(self, coordX, coordY):
+      if not len(coordX):
+         return
+      times = np.round((self.count + np.arange(len(coordX))) * 0.2, 1)
+      coordX = ((coordX - self.x_min + 0.000001) / self.x_diff) * self.new_dimen_x
+      coordY = ((coordY - self.y_min + 0.000001) / self.y_diff) * self.new_dimen_y
+      station = str(self.nodeIterator) + ' '
+      self.pending.append(''.join(station + str(t) + ' ' + str(x) + ' ' + str(y) + "\n"
+                                  for t, x, y in zip(times.tolist(), coordX.tolist(), coordY.tolist())).encode())
+      self.count += len(coordX)
+
+      # The station will be kept, write what is pending
+      if self.count > MIN_POSITIONS:
+         self.rp.write(b''.join(self.pending))
+         self.pending = []
+
+   def NextStation(self):
+      print('station counter: ',self.nodeIterator,'Final time counter: ', round(self.count * 0.2, 1))
+      if self.count > MIN_POSITIONS:
+         # only increase the node number if succesfuly inserted a node inot file
+         self.nodeIterator += 1
+         print('node increased: ',self.nodeIterator)
+
+      self.pending = []
+      self.count = 0
+      self.stationStart = self.rp.tell()
+
+   # The last station is never written, remove what was already written of it
+   def Close(self):
+      self.pending = []
+      self.rp.truncate(self.stationStart)
+
+
+###############################################################################
+
+if __name__ == '__main__':
+   args = ParseCommandLine()
+
+   if traceFormat.IsTrace(args.inFile):
+      trace = traceFormat.Trace(args.inFile)
+      bounds = args.bounds or trace.bounds
+      chunks = TraceChunks(trace)
+   elif args.bounds:
+      bounds = args.bounds
+      chunks = ReadChunks(args.inFile)
+   elif os.path.getsize(args.inFile) <= IN_MEMORY_LIMIT:
+      chunks = list(ReadChunks(args.inFile))
+      bounds = FindBounds(chunks)
+   else:
+      bounds = FindBounds(ReadChunks(args.inFile))
+      chunks = ReadChunks(args.inFile)
 
+   cnt = 0
+   with open(args.outFile, 'wb', buffering = 1024 * 1024) as rp:
+      writer = CoojaWriter(rp, bounds, args.canvas)
+      for nodes, coordX, coordY in chunks:
+         cnt += len(nodes)
+         writer.Feed(nodes, coordX, coordY)
+      writer.Close()
+
+   print('total lines:', str(cnt))
@@ -1,19 +1,23 @@
 #!/usr/bin/python3
 
-from cassandra.cluster import Cluster
-from cassandra.auth import PlainTextAuthProvider
 from calendar import timegm
 from time import struct_time, strftime, gmtime
 from dateutil.relativedelta import relativedelta
 from datetime import datetime
 import argparse
 import sys
-from pyproj import Proj
-import requests
+import resourceInventory
 import math
+import monroeFetch
+import monroeCache
+import miningPipeline
+import monroeSchema
 import os
 
 
+# Columns written by this script (see monroeSchema.py)
+OUTPUT_SCHEMA = ('node', 'time', 'x', 'y', 'gpsRows', 'avgRtt', 'avgRssi', 'rttRows', 'rssiRows')
+
 ###############################################################################
 
 def ParseCommandLine():
@@ -29,6 +33,10 @@ def ParseCommandLine():
                         required=True)
     parser.add_argument('-k', '--privateKey', help='Path to the private key used for server authentication',
                         required=True)
+    monroeCache.AddFetchArguments(parser)
+    resourceInventory.AddInventoryArguments(parser)
+    parser.add_argument('--workers', help='Number of processes projecting and aggregating the nodes in parallel '
+                                          '(default = 1)', required=False, default=1, type=int)
     args = parser.parse_args()
 
     # Validate args
@@ -54,213 +62,109 @@ def ParseCommandLine():
 
 
 ###############################################################################
-# Find UTM zone from long/lat as per
-# https://en.wikipedia.org/wiki/Universal_Transverse_Mercator_coordinate_system#/media/File:Modified_UTM_Zones.png
 
-def FindUtmZone(longitude, latitude):
-    if longitude <= -12 or longitude > 42 or latitude <= 0 or latitude > 72:
-        sys.exit("Long = {}, lat = {}. Make sure -12 <= longitude <= 42 and 0 <= latitude <= 72!".format(longitude,
-                                                                                                         latitude))
+if __name__ == '__main__':
+    args = ParseCommandLine()
 
-    if longitude >= 3 and longitude <= 12 and latitude >= 56 and latitude <= 64:
-        return 32
+    # Get the node inventory (saved locally and revalidated with the scheduler, see resourceInventory.py)
+    inventory = resourceInventory.LoadInventory((args.certificate, args.privateKey), args.inventoryTtl)
 
-    runLongitude = -6
-    for x in range(0, 7):
-        if longitude <= runLongitude:
-            return x + 29
-        runLongitude += 6
+    # Make the connection to the database (and/or open the local cache)
+    cluster, fetcher = monroeCache.OpenFetcher(args)
 
+    # Start the combining algorithm at the immediately higher multiple of 5
+    step = args.interval
+    initialTime = step * (args.startTimeStamp / step + 1)
 
-###############################################################################
+    # Skip nodes that do not belong to the selected product and nodes that are not in the deployed or testing state
+    resources = inventory.Nodes(args.project, ('deployed', 'testing'))
 
-if __name__ == '__main__':
-    args = ParseCommandLine()
+    # Retrieve only the tables needed by the output schema: GPS data of all nodes, then RTT and RSSI data of the
+    # interfaces of the nodes with GPS data
+    try:
+        _, gpsByNode, pingByInterface, metaByInterface = monroeSchema.FetchTables(
+            fetcher, resources, OUTPUT_SCHEMA, args.startTimeStamp, args.endTimeStamp)
+    except monroeFetch.FetchError as e:
+        sys.exit(str(e))
+    fetcher.PrintStats()
 
-    # write results to a file
+    # write results to a file (only once all rows are fetched, so that a failed run keeps the previous file)
     writeFileName = str(args.startTime) + "_" + str(args.endTime) + "_" + str(args.project) + "_intrvl_" + str(
         args.interval)
     print("writing to file: ./" + str(writeFileName))
     writeFile = open("./" + writeFileName, "w+")
 
-    # Make the request to the resources api
-    # response = requests.get('https://scheduler.monroe-system.eu/v1/resources', cert=('/home/dimitris/monroe/certificate.pem', '/home/dimitris/monroe/privateKeyClear.pem'))
-
-    response = requests.get('https://scheduler.monroe-system.eu/v1/resources', cert=(args.certificate, args.privateKey))
-
-    # In case of error print the error and exit
-    if response.status_code != 200:
-        # This means something went wrong.
-        print('GET /v1/resources {}'.format(response.status_code))
-        print('Response Headers: {}'.format(response.headers))
-        sys.exit()
-
-    # Make the connection to the database
-    authProvider = PlainTextAuthProvider(username='monroedb', password='monroedb_pass')
-    cluster = Cluster(['127.0.0.1'], 9042, auth_provider=authProvider, connect_timeout=15)
-    session = cluster.connect('monroe')
-
-    # Start the combining algorithm at the immediately higher multiple of 5
-    step = args.interval
-    initialTime = step * (args.startTimeStamp / step + 1)
+    # Project and aggregate the nodes with GPS data, in parallel with more than one worker (results come in node order)
+    processed = miningPipeline.ProcessNodes(miningPipeline.NodeTasks(resources, gpsByNode, pingByInterface,
+                                                                     metaByInterface, initialTime, args.endTimeStamp,
+                                                                     step), args.workers)
 
     # Iterate over the nodes (each resource is a node)
-    for resource in response.json():
+    for resource in resources:
         # print('{} {}'.format(resource['id'], resource['project']))
 
-        # Skip nodes that do not belong to the selected product and nodes that are not in the deployed or testing state
-        if resource['project'] != args.project or (resource['type'] != 'deployed' and resource['type'] != 'testing'):
-            continue
-
-        # Retrieve the GPS data and check if any rows are returned
-        gpsRows = session.execute(
-            "SELECT nodeid, timestamp, latitude, longitude FROM monroe_meta_device_gps WHERE nodeid = '" + str(
-                resource['id']) + "' AND timestamp >= " + str(args.startTimeStamp) + " AND timestamp <= " + str(
-                args.endTimeStamp) + " ALLOW FILTERING", timeout=20000)
-        if not gpsRows:
+        # Check if any GPS rows are returned
+        gps = gpsByNode[(str(resource['id']),)]
+        if not len(gps['timestamp']):
             print("Node: {}, Type: {}, No GPS data.".format(str(resource['id']), str(resource['type'])))
             continue
 
         else:
             print("Node: {}, Type: {}, GPS data exists. Interfaces {}".format(str(resource['id']), str(resource['type']), str(len(resource['interfaces'])) ))
 
-        # Create an iterator out of the returns rows and grab the first row
-        gpsIterator = iter(gpsRows)
-        gpsRowsFinished = False
-        try:  # Grab initial row
-            gpsRow = gpsIterator.next()
-        except Exception:
-            gpsRowsFinished = True
-
-        interfacesMap = {}  # Initialize a map to store each interface values
-
-        # Iterate over all interfaces of the node
-        for interface in resource['interfaces']:
-            iccid = interface['iccid']
-
-            # Initialize a map for the current interface that will hold the interface-related variables
-            interfacesMap[iccid] = {}
-            interfacesMap[iccid]["pingRowsFinished"], interfacesMap[iccid]["metaRowsFinished"] = False, False
-            interfacesMap[iccid]["avgRtt"], interfacesMap[iccid]["avgRssi"] = 0, 0
-
-            # Retrieve the RTT rows and grab the first row
-            interfacesMap[iccid]["pingRows"] = session.execute(
-                "SELECT nodeid, iccid, timestamp, rtt FROM monroe_exp_ping WHERE nodeid = '" + str(
-                    resource['id']) + "' AND iccid = '" + str(interface['iccid']) + "' AND timestamp >= " + str(
-                    args.startTimeStamp) + " AND timestamp <= " + str(args.endTimeStamp) + " ALLOW FILTERING",
-                timeout=20000)
-            interfacesMap[iccid]["pingIterator"] = iter(interfacesMap[iccid]["pingRows"])
-            try:
-                interfacesMap[iccid]["pingRow"] = interfacesMap[iccid]["pingIterator"].next()
-            except Exception:
-                interfacesMap[iccid]["pingRowsFinished"] = True
-
-            # Retrieve the RSSI rows and grab the first row
-            interfacesMap[iccid]["metaRows"] = session.execute(
-                "SELECT nodeid, iccid, timestamp, rssi FROM monroe_meta_device_modem WHERE nodeid = '" + str(
-                    resource['id']) + "' AND iccid = '" + str(interface['iccid']) + "' AND timestamp >= " + str(
-                    args.startTimeStamp) + " AND timestamp <= " + str(args.endTimeStamp) + " ALLOW FILTERING",
-                timeout=20000)
-            interfacesMap[iccid]["metaIterator"] = iter(interfacesMap[iccid]["metaRows"])
-            try:
-                interfacesMap[iccid]["metaRow"] = interfacesMap[iccid]["metaIterator"].next()
-            except Exception:
-                interfacesMap[iccid]["metaRowsFinished"] = True
-
-        # Initialize the running time to the initial time. At the end of each iteration of the while loop below the
-        # running time will be advances by 5
-        runningTime = initialTime
-
-
-
-        while runningTime <= args.endTimeStamp:
-            # Advance through the gps values and find the last position prior to the running time
-            # print("gpsRowsFinished: {}, gpsRow.timestamp: {:f}, gpsRow.runningTime: {:f}".format(str(gpsRowsFinished), gpsRow.timestamp, runningTime) )
-            while not gpsRowsFinished and gpsRow.timestamp <= runningTime:
-                try:
-                    utmZone = FindUtmZone(gpsRow.longitude, gpsRow.latitude)
-                    p = Proj(proj='utm', zone=utmZone, ellps='WGS84')  # use kwargs
-                    x, y = p(gpsRow.longitude, gpsRow.latitude)
-
-                    # Print the row for verification purposes
-                    if args.verbose:
-                       print ( "node: {} GPS, time: {:f}, zone: {}, x: {:f}, y: {:f} ".format(gpsRow.nodeid, gpsRow.timestamp, utmZone, x, y) )
-
-                    gpsRow = gpsIterator.next()
-                except Exception:
-                    gpsRowsFinished = True
-                    break
-
-            # Loop on the interfaces of this resource (Ping experiment and meta data are reported per iccid)
-            for interface in resource['interfaces']:
-                iccid = interface['iccid']
-                interfacesMap[iccid]["totalRtt"], interfacesMap[iccid]["numOfRttValues"] = 0, 0
-
-                while not interfacesMap[iccid]["pingRowsFinished"] and interfacesMap[iccid][
-                    "pingRow"].timestamp <= runningTime:
-                    # print("interfacesMap[iccid][pingRowsFinished]: {}, interfacesMap[iccid][pingRow].timestamp: {:f}, runningTime: {:f}".format(interfacesMap[iccid]["pingRowsFinished"], interfacesMap[iccid]["pingRow"].timestamp, runningTime) )
-                    try:
-                        if interfacesMap[iccid]["pingRow"].rtt is not None:
-                            interfacesMap[iccid]["totalRtt"] += interfacesMap[iccid]["pingRow"].rtt
-                            interfacesMap[iccid]["numOfRttValues"] += 1
-
-                            # Print the row for verification purposes
-                            if args.verbose:
-                                print ( "node: {} RTT, iccid: {}, time: {:f}, rtt: {:f}".format(str(interfacesMap[iccid]["pingRow"].nodeid), str(interfacesMap[iccid]["pingRow"].iccid), interfacesMap[iccid]["pingRow"].timestamp, interfacesMap[iccid]["pingRow"].rtt) )
-
-                        interfacesMap[iccid]["pingRow"] = interfacesMap[iccid]["pingIterator"].next()
-                    except Exception:
-                        break
-
-                interfacesMap[iccid]["totalRssi"], interfacesMap[iccid]["numOfRssiValues"] = 0, 0
-                while not interfacesMap[iccid]["metaRowsFinished"] and interfacesMap[iccid][
-                    "metaRow"].timestamp <= runningTime:
-                    try:
-                        if interfacesMap[iccid]["metaRow"].rssi is not None:
-                            interfacesMap[iccid]["totalRssi"] += interfacesMap[iccid]["metaRow"].rssi
-                            interfacesMap[iccid]["numOfRssiValues"] += 1
-
-                            # Print the row for verification purposes
-                            if args.verbose:
-                                print ( "node: {} RSSI, iccid: {}, time: {:f}, rssi: {:f}".format(interfacesMap[iccid]["metaRow"].nodeid, interfacesMap[iccid]["metaRow"].iccid, interfacesMap[iccid]["metaRow"].timestamp, interfacesMap[iccid]["metaRow"].rssi))
-
-                        interfacesMap[iccid]["metaRow"] = interfacesMap[iccid]["metaIterator"].next()
-                    except Exception:
-                        break
-
-            # Print the final results
-            #print("node: {}, time: {:f}, x: {:f}, y: {:f} ".format(resource['id'], runningTime, x, y), end='')
-
-            line2write = "node: {} RSSI, iccid: {}, time: {:f}, rssi: {:f}".format(interfacesMap[iccid]["metaRow"].nodeid,
-                                                                            interfacesMap[iccid]["metaRow"].iccid,
-                                                                            interfacesMap[iccid]["metaRow"].timestamp,
-                                                                            interfacesMap[iccid]["metaRow"].rssi)
+        # Projected GPS fixes and rows aggregated for all running times. The running time starts at the initial time and
+        # is advanced by the user-defined step (default = 5)
+        gps, trace = next(processed)
+        interfacesMap = miningPipeline.InterfacesMap(resource, pingByInterface, metaByInterface)
 
-            #line2write = "node: {}, time: {:f}, x: {:f}, y: {:f} ".format(resource['id'], runningTime, x, y)
+        gpsRowStart = 0
+        rowStarts = dict((interface['iccid'], [0, 0]) for interface in resource['interfaces'])
 
+        for bucket, runningTime in enumerate(trace['time'].tolist()):
+            # Print the rows aggregated in this bucket for verification purposes
+            if args.verbose:
+                for row in range(gpsRowStart, trace['gpsIndex'][bucket] + 1):
+                    print ( "node: {} GPS, time: {:f}, zone: {}, x: {:f}, y: {:f} ".format(resource['id'], gps['timestamp'][row], gps['zone'][row], gps['x'][row], gps['y'][row]) )
+                gpsRowStart = max(gpsRowStart, trace['gpsIndex'][bucket] + 1)
+
+                for interface in resource['interfaces']:
+                    iccid = interface['iccid']
+                    ping, meta, aggregated = interfacesMap[iccid]['ping'], interfacesMap[iccid]['modem'], trace['interfaces'][iccid]
+                    for row in range(rowStarts[iccid][0], aggregated['rttRowEnd'][bucket]):
+                        if not math.isnan(ping['rtt'][row]):
+                            print ( "node: {} RTT, iccid: {}, time: {:f}, rtt: {:f}".format(resource['id'], iccid, ping['timestamp'][row], ping['rtt'][row]) )
+                    for row in range(rowStarts[iccid][1], aggregated['rssiRowEnd'][bucket]):
+                        if not math.isnan(meta['rssi'][row]):
+                            print ( "node: {} RSSI, iccid: {}, time: {:f}, rssi: {:f}".format(resource['id'], iccid, meta['timestamp'][row], meta['rssi'][row]))
+                    rowStarts[iccid] = [aggregated['rttRowEnd'][bucket], aggregated['rssiRowEnd'][bucket]]
 
-            print(line2write)
-            writeFile.write(line2write)#+os.linesep)#+'\n')
-            #writeFile.write("\n")
+            # Print the final results
+            #print("node: {}, time: {:f}, x: {:f}, y: {:f} ".format(resource['id'], runningTime, x, y), end='')
 
+            # The RSSI row following this bucket (or the last one) of the last interface of the node
+            iccid = resource['interfaces'][-1]['iccid'] if resource['interfaces'] else None
+            if iccid is not None and len(interfacesMap[iccid]['modem']['timestamp']):
+                meta = interfacesMap[iccid]['modem']
+                row = min(trace['interfaces'][iccid]['rssiRowEnd'][bucket], len(meta['timestamp']) - 1)
+                line2write = "node: {} RSSI, iccid: {}, time: {:f}, rssi: {:f}".format(resource['id'], iccid,
+                                                                                meta['timestamp'][row],
+                                                                                meta['rssi'][row])
 
+                #line2write = "node: {}, time: {:f}, x: {:f}, y: {:f} ".format(resource['id'], runningTime, x, y)
 
 
+                print(line2write)
+                writeFile.write(line2write)#+os.linesep)#+'\n')
+                #writeFile.write("\n")
 
             for interface in resource['interfaces']:
                 iccid = interface['iccid']
+                aggregated = trace['interfaces'][iccid]
 
-                if interfacesMap[iccid]["numOfRttValues"] > 0:
-                    interfacesMap[iccid]["avgRtt"] = interfacesMap[iccid]["totalRtt"] / interfacesMap[iccid][
-                        "numOfRttValues"]
+                if aggregated["numOfRssiValues"][bucket] > 0:
+                    #print(", {} rtt: {:f} ({:d} items), {} rssi: {:f} ({:d} items)".format(iccid, aggregated["avgRtt"][bucket], aggregated["numOfRttValues"][bucket], iccid, aggregated["avgRssi"][bucket], aggregated["numOfRssiValues"][bucket]), end='')
 
-                if interfacesMap[iccid]["numOfRssiValues"] > 0:
-                    interfacesMap[iccid]["avgRssi"] = interfacesMap[iccid]["totalRssi"] / interfacesMap[iccid][
-                        "numOfRssiValues"]
-
-                    #print(", {} rtt: {:f} ({:d} items), {} rssi: {:f} ({:d} items)".format(iccid, interfacesMap[iccid]["avgRtt"], interfacesMap[iccid]["numOfRttValues"], iccid, interfacesMap[iccid]["avgRssi"], interfacesMap[iccid]["numOfRssiValues"]), end='')
-
-                    line2write =", {} rtt: {:f} ({:d} items), {} rssi: {:f} ({:d} items)".format(iccid, interfacesMap[iccid]["avgRtt"], interfacesMap[iccid]["numOfRttValues"], iccid, interfacesMap[iccid]["avgRssi"], interfacesMap[iccid]["numOfRssiValues"])#, end=''
+                    line2write =", {} rtt: {:f} ({:d} items), {} rssi: {:f} ({:d} items)".format(iccid, aggregated["avgRtt"][bucket], aggregated["numOfRttValues"][bucket], iccid, aggregated["avgRssi"][bucket], aggregated["numOfRssiValues"][bucket])#, end=''
 
                     print(line2write)
                     writeFile.write(line2write)#+os.linesep)#+'\n')
@@ -270,10 +174,7 @@ if __name__ == '__main__':
             if args.verbose:
                 print("---" + str(runningTime) + "-----")
 
-            runningTime += step
-            # sys.exit()
-
-
 
-    cluster.shutdown
 
+    if cluster is not None:
+        cluster.shutdown()
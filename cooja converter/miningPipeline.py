@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+# Per-node processing of the fetch scripts on a process pool.
+#
+# Apart from the overall bounding box, nodes are independent: a worker projects the GPS fixes of a node and aggregates
+# its rows into time buckets (utmProjection.py, timeBuckets.py). The bucketed trace carries the bounding box of the
+# node, which the parent merges. Results are returned in node order, so the output does not depend on the number of
+# workers.
+
+import multiprocessing
+import utmProjection
+import timeBuckets
+
+
+###############################################################################
+# RTT and RSSI columns of every interface of a node, of the tables that were fetched (see monroeSchema.py)
+
+def InterfacesMap(resource, pingByInterface, metaByInterface):
+    interfacesMap = {}
+    for interface in resource['interfaces']:
+        key = (str(resource['id']), str(interface['iccid']))
+        interfacesMap[interface['iccid']] = dict((table, byInterface[key]) for table, byInterface in
+                                                 (('ping', pingByInterface), ('modem', metaByInterface))
+                                                 if key in byInterface)
+    return interfacesMap
+
+
+# One task per node with GPS data, in node order
+def NodeTasks(resources, gpsByNode, pingByInterface, metaByInterface, initialTime, endTimeStamp, step):
+    tasks = []
+    for resource in resources:
+        gps = gpsByNode[(str(resource['id']),)]
+        if len(gps['timestamp']):
+            tasks.append((gps, InterfacesMap(resource, pingByInterface, metaByInterface), initialTime, endTimeStamp,
+                          step))
+    return tasks
+
+
+###############################################################################
+# Project all GPS fixes of the node at once (one call per UTM zone) and aggregate the rows for all running times.
+# Returns the GPS columns (with 'x', 'y', 'zone' added) and the bucketed trace.
+
+def ProcessNode(task):
+    gps, interfacesMap, initialTime, endTimeStamp, step = task
+    gps['x'], gps['y'], gps['zone'] = utmProjection.ProjectToUtm(gps['longitude'], gps['latitude'])
+    return gps, timeBuckets.AggregateNode(gps, interfacesMap, initialTime, endTimeStamp, step)
+
+
+# Yields the (gps, trace) of every task in task order. With more than one worker the nodes are processed on a pool
+# while the caller consumes the results. The workers are spawned rather than forked since the parent runs the threads
+# of the Cassandra driver.
+def ProcessNodes(tasks, workers=1):
+    if workers <= 1:
+        for task in tasks:
+            yield ProcessNode(task)
+        return
+
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        for result in pool.imap(ProcessNode, tasks):
+            yield result
+
+
+# Merge the (x_min, y_min, x_max, y_max) bounding box of a node (None if it has none) into the overall one
+def MergeBounds(bounds, nodeBounds):
+    if nodeBounds is None:
+        return bounds
+    return (min(bounds[0], nodeBounds[0]), min(bounds[1], nodeBounds[1]), max(bounds[2], nodeBounds[2]),
+            max(bounds[3], nodeBounds[3]))
@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+
+# Local on-disk cache of the MONROE Cassandra tables.
+#
+# Rows are kept as Parquet files, one per table, key (nodeid or nodeid/iccid) and UTC day:
+#     <cacheDir>/<table>/<nodeid>[/<iccid>]/<YYYY-MM-DD>.parquet
+# A day file holds the rows of [day, day + 1 day) and is only written once the day is settled: over for more than the
+# settle delay, since the nodes upload buffered rows late (e.g. after reconnecting). Every file in the cache is then
+# complete (days without rows are cached as empty files), the more recent days are always fetched. Only the days
+# missing from the cache are fetched from Cassandra. The size of the cache is capped by evicting the least recently
+# used day files.
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import numpy as np
+import monroeFetch
+import monroeCheckpoint
+from time import strftime, gmtime
+import os
+import sys
+import time
+
+DAY = 86400
+
+# Default maximum size of the cache in MB
+DEFAULT_CACHE_SIZE = 2048
+
+# Default time in seconds after the end of a day before its rows are considered complete
+DEFAULT_SETTLE_DELAY = 2 * DAY
+
+
+# True if the rows up to endTimeStamp are complete and can be cached
+def IsSettled(endTimeStamp, settleDelay=DEFAULT_SETTLE_DELAY):
+    return endTimeStamp + settleDelay <= time.time()
+
+
+###############################################################################
+# Command line options of the database, the cache and the checkpoint, shared by the scripts (see OpenFetcher)
+
+def AddFetchArguments(parser):
+    parser.add_argument('--concurrency', help='Maximum number of database requests in flight (default = {})'.format(
+        monroeFetch.DEFAULT_CONCURRENCY), required=False, default=monroeFetch.DEFAULT_CONCURRENCY, type=int)
+    parser.add_argument('--sliceLength', help='Split every query into time slices of this many seconds '
+                                              '(default = {})'.format(monroeFetch.DEFAULT_SLICE_LENGTH),
+                        required=False, default=monroeFetch.DEFAULT_SLICE_LENGTH, type=int)
+    parser.add_argument('--cacheDir', help='Directory of the local table cache, consulted before the database '
+                                           '(default = no cache)', required=False)
+    parser.add_argument('--cacheSize', help='Maximum size of the cache in MB (default = {})'.format(DEFAULT_CACHE_SIZE),
+                        required=False, default=DEFAULT_CACHE_SIZE, type=int)
+    parser.add_argument('--settleDelay', help='Only cache the days that ended more than this many seconds ago, the '
+                                              'more recent ones can still get rows (default = {})'.format(
+                                                  DEFAULT_SETTLE_DELAY),
+                        required=False, default=DEFAULT_SETTLE_DELAY, type=int)
+    parser.add_argument('--offline', help='Use the cache only, do not connect to the database', required=False,
+                        action="store_true")
+    parser.add_argument('--checkpointDir', help='Directory of the checkpoint of the queries: an interrupted run '
+                                                 'resumes from it (default = no checkpoint)', required=False)
+    parser.add_argument('--fetchSize', help='Rows per page of the query results (default = {})'.format(
+        monroeFetch.DEFAULT_FETCH_SIZE), required=False, default=monroeFetch.DEFAULT_FETCH_SIZE, type=int)
+    parser.add_argument('--pageBudget', help='Maximum number of result pages fetched or waiting to be converted at '
+                                              'the same time (default = {})'.format(monroeFetch.DEFAULT_PAGE_BUDGET),
+                        required=False, default=monroeFetch.DEFAULT_PAGE_BUDGET, type=int)
+
+
+###############################################################################
+# Connect to the database and/or open the cache with the options of AddFetchArguments. Returns (cluster, fetcher),
+# cluster is None in offline mode. Without a cache directory the fetcher goes directly to the database. With a
+# checkpoint directory the database is queried in resumable units (see monroeCheckpoint.py).
+
+def OpenFetcher(args):
+    if args.offline and args.cacheDir is None:
+        sys.exit("Offline mode needs a cache directory (--cacheDir)")
+
+    cluster, fetcher = None, None
+    if not args.offline:
+        cluster, session = monroeFetch.ConnectMonroe()
+        fetcher = monroeFetch.MonroeFetcher(session, args.concurrency, args.sliceLength, fetchSize=args.fetchSize,
+                                             pageBudget=args.pageBudget)
+        if args.checkpointDir is not None:
+            fetcher = monroeCheckpoint.CheckpointedFetcher(fetcher, args.checkpointDir)
+
+    if args.cacheDir is None:
+        return cluster, fetcher
+    return cluster, MonroeCache(fetcher, args.cacheDir, args.cacheSize, args.settleDelay)
+
+
+###############################################################################
+
+class MonroeCache:
+    # fetcher is the MonroeFetcher used for the missing days (None = offline, nothing is fetched)
+    def __init__(self, fetcher, cacheDir, cacheSize=DEFAULT_CACHE_SIZE, settleDelay=DEFAULT_SETTLE_DELAY):
+        self.fetcher = fetcher
+        self.cacheDir = cacheDir
+        self.maxBytes = cacheSize * 1024 * 1024
+        self.settleDelay = settleDelay
+
+        # Bytes of the day files, counted when the first day file is written and then kept up to date
+        self.size = None
+
+        # Day files read from / fetched into the cache per table
+        self.stats = {}
+
+    def DayPath(self, tableName, key, day):
+        return os.path.join(self.cacheDir, monroeFetch.TABLES[tableName]['table'], *key) + os.sep + \
+            strftime("%Y-%m-%d", gmtime(day)) + ".parquet"
+
+    # Same as MonroeFetcher.Fetch: returns a dict key -> columns of the rows in [startTimeStamp, endTimeStamp]
+    def Fetch(self, tableName, keys, startTimeStamp, endTimeStamp):
+        keys = [tuple(str(value) for value in key) for key in keys]
+
+        # Per key, the columns of every day in order. Missing days are None until fetched.
+        pieces = dict((key, []) for key in keys)
+        ranges = []
+        owners = []
+        read = 0
+        for key in keys:
+            day = (startTimeStamp // DAY) * DAY
+            while day <= endTimeStamp:
+                path = self.DayPath(tableName, key, day)
+                if not IsSettled(day + DAY, self.settleDelay):
+                    # The day (and the following ones) can still get rows, only fetch the requested part and do not
+                    # cache it
+                    ranges.append((key, max(startTimeStamp, day), endTimeStamp, True))
+                    owners.append((key, len(pieces[key]), None))
+                    pieces[key].append(None)
+                    break
+
+                if os.path.exists(path):
+                    pieces[key].append(self.ReadDay(tableName, path))
+                    read += 1
+                else:
+                    ranges.append((key, day, day + DAY, False))
+                    owners.append((key, len(pieces[key]), path))
+                    pieces[key].append(None)
+                day += DAY
+
+        if ranges:
+            if self.fetcher is None:
+                sys.exit("{} day(s) of {} are not in the cache {} (offline mode)".format(
+                    len(ranges), monroeFetch.TABLES[tableName]['table'], self.cacheDir))
+
+            for (key, index, path), columns in zip(owners, self.fetcher.FetchRanges(tableName, ranges)):
+                if path is not None:
+                    self.WriteDay(path, columns)
+                pieces[key][index] = columns
+
+        days, fetched = self.stats.get(tableName, (0, 0))
+        self.stats[tableName] = (days + read, fetched + sum(1 for owner in owners if owner[2] is not None))
+        self.Evict()
+
+        # Concatenate the days of every key and keep the requested range only
+        columns = monroeFetch.ValueColumns(tableName)
+        result = {}
+        for key in keys:
+            merged = dict((column, np.concatenate([piece[column] for piece in pieces[key]])) for column in columns)
+            inRange = (merged['timestamp'] >= startTimeStamp) & (merged['timestamp'] <= endTimeStamp)
+            result[key] = dict((column, values[inRange]) for column, values in merged.items())
+        return result
+
+    def ReadDay(self, tableName, path):
+        table = pq.read_table(path)
+        # Mark the file as recently used for the eviction
+        os.utime(path)
+        return dict((column, np.asarray(table.column(column).to_numpy(), dtype=float))
+                    for column in monroeFetch.ValueColumns(tableName))
+
+    # Write a day file atomically, so that an interrupted run never leaves a partial day behind
+    def WriteDay(self, path, columns):
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.DayFiles())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pa.table(dict((column, pa.array(values, type=pa.float64())) for column, values in columns.items()))
+        pq.write_table(table, path + ".tmp")
+        if os.path.exists(path):
+            self.size -= os.path.getsize(path)
+        os.replace(path + ".tmp", path)
+        self.size += os.path.getsize(path)
+
+    # (last use, size, path) of every day file of the cache
+    def DayFiles(self):
+        files = []
+        for directory, _, names in os.walk(self.cacheDir):
+            for name in names:
+                if name.endswith(".parquet"):
+                    path = os.path.join(directory, name)
+                    status = os.stat(path)
+                    files.append((status.st_mtime, status.st_size, path))
+        return files
+
+    # Remove the least recently used day files until the cache fits in its maximum size. The cache is only walked
+    # when the day files written by this run made it grow beyond the maximum size.
+    def Evict(self):
+        if self.size is None or self.size <= self.maxBytes:
+            return
+        files = self.DayFiles()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.maxBytes:
+                break
+            os.remove(path)
+            total -= size
+        self.size = total
+
+    def PrintStats(self):
+        if self.fetcher is not None:
+            self.fetcher.PrintStats()
+        for tableName, (read, fetched) in sorted(self.stats.items()):
+            print("{} cache: {} day files read, {} day files fetched".format(monroeFetch.TABLES[tableName]['table'],
+                                                                             read, fetched))
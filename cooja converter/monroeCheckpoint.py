@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+
+# Checkpointed, resumable fetching of the MONROE Cassandra tables.
+#
+# The requested ranges are fetched as units (table, key, time slice). Every completed unit is saved in the checkpoint
+# directory and recorded in its manifest:
+#     <checkpointDir>/manifest.jsonl                                  one line per completed unit
+#     <checkpointDir>/<table>/<nodeid>[/<iccid>]/<start>_<end>[c].npz  the columns of the unit (c = end included)
+# Running the same command again with the same checkpoint directory only fetches what is not in the manifest yet, so
+# an interrupted run (timeout, lost SSH tunnel) never redoes finished work.
+#
+# The slice length adapts to the database: a unit whose query times out is split in two and retried, and the slices
+# of the following units are halved; when a whole round of queries is fast the slices are doubled.
+
+from cassandra import OperationTimedOut, ReadTimeout, ReadFailure
+import numpy as np
+import monroeFetch
+import json
+import os
+import time
+
+# Bounds of the adaptive slice length in seconds (the initial one is the slice length of the fetcher)
+MIN_SLICE_LENGTH = 600
+MAX_SLICE_LENGTH = 30 * 86400
+
+# Slices grow when a round of queries took less than this many seconds
+FAST_ROUND = 10.0
+
+# Timeout of a single request in seconds. Slow units are split instead of waiting for hours.
+DEFAULT_TIMEOUT = 600
+
+# Times a unit of MIN_SLICE_LENGTH is retried after a timeout before giving up
+MAX_RETRIES = 3
+
+TIMEOUTS = (OperationTimedOut, ReadTimeout, ReadFailure)
+
+
+###############################################################################
+# Parts of [startTimeStamp, endTimeStamp] (closed: end included) not covered by the completed units, as a list of
+# (start, end, closed). units is a list of (start, end, closed) of the completed units of the key.
+
+def MissingRanges(startTimeStamp, endTimeStamp, closed, units):
+    missing = []
+    cursor = startTimeStamp
+    endDone = False
+    for unitStart, unitEnd, unitClosed in sorted(units):
+        if unitEnd < startTimeStamp or unitStart > endTimeStamp:
+            continue
+        if unitStart > cursor:
+            missing.append((cursor, min(unitStart, endTimeStamp), False))
+        cursor = max(cursor, unitEnd)
+        if unitEnd > endTimeStamp or (unitEnd == endTimeStamp and unitClosed):
+            endDone = True
+    if cursor < endTimeStamp:
+        missing.append((cursor, endTimeStamp, closed))
+    elif closed and not endDone:
+        # Only the rows at the end of the range itself are missing
+        missing.append((endTimeStamp, endTimeStamp, True))
+    return missing
+
+
+###############################################################################
+
+class CheckpointedFetcher:
+    # fetcher is the MonroeFetcher that runs the queries
+    def __init__(self, fetcher, checkpointDir, timeout=DEFAULT_TIMEOUT):
+        self.fetcher = fetcher
+        self.checkpointDir = checkpointDir
+        self.sliceLength = fetcher.sliceLength
+        fetcher.session.default_timeout = timeout
+
+        # (table, key) -> [(start, end, closed)] of the completed units
+        self.done = {}
+        self.manifest = os.path.join(checkpointDir, "manifest.jsonl")
+        os.makedirs(checkpointDir, exist_ok=True)
+        if os.path.exists(self.manifest):
+            with open(self.manifest) as f:
+                for line in f:
+                    try:
+                        unit = json.loads(line)
+                    except ValueError:
+                        continue  # Line cut by an interrupted run, the unit is fetched again
+                    key = tuple(unit['key'])
+                    if os.path.exists(self.UnitPath(unit['table'], key, unit['start'], unit['end'], unit['closed'])):
+                        self.done.setdefault((unit['table'], key), []).append(
+                            (unit['start'], unit['end'], unit['closed']))
+
+        # Units resumed from / fetched into the checkpoint per table, and the number of timeouts
+        self.stats = {}
+        self.timeouts = 0
+
+    def UnitPath(self, tableName, key, start, end, closed):
+        return os.path.join(self.checkpointDir, monroeFetch.TABLES[tableName]['table'], *key) + os.sep + \
+            "{}_{}{}.npz".format(start, end, "c" if closed else "")
+
+    # Same as MonroeFetcher.Fetch
+    def Fetch(self, tableName, keys, startTimeStamp, endTimeStamp):
+        keys = [tuple(str(value) for value in key) for key in keys]
+        columns = self.FetchRanges(tableName, [(key, startTimeStamp, endTimeStamp, True) for key in keys])
+        return dict(zip(keys, columns))
+
+    # Same as MonroeFetcher.FetchRanges: fetches the units missing from the checkpoint, then returns the columns of
+    # every range from the saved units
+    def FetchRanges(self, tableName, ranges):
+        ranges = [(tuple(str(value) for value in key), start, end, closed) for key, start, end, closed in ranges]
+
+        pending = []
+        for key, startTimeStamp, endTimeStamp, closed in ranges:
+            for missing in MissingRanges(startTimeStamp, endTimeStamp, closed, self.done.get((tableName, key), [])):
+                pending.append((key,) + missing)
+        resumed = sum(len(self.done.get((tableName, key), [])) for key in set(key for key, _, _, _ in ranges))
+        fetched = self.FetchUnits(tableName, pending)
+
+        units, fetchedBefore = self.stats.get(tableName, (0, 0))
+        self.stats[tableName] = (units + resumed, fetchedBefore + fetched)
+
+        return [self.Load(tableName, key, startTimeStamp, endTimeStamp, closed)
+                for key, startTimeStamp, endTimeStamp, closed in ranges]
+
+    # Fetch the pending (key, start, end, closed) ranges in rounds of at most concurrency units, cut with the current
+    # slice length. Returns the number of units fetched.
+    def FetchUnits(self, tableName, pending):
+        spec = monroeFetch.TABLES[tableName]
+        columns = monroeFetch.ValueColumns(tableName)
+        positions = [spec['columns'].index(column) for column in columns]
+        retries = {}
+        fetched = 0
+
+        while pending:
+            # Next units: the first slice of the pending ranges, the rest of a range stays pending
+            units = []
+            while pending and len(units) < self.fetcher.concurrency:
+                key, start, end, closed = pending.pop(0)
+                sliceEnd = (start // self.sliceLength + 1) * self.sliceLength
+                if sliceEnd < end:
+                    units.append((key, start, sliceEnd, False))
+                    pending.insert(0, (key, sliceEnd, end, closed))
+                else:
+                    units.append((key, start, end, closed))
+
+            requests = [(self.fetcher.Statement(tableName, closed), key + (start, end))
+                        for key, start, end, closed in units]
+            started = time.time()
+            pages = [[] for _ in units]
+            errors = {}
+            rows = 0
+            for index, pageRows, error in self.fetcher.Execute(requests):
+                if error is not None:
+                    errors[index] = error
+                else:
+                    page = monroeFetch.RowsToColumns(pageRows, columns, positions)
+                    pages[index].append(page)
+                    rows += len(page['timestamp'])
+
+            # The successful units of the round are saved before a failure is raised, so that a new run resumes them
+            timedOut = False
+            failure = None
+            for index, unit in enumerate(units):
+                key, start, end, closed = unit
+                result = errors.get(index)
+                if result is None:
+                    self.Save(tableName, unit, monroeFetch.ConcatColumns(pages[index], columns))
+                    fetched += 1
+                elif isinstance(result, TIMEOUTS):
+                    timedOut = True
+                    self.timeouts += 1
+                    if end - start > MIN_SLICE_LENGTH:
+                        # Split the unit and retry both halves first
+                        middle = start + (end - start) // 2
+                        pending[:0] = [(key, start, middle, False), (key, middle, end, closed)]
+                    elif retries.get(unit, 0) < MAX_RETRIES:
+                        retries[unit] = retries.get(unit, 0) + 1
+                        pending.insert(0, unit)
+                    elif failure is None:
+                        failure = monroeFetch.FetchError(
+                            "{} query keeps timing out for {} {}-{}, run again to resume from {}".format(
+                                spec['table'], key, start, end, self.checkpointDir), result)
+                elif failure is None:
+                    failure = monroeFetch.FetchError(
+                        "{} query failed for {} {}-{}: {}, run again to resume from {}".format(
+                            spec['table'], key, start, end, result, self.checkpointDir), result)
+
+            seconds = time.time() - started
+            self.fetcher.UpdateStats(tableName, rows, seconds)
+            if failure is not None:
+                raise failure
+            if timedOut:
+                self.sliceLength = max(MIN_SLICE_LENGTH, self.sliceLength // 2)
+            elif seconds < FAST_ROUND:
+                self.sliceLength = min(MAX_SLICE_LENGTH, self.sliceLength * 2)
+
+        return fetched
+
+    # Write the unit file atomically, then record the unit in the manifest
+    def Save(self, tableName, unit, columns):
+        key, start, end, closed = unit
+        path = self.UnitPath(tableName, key, start, end, closed)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", 'wb') as f:
+            np.savez(f, **columns)
+        os.replace(path + ".tmp", path)
+        with open(self.manifest, 'a') as f:
+            f.write(json.dumps({'table': tableName, 'key': list(key), 'start': start, 'end': end,
+                                'closed': closed}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.setdefault((tableName, key), []).append((start, end, closed))
+
+    # Columns of a range from the saved units, in timestamp order
+    def Load(self, tableName, key, startTimeStamp, endTimeStamp, closed):
+        columns = monroeFetch.ValueColumns(tableName)
+        pieces = []
+        closedEnd = None
+        for start, end, unitClosed in sorted(set(self.done.get((tableName, key), []))):
+            if end < startTimeStamp or start > endTimeStamp:
+                continue
+            with np.load(self.UnitPath(tableName, key, start, end, unitClosed)) as unit:
+                piece = dict((column, unit[column]) for column in columns)
+            if start == closedEnd:
+                # The rows at the start of the unit are already in the previous unit, which includes its end
+                after = piece['timestamp'] > start
+                piece = dict((column, values[after]) for column, values in piece.items())
+            pieces.append(piece)
+            closedEnd = end if unitClosed else None
+
+        merged = dict((column, np.concatenate([piece[column] for piece in pieces]) if pieces else np.empty(0))
+                      for column in columns)
+        timestamps = merged['timestamp']
+        inRange = (timestamps >= startTimeStamp) & ((timestamps <= endTimeStamp) if closed
+                                                    else (timestamps < endTimeStamp))
+        return dict((column, values[inRange]) for column, values in merged.items())
+
+    def PrintStats(self):
+        self.fetcher.PrintStats()
+        for tableName, (resumed, fetched) in sorted(self.stats.items()):
+            print("{} checkpoint: {} units resumed, {} units fetched".format(monroeFetch.TABLES[tableName]['table'],
+                                                                            resumed, fetched))
+        print("Checkpoint: {} timeouts, slice length {} s".format(self.timeouts, self.sliceLength))
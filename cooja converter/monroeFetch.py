@@ -0,0 +1,344 @@
+#!/usr/bin/python3
+
+# Shared Cassandra fetch layer for the MONROE mining scripts.
+#
+# Instead of one string-concatenated SELECT per node/interface executed serially, the queries are prepared once
+# and executed concurrently with a bounded number of requests in flight. Long time ranges are split into
+# sub-ranges (slices) so that every request only touches a bounded part of a partition.
+#
+# Results are paged (fetchSize rows per page). The next page of a request is fetched by the driver while the current
+# one is converted to arrays, and at most pageBudget pages of driver rows are fetched or waiting to be converted at any
+# time. The converted arrays of a range are concatenated as soon as all its pages are in, so the memory used is about
+# the size of the result as float columns (plus the page budget), not the size of the rows held by the driver.
+# A failed query raises FetchError, the scripts decide whether to exit.
+#
+# Rows are not returned as named tuples: when the driver has its Cython extensions, every page is decoded by the
+# NumPy protocol handler straight into one typed array per column, otherwise the rows are plain tuples.
+
+from cassandra.cluster import Cluster
+from cassandra.auth import PlainTextAuthProvider
+from cassandra.query import tuple_factory
+from collections import deque
+import numpy as np
+import threading
+import time
+
+try:
+    from cassandra.protocol import NumpyProtocolHandler
+except ImportError:
+    NumpyProtocolHandler = None
+
+# A query that failed (or kept failing), error is the exception of the driver if there is one
+class FetchError(Exception):
+    def __init__(self, message, error=None):
+        Exception.__init__(self, message)
+        self.error = error
+
+
+###############################################################################
+# Tables used by the mining scripts. 'keys' are the columns bound in the WHERE clause next to the time range.
+
+TABLES = {
+    'gps': {
+        'table': 'monroe_meta_device_gps',
+        'columns': ['nodeid', 'timestamp', 'latitude', 'longitude'],
+        'keys': ['nodeid'],
+    },
+    'ping': {
+        'table': 'monroe_exp_ping',
+        'columns': ['nodeid', 'iccid', 'timestamp', 'rtt'],
+        'keys': ['nodeid', 'iccid'],
+    },
+    'modem': {
+        'table': 'monroe_meta_device_modem',
+        'columns': ['nodeid', 'iccid', 'timestamp', 'rssi'],
+        'keys': ['nodeid', 'iccid'],
+    },
+}
+
+# Default number of requests in flight and default slice length (one day)
+DEFAULT_CONCURRENCY = 32
+DEFAULT_SLICE_LENGTH = 86400
+
+# Timeout of a single request in seconds (same as the one used by the original scripts)
+DEFAULT_TIMEOUT = 20000
+
+# Default rows per page and default number of pages fetched or waiting to be converted at the same time
+DEFAULT_FETCH_SIZE = 5000
+DEFAULT_PAGE_BUDGET = 2 * DEFAULT_CONCURRENCY
+
+
+###############################################################################
+# Make the connection to the database (through the SSH tunnel on the local machine)
+
+def ConnectMonroe():
+    authProvider = PlainTextAuthProvider(username='monroedb', password='monroedb_pass')
+    cluster = Cluster(['127.0.0.1'], 9042, auth_provider=authProvider, connect_timeout=15)
+    session = cluster.connect('monroe')
+    return cluster, session
+
+
+###############################################################################
+# Split [startTimeStamp, endTimeStamp] into consecutive slices of at most sliceLength seconds. Slices are aligned to
+# multiples of sliceLength so that the same slices are produced for overlapping ranges. Every slice is half-open
+# [start, end) except for the last one which is closed, i.e. the union is exactly the requested range. With
+# closed=False the last slice is half-open too, i.e. the range is [startTimeStamp, endTimeStamp).
+
+def SplitTimeRange(startTimeStamp, endTimeStamp, sliceLength=DEFAULT_SLICE_LENGTH, closed=True):
+    slices = []
+    sliceStart = startTimeStamp
+    while True:
+        sliceEnd = (sliceStart // sliceLength + 1) * sliceLength
+        if sliceEnd >= endTimeStamp:
+            slices.append((sliceStart, endTimeStamp, closed))
+            return slices
+        slices.append((sliceStart, sliceEnd, False))
+        sliceStart = sliceEnd
+
+
+###############################################################################
+# Columns of a table that are not bound in the WHERE clause, i.e. the columns returned per key
+
+def ValueColumns(tableName):
+    spec = TABLES[tableName]
+    return [column for column in spec['columns'] if column not in spec['keys']]
+
+
+# Convert a page of rows to a dict column -> float array (missing values become NaN). The page is a dict of column
+# arrays (NumPy protocol handler) or a list of tuples.
+def RowsToColumns(rows, columns, positions):
+    if isinstance(rows, dict):
+        return dict((column, ColumnToFloat(rows[column])) for column in columns)
+    values = np.array([[row[i] for i in positions] for row in rows], dtype=float).reshape(-1, len(columns))
+    return dict((column, values[:, n].copy()) for n, column in enumerate(columns))
+
+
+def ColumnToFloat(values):
+    if np.ma.isMaskedArray(values):
+        return values.astype(float).filled(np.nan)
+    # Object array of a type without a NumPy dtype, None where the value is missing
+    return np.array(values.tolist(), dtype=float)
+
+
+# Concatenate the columns of consecutive pieces (e.g. pages) of rows
+def ConcatColumns(pieces, columns):
+    if len(pieces) == 1:
+        return pieces[0]
+    return dict((column, np.concatenate([piece[column] for piece in pieces]) if pieces else np.empty(0))
+                for column in columns)
+
+
+###############################################################################
+# Execute (statement, parameters) requests with at most concurrency requests in flight and page through their
+# results. A page is handed to the caller while the next one is fetched by the driver (in its own thread), and at most
+# pageBudget pages are being fetched or waiting for the caller: when the caller is slower than the database, the
+# requests wait for it.
+
+class PagedExecution:
+    def __init__(self, session, requests, concurrency, pageBudget):
+        self.session = session
+        self.requests = list(requests)
+        self.concurrency = concurrency
+        self.pageBudget = max(1, pageBudget)
+
+        self.condition = threading.Condition()
+        self.pages = deque()  # (index, rows, last page, error) waiting for the caller
+        self.paused = deque()  # futures whose next page waits for the budget
+        self.next = 0  # Next request to start
+        self.active = 0  # Requests started and not finished
+        self.held = 0  # Pages being fetched or waiting for the caller
+        self.finished = set()  # Requests whose last page was handed to the caller
+        self.cancelled = False
+
+    # Yields (index, rows, error) for every page in the order the pages arrive (the pages of a request in order).
+    # index is the position of the request, error the exception of a failed request (rows is then None).
+    def __iter__(self):
+        with self.condition:
+            starts = self.Schedule()
+        self.Start(starts)
+        remaining = len(self.requests)
+        while remaining:
+            with self.condition:
+                while not self.pages:
+                    self.condition.wait()
+                index, rows, last, error = self.pages.popleft()
+                self.held -= 1
+                starts = self.Schedule()
+            self.Start(starts)
+            if last:
+                remaining -= 1
+                self.finished.add(index)
+            yield index, rows, error
+
+    # True once the last page (or the error) of a request has been handed to the caller
+    def Finished(self, index):
+        return index in self.finished
+
+    # Stop starting requests and fetching pages, e.g. when the caller gives up after a failed request. The requests in
+    # flight finish in the driver and their pages are dropped.
+    def Cancel(self):
+        with self.condition:
+            self.cancelled = True
+            self.paused.clear()
+            self.pages.clear()
+
+    # Reserve the budget of the next pages and requests that can be started (the pages of started requests come
+    # first). Returns them as futures (next page) and request indexes, to be started by Start() outside the lock.
+    def Schedule(self):
+        starts = []
+        while self.held < self.pageBudget and not self.cancelled:
+            if self.paused:
+                starts.append(self.paused.popleft())
+            elif self.next < len(self.requests) and self.active < self.concurrency:
+                starts.append(self.next)
+                self.next += 1
+                self.active += 1
+            else:
+                break
+            self.held += 1
+        return starts
+
+    def Start(self, starts):
+        for start in starts:
+            if isinstance(start, int):
+                statement, parameters = self.requests[start]
+                future = self.session.execute_async(statement, parameters)
+                future.add_callbacks(callback=self.OnPage, callback_args=(start, future),
+                                     errback=self.OnError, errback_args=(start,))
+            else:
+                start.start_fetching_next_page()
+
+    # Called by the driver thread with every page of a request
+    def OnPage(self, rows, index, future):
+        with self.condition:
+            last = not future.has_more_pages
+            if last:
+                self.active -= 1
+            if self.cancelled:
+                return
+            if not last:
+                self.paused.append(future)
+            self.pages.append((index, rows, last, None))
+            starts = self.Schedule()
+            self.condition.notify()
+        self.Start(starts)
+
+    def OnError(self, error, index):
+        with self.condition:
+            self.active -= 1
+            if self.cancelled:
+                return
+            self.pages.append((index, None, True, error))
+            starts = self.Schedule()
+            self.condition.notify()
+        self.Start(starts)
+
+
+###############################################################################
+
+class MonroeFetcher:
+    def __init__(self, session, concurrency=DEFAULT_CONCURRENCY, sliceLength=DEFAULT_SLICE_LENGTH,
+                 timeout=DEFAULT_TIMEOUT, fetchSize=DEFAULT_FETCH_SIZE, pageBudget=DEFAULT_PAGE_BUDGET):
+        self.session = session
+        self.concurrency = concurrency
+        self.sliceLength = sliceLength
+        self.pageBudget = pageBudget
+        self.session.default_timeout = timeout
+        self.session.default_fetch_size = fetchSize
+        self.session.row_factory = tuple_factory
+        if NumpyProtocolHandler is not None:
+            self.session.client_protocol_handler = NumpyProtocolHandler
+
+        # Prepared statements per (table, last slice) and rows/seconds spent per table
+        self.statements = {}
+        self.stats = {}
+
+    # Prepare (once) the statement for a table. The last slice of a range includes its upper bound.
+    def Statement(self, tableName, lastSlice):
+        if (tableName, lastSlice) not in self.statements:
+            spec = TABLES[tableName]
+            query = "SELECT " + ", ".join(spec['columns']) + " FROM " + spec['table'] + " WHERE "
+            query += " AND ".join(key + " = ?" for key in spec['keys'])
+            query += " AND timestamp >= ? AND timestamp " + ("<=" if lastSlice else "<") + " ? ALLOW FILTERING"
+            self.statements[(tableName, lastSlice)] = self.session.prepare(query)
+        return self.statements[(tableName, lastSlice)]
+
+    # Fetch the rows of a table for every key tuple (e.g. (nodeid,) or (nodeid, iccid)) in the given time range.
+    # All (key, slice) requests are executed concurrently. Returns a dict key -> columns in timestamp order, i.e. a
+    # dict column -> array for every non-key column of the table (e.g. 'timestamp', 'rtt').
+    def Fetch(self, tableName, keys, startTimeStamp, endTimeStamp):
+        keys = [tuple(str(value) for value in key) for key in keys]
+        columns = self.FetchRanges(tableName, [(key, startTimeStamp, endTimeStamp, True) for key in keys])
+        return dict(zip(keys, columns))
+
+    # Fetch a list of (key, start, end, closed) ranges, each one possibly for a different key and time range (closed
+    # tells whether the end of the range is included). All the slices of all the ranges are executed concurrently.
+    # Returns the columns of every range, in the order of the ranges.
+    def FetchRanges(self, tableName, ranges):
+        results = [None] * len(ranges)
+        for n, columns in self.IterRanges(tableName, ranges):
+            results[n] = columns
+        return results
+
+    # Same as FetchRanges, but yields (position of the range, columns) for every range as soon as all its pages are
+    # in, so that the caller can process a range while the others are being fetched
+    def IterRanges(self, tableName, ranges):
+        spec = TABLES[tableName]
+
+        # The slices of a range are consecutive requests: requests[first[n]:first[n + 1]]
+        requests = []
+        owners = []
+        first = []
+        for n, (key, startTimeStamp, endTimeStamp, closed) in enumerate(ranges):
+            key = tuple(str(value) for value in key)
+            first.append(len(requests))
+            for sliceStart, sliceEnd, lastSlice in SplitTimeRange(startTimeStamp, endTimeStamp, self.sliceLength,
+                                                                  closed):
+                requests.append((self.Statement(tableName, lastSlice), key + (sliceStart, sliceEnd)))
+                owners.append(n)
+        first.append(len(requests))
+
+        columns = ValueColumns(tableName)
+        positions = [spec['columns'].index(column) for column in columns]
+
+        # Requests of every range that have not received their last page
+        unfinished = [first[n + 1] - first[n] for n in range(len(ranges))]
+
+        # Every page is converted to arrays as soon as it arrives
+        started = time.time()
+        pages = [[] for _ in requests]
+        fetched = 0
+        execution = self.Execute(requests)
+        for index, rows, error in execution:
+            if error is not None:
+                execution.Cancel()
+                raise FetchError("{} query failed for {}: {}".format(spec['table'], requests[index][1], error), error)
+            page = RowsToColumns(rows, columns, positions)
+            pages[index].append(page)
+            fetched += len(page['timestamp'])
+            if execution.Finished(index):
+                n = owners[index]
+                unfinished[n] -= 1
+                if not unfinished[n]:
+                    # The pages of the slices are concatenated in timestamp order and released
+                    rangePages = []
+                    for request in range(first[n], first[n + 1]):
+                        rangePages.extend(pages[request])
+                        pages[request] = None
+                    yield n, ConcatColumns(rangePages, columns)
+
+        self.UpdateStats(tableName, fetched, time.time() - started)
+
+    # Execute (statement, parameters) requests, see PagedExecution
+    def Execute(self, requests):
+        return PagedExecution(self.session, requests, self.concurrency, self.pageBudget)
+
+    def UpdateStats(self, tableName, rows, seconds):
+        totalRows, totalSeconds = self.stats.get(tableName, (0, 0.0))
+        self.stats[tableName] = (totalRows + rows, totalSeconds + seconds)
+
+    # Print rows/s per table
+    def PrintStats(self):
+        for tableName, (rows, seconds) in sorted(self.stats.items()):
+            print("{}: {} rows in {:.2f} s ({:.0f} rows/s)".format(TABLES[tableName]['table'], rows, seconds,
+                                                                   rows / seconds if seconds > 0 else 0))
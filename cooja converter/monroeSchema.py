@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+
+# Output schemas of the fetch scripts and the tables they need.
+#
+# Every script declares the columns it writes (its output schema) and only the tables needed by these columns are
+# fetched. A Cooja mobility trace (node, time, x, y) only needs the GPS rows, so the ping and modem tables of the
+# interfaces are not queried at all. A list of the nodes with GPS data does not even need the GPS rows: one LIMIT 1
+# probe per node is enough (see monroeSummary.py). In every case the nodes without GPS data are found first, and the
+# interfaces of these nodes are never queried.
+
+import monroeSummary
+
+# Tables needed by every output column
+COLUMN_TABLES = {
+    'node': (),
+    'time': (),
+    'hasGps': (),
+    'x': ('gps',),
+    'y': ('gps',),
+    'bounds': ('gps',),
+    'gpsRows': ('gps',),
+    'avgRtt': ('gps', 'ping'),
+    'avgRssi': ('gps', 'modem'),
+    'rttRows': ('gps', 'ping'),
+    'rssiRows': ('gps', 'modem'),
+}
+
+
+def SchemaTables(schema):
+    tables = set()
+    for column in schema:
+        if column not in COLUMN_TABLES:
+            raise ValueError("Unknown output column {}, choose from {}".format(column, sorted(COLUMN_TABLES)))
+        tables.update(COLUMN_TABLES[column])
+    return tables
+
+
+###############################################################################
+# Fetch the tables needed by the output schema for all nodes. Returns (nodesWithGps, gpsByNode, pingByInterface,
+# metaByInterface): the set of the node ids (as strings) with GPS data, then the columns of every fetched table as
+# returned by fetcher.Fetch. Tables that are not needed are empty dicts, and only the interfaces of nodes with GPS
+# data are fetched.
+
+def FetchTables(fetcher, resources, schema, startTimeStamp, endTimeStamp):
+    tables = SchemaTables(schema)
+    nodes = [(resource['id'],) for resource in resources]
+
+    gpsByNode = {}
+    if 'gps' in tables:
+        gpsByNode = fetcher.Fetch('gps', nodes, startTimeStamp, endTimeStamp)
+        nodesWithGps = set(nodeid for (nodeid,), gps in gpsByNode.items() if len(gps['timestamp']))
+    else:
+        hasGpsByNode = monroeSummary.GpsSummaries(fetcher).HasGps([nodeid for nodeid, in nodes], startTimeStamp,
+                                                                  endTimeStamp)
+        nodesWithGps = set(nodeid for nodeid, hasGps in hasGpsByNode.items() if hasGps)
+
+    interfaceKeys = [(resource['id'], interface['iccid']) for resource in resources
+                     if str(resource['id']) in nodesWithGps for interface in resource['interfaces']]
+    pingByInterface = fetcher.Fetch('ping', interfaceKeys, startTimeStamp, endTimeStamp) if 'ping' in tables else {}
+    metaByInterface = fetcher.Fetch('modem', interfaceKeys, startTimeStamp, endTimeStamp) if 'modem' in tables else {}
+    return nodesWithGps, gpsByNode, pingByInterface, metaByInterface
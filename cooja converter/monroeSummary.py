@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+# Cheap classification of the MONROE nodes from their GPS rows: has a node GPS rows, is it mobile, where is it.
+#
+# Instead of fetching every GPS row of a (node, time range), the database only answers small questions about it:
+#     HasGps      SELECT timestamp ... LIMIT 1                 is there any row at all
+#     Summaries   SELECT count(*), min/max(latitude/longitude)  row count and bounding box of the range
+# A node is mobile in a range when its bounding box is not a single point, i.e. when some position differs from the
+# first one. All the (node, range) probes are executed concurrently through the fetcher.
+#
+# With a cache directory, the summaries of settled ranges (ended more than the settle delay ago, as the days of the
+# table cache, see monroeCache.py) are saved in
+#     <cacheDir>/summaries/monroe_meta_device_gps.json
+# so that a census over the same days does not query the database again. In offline mode the summaries are computed
+# from the GPS rows of the table cache.
+
+import monroeFetch
+import monroeCache
+import json
+import os
+
+# Columns of a summary: row count and bounding box (NaN without rows)
+SUMMARY_COLUMNS = ['rows', 'minlatitude', 'maxlatitude', 'minlongitude', 'maxlongitude']
+
+
+###############################################################################
+# MonroeFetcher below a cache and/or a checkpoint (None in offline mode)
+
+def DatabaseFetcher(fetcher):
+    while fetcher is not None and not isinstance(fetcher, monroeFetch.MonroeFetcher):
+        fetcher = fetcher.fetcher
+    return fetcher
+
+
+def IsMobile(summary):
+    return summary['rows'] > 0 and (summary['minlatitude'] != summary['maxlatitude'] or
+                                    summary['minlongitude'] != summary['maxlongitude'])
+
+
+# (minLatitude, maxLatitude, minLongitude, maxLongitude), None without rows
+def BoundingBox(summary):
+    if not summary['rows']:
+        return None
+    return tuple(summary[column] for column in SUMMARY_COLUMNS[1:])
+
+
+# Summary of GPS columns already fetched (see MonroeFetcher.Fetch)
+def SummarizeColumns(gps):
+    if not len(gps['timestamp']):
+        return dict((column, 0 if column == 'rows' else float('nan')) for column in SUMMARY_COLUMNS)
+    return {'rows': len(gps['timestamp']),
+            'minlatitude': float(gps['latitude'].min()), 'maxlatitude': float(gps['latitude'].max()),
+            'minlongitude': float(gps['longitude'].min()), 'maxlongitude': float(gps['longitude'].max())}
+
+
+###############################################################################
+
+class GpsSummaries:
+    # fetcher is the one returned by monroeCache.OpenFetcher, cacheDir the directory of the table cache (or None)
+    def __init__(self, fetcher, cacheDir=None, settleDelay=monroeCache.DEFAULT_SETTLE_DELAY):
+        self.fetcher = fetcher
+        self.settleDelay = settleDelay
+        self.database = DatabaseFetcher(fetcher)
+        self.table = monroeFetch.TABLES['gps']['table']
+        self.statements = {}
+
+        # "nodeid start end" -> summary of the (closed) range
+        self.summaries = {}
+        self.path = None
+        if cacheDir is not None:
+            self.path = os.path.join(cacheDir, "summaries", self.table + ".json")
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    self.summaries = json.load(f)
+
+        # Probes sent to the database and summaries read from the saved ones
+        self.probes = 0
+        self.cached = 0
+
+    def Statement(self, kind):
+        if kind not in self.statements:
+            if kind == 'exists':
+                query = "SELECT timestamp FROM " + self.table
+            else:
+                query = "SELECT count(*) AS rows, min(latitude) AS minlatitude, max(latitude) AS maxlatitude, " \
+                        "min(longitude) AS minlongitude, max(longitude) AS maxlongitude FROM " + self.table
+            query += " WHERE nodeid = ? AND timestamp >= ? AND timestamp <= ?"
+            query += " LIMIT 1 ALLOW FILTERING" if kind == 'exists' else " ALLOW FILTERING"
+            self.statements[kind] = self.database.session.prepare(query)
+        return self.statements[kind]
+
+    # Execute one probe per (nodeid, start, end) range, returns the columns of the result of every range
+    def Probe(self, kind, ranges, columns):
+        requests = [(self.Statement(kind), (nodeid, start, end)) for nodeid, start, end in ranges]
+        pages = [[] for _ in requests]
+        execution = self.database.Execute(requests)
+        for index, rows, error in execution:
+            if error is not None:
+                execution.Cancel()
+                raise monroeFetch.FetchError("{} probe failed for {}: {}".format(self.table, requests[index][1], error),
+                                             error)
+            pages[index].append(monroeFetch.RowsToColumns(rows, columns, list(range(len(columns)))))
+        self.probes += len(requests)
+        return [monroeFetch.ConcatColumns(requestPages, columns) for requestPages in pages]
+
+    # Dict nodeid -> True if the node has GPS rows in [startTimeStamp, endTimeStamp]
+    def HasGps(self, nodes, startTimeStamp, endTimeStamp):
+        nodes = sorted(set(str(nodeid) for nodeid in nodes))
+        result = {}
+        missing = []
+        for nodeid in nodes:
+            summary = self.summaries.get("{} {} {}".format(nodeid, startTimeStamp, endTimeStamp))
+            if summary is not None:
+                result[nodeid] = summary['rows'] > 0
+                self.cached += 1
+            else:
+                missing.append(nodeid)
+
+        if self.database is None:
+            gpsByNode = self.fetcher.Fetch('gps', [(nodeid,) for nodeid in missing], startTimeStamp, endTimeStamp)
+            for (nodeid,), gps in gpsByNode.items():
+                result[nodeid] = len(gps['timestamp']) > 0
+        elif missing:
+            probes = self.Probe('exists', [(nodeid, startTimeStamp, endTimeStamp) for nodeid in missing],
+                                ['timestamp'])
+            for nodeid, probe in zip(missing, probes):
+                result[nodeid] = len(probe['timestamp']) > 0
+        return result
+
+    # Dict (nodeid, start, end) -> summary (dict column -> value, see SUMMARY_COLUMNS) of every closed
+    # [start, end] range of every node
+    def Summaries(self, nodes, ranges):
+        nodes = sorted(set(str(nodeid) for nodeid in nodes))
+        wanted = [(nodeid, start, end) for nodeid in nodes for start, end in ranges]
+        result = {}
+        missing = []
+        for nodeid, start, end in wanted:
+            summary = self.summaries.get("{} {} {}".format(nodeid, start, end))
+            if summary is not None:
+                result[(nodeid, start, end)] = summary
+                self.cached += 1
+            else:
+                missing.append((nodeid, start, end))
+
+        if self.database is None:
+            nodesPerRange = {}
+            for nodeid, start, end in missing:
+                nodesPerRange.setdefault((start, end), []).append(nodeid)
+            for (start, end), rangeNodes in sorted(nodesPerRange.items()):
+                gpsByNode = self.fetcher.Fetch('gps', [(nodeid,) for nodeid in rangeNodes], start, end)
+                for (nodeid,), gps in gpsByNode.items():
+                    result[(nodeid, start, end)] = SummarizeColumns(gps)
+        elif missing:
+            # An aggregate query always returns one row
+            probes = self.Probe('summary', missing, SUMMARY_COLUMNS)
+            for unit, probe in zip(missing, probes):
+                summary = dict((column, float(probe[column][0])) for column in SUMMARY_COLUMNS)
+                summary['rows'] = int(summary['rows'])
+                result[unit] = summary
+
+        # Save the summaries of the settled ranges, the others can still get rows
+        saved = [unit for unit in missing if monroeCache.IsSettled(unit[2], self.settleDelay)]
+        if self.path is not None and saved:
+            for nodeid, start, end in saved:
+                self.summaries["{} {} {}".format(nodeid, start, end)] = result[(nodeid, start, end)]
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", 'w') as f:
+                json.dump(self.summaries, f)
+            os.replace(self.path + ".tmp", self.path)
+        return result
+
+    def PrintStats(self):
+        print("{} summaries: {} probes, {} saved summaries read".format(self.table, self.probes, self.cached))
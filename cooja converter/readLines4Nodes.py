@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 import os
+import traceFormat
 
 #Italy
 fname = "./2010-01-01 16:35_2017-11-28 16:35_italy_intrvl_3600.0"
@@ -16,6 +17,12 @@ nodes = []
 
 # find all possible nodes in the incoming file
 def scanLine(fname):
+	# binary trace (traceFormat.py): the nodes are in the node table
+	if traceFormat.IsTrace(fname):
+		nodes.extend(str(node) for node in traceFormat.Trace(fname).nodes['node'].tolist())
+		print (nodes)
+		return
+
 	with open(fname) as f:
 		 for line in f:
 		 	sub1=line.split("node: ",1)[1]
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+# Node inventory of the MONROE scheduler (/v1/resources).
+#
+# The inventory is parsed once and indexed by node id, project and ICCID. It is saved locally together with its
+# ETag/Last-Modified headers: within the TTL the saved copy is used without any request, after that it is revalidated
+# with a conditional request (If-None-Match/If-Modified-Since) and only downloaded again when it has changed.
+# MONROE_RESOURCES_URL overrides the scheduler URL (e.g. to point the scripts at a local stub server).
+
+import json
+import os
+import sys
+import time
+import requests
+
+DEFAULT_URL = 'https://scheduler.monroe-system.eu/v1/resources'
+
+# Where the inventory is saved and for how long (in seconds) it is used without revalidation
+DEFAULT_INVENTORY_FILE = os.path.join(os.path.expanduser('~'), '.monroe_resources.json')
+DEFAULT_TTL = 3600
+
+
+###############################################################################
+# Command line option of the inventory, shared by the scripts (see LoadInventory)
+
+def AddInventoryArguments(parser):
+    parser.add_argument('--inventoryTtl', help='Use the saved node inventory for this many seconds before revalidating '
+                                               'it with the scheduler (default = {})'.format(DEFAULT_TTL),
+                        required=False, default=DEFAULT_TTL, type=int)
+
+
+###############################################################################
+
+class ResourceInventory:
+    def __init__(self, resources):
+        self.resources = resources
+
+        self.byId = {}
+        self.byProject = {}
+        self.byIccid = {}
+        for resource in resources:
+            self.byId[str(resource['id'])] = resource
+            self.byProject.setdefault(resource['project'], []).append(resource)
+            for interface in resource.get('interfaces', []):
+                self.byIccid[str(interface['iccid'])] = resource
+
+    # Nodes of a project in one of the given states, in inventory order
+    def Nodes(self, project, types=('deployed', 'testing')):
+        return [resource for resource in self.byProject.get(project, []) if resource['type'] in types]
+
+    def Node(self, nodeId):
+        return self.byId.get(str(nodeId))
+
+    # Node an interface (ICCID) belongs to
+    def NodeOfInterface(self, iccid):
+        return self.byIccid.get(str(iccid))
+
+
+###############################################################################
+
+def ReadSaved(inventoryFile, url):
+    try:
+        with open(inventoryFile) as f:
+            saved = json.load(f)
+    except (IOError, ValueError):
+        return None
+    return saved if saved.get('url') == url else None
+
+
+# Save atomically so that concurrent runs never read a partial file
+def Save(inventoryFile, saved):
+    directory = os.path.dirname(os.path.abspath(inventoryFile))
+    os.makedirs(directory, exist_ok=True)
+    with open(inventoryFile + '.tmp', 'w') as f:
+        json.dump(saved, f)
+    os.replace(inventoryFile + '.tmp', inventoryFile)
+
+
+###############################################################################
+# Return the ResourceInventory, from the saved copy when it is fresh (or still valid on the server).
+# ttl = 0 revalidates on every run.
+
+def LoadInventory(cert, ttl=DEFAULT_TTL, inventoryFile=DEFAULT_INVENTORY_FILE, url=None):
+    url = url or os.environ.get('MONROE_RESOURCES_URL', DEFAULT_URL)
+    saved = ReadSaved(inventoryFile, url)
+
+    if saved is not None and time.time() - saved['checked'] < ttl:
+        return ResourceInventory(saved['resources'])
+
+    headers = {}
+    if saved is not None:
+        if saved.get('etag'):
+            headers['If-None-Match'] = saved['etag']
+        if saved.get('lastModified'):
+            headers['If-Modified-Since'] = saved['lastModified']
+
+    try:
+        response = requests.get(url, cert=cert, headers=headers)
+    except requests.RequestException as error:
+        if saved is None:
+            raise
+        print('GET /v1/resources failed ({}), using the inventory saved in {}'.format(error, inventoryFile))
+        return ResourceInventory(saved['resources'])
+
+    if response.status_code == 304 and saved is not None:
+        saved['checked'] = time.time()
+    elif response.status_code == 200:
+        saved = {'url': url, 'checked': time.time(), 'etag': response.headers.get('ETag'),
+                 'lastModified': response.headers.get('Last-Modified'), 'resources': response.json()}
+    else:
+        # This means something went wrong.
+        print('GET /v1/resources {}'.format(response.status_code))
+        print('Response Headers: {}'.format(response.headers))
+        if saved is None:
+            sys.exit()
+        print('Using the inventory saved in {}'.format(inventoryFile))
+        return ResourceInventory(saved['resources'])
+
+    Save(inventoryFile, saved)
+    return ResourceInventory(saved['resources'])
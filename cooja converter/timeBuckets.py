@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+# Columnar time-bucket aggregation of the rows of a node.
+#
+# The time range is cut into buckets ending at initialTime, initialTime + step, ... <= endTimeStamp. A bucket ending
+# at runningTime holds the rows with previous runningTime < timestamp <= runningTime (the first bucket also holds the
+# rows before it). For every bucket the last known GPS position and the per-ICCID average RTT/RSSI are computed for all
+# buckets at once with searchsorted/bincount instead of walking the rows one by one.
+
+import numpy as np
+
+
+###############################################################################
+# Bucket (running) times
+
+def BucketTimes(initialTime, endTimeStamp, step):
+    if initialTime > endTimeStamp:
+        return np.empty(0)
+    times = initialTime + step * np.arange(int((endTimeStamp - initialTime) // step) + 1)
+    return times[times <= endTimeStamp]
+
+
+# Index of the last row with timestamp <= each bucket time (-1 if there is none)
+def LastRowIndex(bucketTimes, timestamps):
+    return np.searchsorted(timestamps, bucketTimes, side='right') - 1
+
+
+# Number of (non missing) values and their sum per bucket. Rows after the last bucket are ignored.
+def BucketSums(bucketTimes, timestamps, values):
+    valid = ~np.isnan(values)
+    buckets = np.searchsorted(bucketTimes, timestamps[valid], side='left')
+    inRange = buckets < len(bucketTimes)
+    counts = np.bincount(buckets[inRange], minlength=len(bucketTimes))
+    sums = np.bincount(buckets[inRange], weights=values[valid][inRange], minlength=len(bucketTimes))
+    return counts, sums
+
+
+# Average per bucket. Buckets without values keep the average of the last bucket that had values (0 before that).
+def CarriedAverages(counts, sums):
+    withValues = np.where(counts > 0, np.arange(len(counts)), -1)
+    lastWithValues = np.maximum.accumulate(withValues) if len(counts) else withValues
+    averages = sums / np.maximum(counts, 1)
+    return np.where(lastWithValues >= 0, averages[np.maximum(lastWithValues, 0)], 0.0)
+
+
+###############################################################################
+# Aggregate the rows of one node.
+#   gps: dict with the 'timestamp' array of the GPS fixes and their projected 'x', 'y' arrays
+#   interfaces: dict iccid -> {'ping': {'timestamp', 'rtt'}, 'modem': {'timestamp', 'rssi'}} (columns as arrays)
+# Returns a dict with the bucket 'time', 'x', 'y' arrays, 'gpsIndex' (last GPS row of every bucket, -1 if none),
+# 'bounds' (x_min, y_min, x_max, y_max of the GPS fixes used, None if there are none) and per ICCID the 'avgRtt',
+# 'numOfRttValues', 'avgRssi' and 'numOfRssiValues' arrays plus 'rttRowEnd'/'rssiRowEnd' (index after the last row of
+# every bucket).
+
+def AggregateNode(gps, interfaces, initialTime, endTimeStamp, step):
+    times = BucketTimes(initialTime, endTimeStamp, step)
+
+    # Last known position prior to each running time. Position is (0, 0) before the first fix (index -1 picks the
+    # appended 0).
+    gpsIndex = LastRowIndex(times, gps['timestamp'])
+    x = np.append(gps['x'], 0.0)[gpsIndex]
+    y = np.append(gps['y'], 0.0)[gpsIndex]
+
+    bounds = None
+    used = gpsIndex[-1] + 1 if len(times) else 0
+    usedX, usedY = gps['x'][:used], gps['y'][:used]
+    projected = ~np.isnan(usedX)
+    if projected.any():
+        bounds = (float(usedX[projected].min()), float(usedY[projected].min()), float(usedX[projected].max()),
+                  float(usedY[projected].max()))
+
+    trace = {'time': times, 'x': x, 'y': y, 'gpsIndex': gpsIndex, 'bounds': bounds, 'interfaces': {}}
+
+    for iccid, tables in interfaces.items():
+        aggregated = {}
+        if 'ping' in tables:
+            counts, sums = BucketSums(times, tables['ping']['timestamp'], tables['ping']['rtt'])
+            aggregated['avgRtt'], aggregated['numOfRttValues'] = CarriedAverages(counts, sums), counts
+            aggregated['rttRowEnd'] = LastRowIndex(times, tables['ping']['timestamp']) + 1
+        if 'modem' in tables:
+            counts, sums = BucketSums(times, tables['modem']['timestamp'], tables['modem']['rssi'])
+            aggregated['avgRssi'], aggregated['numOfRssiValues'] = CarriedAverages(counts, sums), counts
+            aggregated['rssiRowEnd'] = LastRowIndex(times, tables['modem']['timestamp']) + 1
+        trace['interfaces'][iccid] = aggregated
+
+    return trace
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+
+# Binary trace format between the fetch stage and the Cooja converter.
+#
+# Instead of "node: N, time: T, x: X, y: Y" text lines the trace is stored as fixed-width little-endian records
+# (node, time, x, y), grouped per node in the order they were written. The file starts with a fixed-size header holding
+# the bounds of the x-y coordinates and the position of the node table, which gives the first record and the number of
+# records of every node:
+#
+#     header (HEADER_DTYPE) | records (RECORD_DTYPE) ... | node table (NODE_DTYPE) ...
+#
+# The readers memory-map the records (no parsing, no copy) and seek to the records of a node in O(1).
+
+import numpy as np
+
+MAGIC = b'MONTRACE'
+VERSION = 1
+
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('nodes', '<u4'), ('records', '<u8'),
+                         ('table', '<u8'), ('bounds', '<f8', (4,))])
+RECORD_DTYPE = np.dtype([('node', '<u4'), ('time', '<f8'), ('x', '<f8'), ('y', '<f8')])
+NODE_DTYPE = np.dtype([('node', '<u4'), ('start', '<u8'), ('count', '<u8')])
+
+
+###############################################################################
+# Check whether a file is a binary trace (the text traces start with "node: ")
+
+def IsTrace(fileName):
+    with open(fileName, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+###############################################################################
+
+class TraceWriter:
+    def __init__(self, fileName):
+        self.file = open(fileName, 'wb')
+        self.file.write(np.zeros(1, dtype=HEADER_DTYPE).tobytes())
+
+        self.nodes = []
+        self.records = 0
+        self.bounds = [np.inf, np.inf, -np.inf, -np.inf]
+
+    # Append the records of a node (all the records of a node must be written at once)
+    def WriteNode(self, nodeId, times, x, y):
+        records = np.empty(len(times), dtype=RECORD_DTYPE)
+        records['node'] = int(nodeId)
+        records['time'] = times
+        records['x'] = x
+        records['y'] = y
+        self.file.write(records.tobytes())
+
+        self.nodes.append((int(nodeId), self.records, len(records)))
+        self.records += len(records)
+        if len(records):
+            self.bounds = [min(self.bounds[0], records['x'].min()), min(self.bounds[1], records['y'].min()),
+                           max(self.bounds[2], records['x'].max()), max(self.bounds[3], records['y'].max())]
+
+    # Write the node table and the final header
+    def Close(self):
+        table = self.file.tell()
+        self.file.write(np.array(self.nodes, dtype=NODE_DTYPE).tobytes())
+
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['nodes'] = len(self.nodes)
+        header['records'] = self.records
+        header['table'] = table
+        header['bounds'] = self.bounds if self.records else [0.0, 0.0, 0.0, 0.0]
+        self.file.seek(0)
+        self.file.write(header.tobytes())
+        self.file.close()
+
+
+###############################################################################
+
+class Trace:
+    def __init__(self, fileName):
+        header = np.fromfile(fileName, dtype=HEADER_DTYPE, count=1)
+        if not len(header) or header['magic'][0] != MAGIC:
+            raise ValueError("{} is not a binary trace".format(fileName))
+        if header['version'][0] != VERSION:
+            raise ValueError("{}: unsupported trace version {}".format(fileName, header['version'][0]))
+
+        # x_min, y_min, x_max, y_max
+        self.bounds = tuple(header['bounds'][0].tolist())
+
+        numOfRecords = int(header['records'][0])
+        self.records = np.memmap(fileName, dtype=RECORD_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize,
+                                 shape=(numOfRecords,)) if numOfRecords else np.empty(0, dtype=RECORD_DTYPE)
+        self.nodes = np.fromfile(fileName, dtype=NODE_DTYPE, count=int(header['nodes'][0]),
+                                 offset=int(header['table'][0]))
+        self.nodeIndex = dict((node, n) for n, node in enumerate(self.nodes['node'].tolist()))
+
+    # Records of a node in write order
+    def Node(self, nodeId):
+        entry = self.nodes[self.nodeIndex[int(nodeId)]]
+        return self.records[int(entry['start']):int(entry['start']) + int(entry['count'])]
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+# GPS (long/lat) to UTM x-y projection for whole arrays of fixes.
+#
+# Building a Proj object is far more expensive than projecting a point, so one Proj is kept per UTM zone and every
+# zone is projected with a single call on NumPy arrays.
+
+from pyproj import Proj
+import numpy as np
+import sys
+
+# Upper (inclusive) longitude of the zones 29, 30, 31, ... inside the supported area
+ZONE_EDGES = np.arange(-6, 43, 6)
+
+# One Proj object per UTM zone
+projCache = {}
+
+
+###############################################################################
+# Find UTM zone from long/lat as per
+# https://en.wikipedia.org/wiki/Universal_Transverse_Mercator_coordinate_system#/media/File:Modified_UTM_Zones.png
+# Fixes with a missing coordinate (NaN) get zone 0.
+
+def FindUtmZones(longitudes, latitudes):
+    longitudes = np.asarray(longitudes, dtype=float)
+    latitudes = np.asarray(latitudes, dtype=float)
+
+    missing = np.isnan(longitudes) | np.isnan(latitudes)
+    outside = ~missing & ((longitudes <= -12) | (longitudes > 42) | (latitudes <= 0) | (latitudes > 72))
+    if outside.any():
+        first = np.argmax(outside)
+        sys.exit("Long = {}, lat = {}. Make sure -12 <= longitude <= 42 and 0 <= latitude <= 72!".format(
+            longitudes[first], latitudes[first]))
+
+    zones = np.searchsorted(ZONE_EDGES, longitudes, side='left') + 29
+
+    # Southern Norway is in zone 32
+    zones[(longitudes >= 3) & (longitudes <= 12) & (latitudes >= 56) & (latitudes <= 64)] = 32
+    zones[missing] = 0
+    return zones
+
+
+def FindUtmZone(longitude, latitude):
+    return int(FindUtmZones([longitude], [latitude])[0])
+
+
+###############################################################################
+
+def GetProj(utmZone):
+    if utmZone not in projCache:
+        projCache[utmZone] = Proj(proj='utm', zone=utmZone, ellps='WGS84')  # use kwargs
+    return projCache[utmZone]
+
+
+# Project arrays of longitudes/latitudes to x-y. Every point is projected in its own UTM zone.
+# Returns the x, y and zone arrays (x and y are NaN for fixes with a missing coordinate).
+def ProjectToUtm(longitudes, latitudes):
+    longitudes = np.array(longitudes, dtype=float)
+    latitudes = np.array(latitudes, dtype=float)
+    zones = FindUtmZones(longitudes, latitudes)
+
+    x = np.full(len(longitudes), np.nan)
+    y = np.full(len(longitudes), np.nan)
+    for utmZone in np.unique(zones[zones > 0]):
+        inZone = zones == utmZone
+        x[inZone], y[inZone] = GetProj(int(utmZone))(longitudes[inZone], latitudes[inZone])
+
+    return x, y, zones
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Scheduler of the curl actions.
+
+Every action is due "Time" seconds after the start of the experiment. An action
+with "Every" (seconds) and "Count" repeats: it is due Count times, Every seconds
+apart. Each action has one timer in the event loop (a heap) for its next
+occurrence, so the scheduler wakes up exactly when an occurrence is due,
+whatever the number of actions.
+
+Occurrences run one at a time in the order they are due: an occurrence due
+while another one runs waits for it. The scheduling lag of an occurrence is the
+time between when it was due and when it was started; lags make the dynamic and
+static executions of different actions less comparable, so they are kept in
+lag statistics.
+"""
+from collections import deque
+
+
+class ActionScheduler(object):
+    def __init__(self, loop, actions, start, run_action, on_finished, retry=5.0):
+        """run_action(action, lag, done) starts an occurrence and returns True,
+           done() must be called once it has finished. It returns False if the
+           occurrence cannot run yet: it is then retried after retry seconds.
+           on_finished() is called when all occurrences have finished."""
+        self.loop = loop
+        self.start = start
+        self.run_action = run_action
+        self.on_finished = on_finished
+        self.retry = retry
+
+        self.ready = deque()  # (due, action) of the due occurrences, in due order
+        self.running = None
+        self.waiting = None  # Timer of the retry of the first ready occurrence
+        self.remaining = 0  # Occurrences that have not finished
+
+        self.lagCount = 0
+        self.lagSum = 0.0
+        self.lagMax = 0.0
+
+        for action in actions:
+            count = int(action.get('Count', 1))
+            if count > 1 and not action.get('Every'):
+                raise ValueError("Action {} repeats without an Every interval".format(action))
+            self.remaining += count
+            if count > 0:
+                self.schedule(action, start + action['Time'], count - 1)
+
+        if not self.remaining:
+            self.loop.call_later(0, self.on_finished)
+
+    def schedule(self, action, due, repeats):
+        self.loop.call_at(due, self.handle_due, action, due, repeats)
+
+    def handle_due(self, action, due, repeats):
+        if repeats:
+            self.schedule(action, due + action['Every'], repeats - 1)
+        self.ready.append((due, action))
+        self.run_next()
+
+    def run_next(self):
+        while self.running is None and self.waiting is None and self.ready:
+            due, action = self.ready.popleft()
+            lag = self.loop.time() - due
+            self.running = (due, action)
+            if self.run_action(action, lag, self.handle_done):
+                self.lagCount += 1
+                self.lagSum += lag
+                self.lagMax = max(self.lagMax, lag)
+            else:
+                # Not started, it stays first with its due time so that the lag includes the wait
+                self.running = None
+                self.ready.appendleft((due, action))
+                self.waiting = self.loop.call_later(self.retry, self.handle_retry)
+
+    def handle_retry(self):
+        self.waiting = None
+        self.run_next()
+
+    def handle_done(self):
+        self.running = None
+        self.remaining -= 1
+        if not self.remaining:
+            self.on_finished()
+        else:
+            self.run_next()
+
+    def mean_lag(self):
+        return self.lagSum / self.lagCount if self.lagCount else None
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Downloads of the curl actions, driven by the event loop.
+
+Two downloaders with the same interface are available:
+    PycurlDownloader  in process with a pycurl multi handle, whose sockets and
+                      timers are handled by the event loop. Connections (and
+                      DNS lookups) are kept across downloads if keepalive is set.
+    CliDownloader     one curl process per download (as run by hand), used
+                      when pycurl is not installed.
+
+download(ifname, url, on_done) starts a download over an interface and calls
+on_done(metrics, err_code, started, error) when it has finished, with the
+CURL_METRICS fields (None if they could not be read, error then describes
+why), the curl error code (0 on success, 22 for HTTP errors) and the time the
+download was started.
+"""
+import json
+import os
+import subprocess
+import time
+
+try:
+    import pycurl
+except ImportError:
+    pycurl = None
+
+# What to save from curl
+CURL_METRICS = ('{ '
+                '"Host": "%{remote_ip}", '
+                '"Port": "%{remote_port}", '
+                '"Speed": %{speed_download}, '
+                '"Bytes": %{size_download}, '
+                '"Url": "%{url_effective}", '
+                '"TotalTime": %{time_total}, '
+                '"SetupTime": %{time_starttransfer} '
+                '}')
+
+
+def create_downloader(loop, expconfig):
+    """The downloader set by the "curl_engine" option ("pycurl" or "cli"), the
+       curl command if pycurl is not installed."""
+    if expconfig['curl_engine'] == "pycurl" and pycurl is not None:
+        return PycurlDownloader(loop, expconfig['time'], expconfig['curl_keepalive'])
+    if expconfig['curl_engine'] == "pycurl" and expconfig['verbosity'] > 1:
+        print "pycurl is not installed, downloading with the curl command"
+    return CliDownloader(loop, expconfig['time'])
+
+
+class CliDownloader(object):
+    def __init__(self, loop, maxTime):
+        self.loop = loop
+        self.maxTime = maxTime
+        self.running = {}  # fd -> [popen, output chunks, on_done, started]
+
+    def command(self, ifname, url):
+        return ["curl",
+                "-o", "/dev/null",  # to not output filecontents on stdout
+                "--fail",  # to get the curl exit code 22 for http failures
+                "--insecure",  # to allow selfsigned certificates
+                "--raw",
+                "--silent",
+                "--write-out", "{}".format(CURL_METRICS),
+                "--interface", "{}".format(ifname),
+                "--max-time", "{}".format(self.maxTime),
+                # "--range", "0-{}".format(expconfig['size'] - 1),
+                "{}".format(url)]
+
+    def download(self, ifname, url, on_done):
+        started = time.time()
+        popen = subprocess.Popen(self.command(ifname, url), stdout=subprocess.PIPE)
+        fd = popen.stdout.fileno()
+        self.running[fd] = [popen, [], on_done, started]
+        self.loop.add_reader(fd, self.handle_output, fd)
+
+    def handle_output(self, fd):
+        popen, output, on_done, started = self.running[fd]
+        data = os.read(fd, 4096)
+        if data:
+            output.append(data)
+            return
+        self.loop.remove_reader(fd)
+        del self.running[fd]
+        popen.stdout.close()
+        err_code = popen.wait()
+
+        # Clean away leading and trailing whitespace
+        output = ''.join(output).strip(' \t\r\n\0')
+        try:
+            metrics, error = json.loads(output), None
+        except ValueError as e:
+            metrics, error = None, "output : {}, error: {}".format(output, e)
+        on_done(metrics, err_code, started, error)
+
+    def stop(self):
+        for fd, (popen, _, _, _) in self.running.items():
+            self.loop.remove_reader(fd)
+            popen.stdout.close()
+            if popen.poll() is None:
+                popen.terminate()
+            popen.wait()
+        self.running = {}
+
+
+class PycurlDownloader(object):
+    def __init__(self, loop, maxTime, keepalive=False):
+        self.loop = loop
+        self.maxTime = maxTime
+        self.keepalive = keepalive
+        self.timer = None
+        self.running = {}  # handle -> (on_done, started)
+
+        self.multi = pycurl.CurlMulti()
+        self.multi.setopt(pycurl.M_SOCKETFUNCTION, self.handle_socket)
+        self.multi.setopt(pycurl.M_TIMERFUNCTION, self.handle_timer)
+
+    def download(self, ifname, url, on_done):
+        handle = pycurl.Curl()
+        handle.setopt(pycurl.URL, url)
+        handle.setopt(pycurl.WRITEFUNCTION, lambda data: None)  # to not keep the contents
+        handle.setopt(pycurl.FAILONERROR, 1)  # to get the error code 22 for http failures
+        handle.setopt(pycurl.SSL_VERIFYPEER, 0)  # to allow selfsigned certificates
+        handle.setopt(pycurl.SSL_VERIFYHOST, 0)
+        handle.setopt(pycurl.HTTP_CONTENT_DECODING, 0)  # raw, as curl --raw
+        handle.setopt(pycurl.HTTP_TRANSFER_DECODING, 0)
+        handle.setopt(pycurl.INTERFACE, str(ifname))
+        handle.setopt(pycurl.TIMEOUT, int(self.maxTime))
+        if not self.keepalive:
+            # Set up every download from scratch, like a new curl process
+            handle.setopt(pycurl.FRESH_CONNECT, 1)
+            handle.setopt(pycurl.FORBID_REUSE, 1)
+            handle.setopt(pycurl.DNS_CACHE_TIMEOUT, 0)
+
+        self.running[handle] = (on_done, time.time())
+        self.multi.add_handle(handle)
+
+    # Called by libcurl to (un)watch the sockets of the downloads
+    def handle_socket(self, event, fd, multi, data):
+        if event == pycurl.POLL_REMOVE:
+            self.loop.remove_handler(fd)
+            return
+        events = 0
+        if event & pycurl.POLL_IN:
+            events |= 1  # zmq.POLLIN
+        if event & pycurl.POLL_OUT:
+            events |= 2  # zmq.POLLOUT
+        self.loop.add_handler(fd, events, self.handle_ready, fd)
+
+    # Called by libcurl to set the timeout after which it must be called
+    def handle_timer(self, timeout):
+        self.loop.cancel(self.timer)
+        self.timer = None
+        if timeout >= 0:
+            self.timer = self.loop.call_later(timeout / 1000.0, self.handle_timeout)
+
+    def handle_ready(self, revents, fd):
+        action = 0
+        if revents & 1:
+            action |= pycurl.CSELECT_IN
+        if revents & 2:
+            action |= pycurl.CSELECT_OUT
+        if revents & 4:
+            action |= pycurl.CSELECT_ERR
+        self.multi.socket_action(fd, action)
+        self.check_done()
+
+    def handle_timeout(self):
+        self.timer = None
+        self.multi.socket_action(pycurl.SOCKET_TIMEOUT, 0)
+        self.check_done()
+
+    def check_done(self):
+        while True:
+            queued, succeeded, failed = self.multi.info_read()
+            done = [(handle, 0) for handle in succeeded] + [(handle, errno) for handle, errno, _ in failed]
+            for handle, err_code in done:
+                self.multi.remove_handle(handle)
+                on_done, started = self.running.pop(handle)
+                metrics = {
+                    "Host": handle.getinfo(pycurl.PRIMARY_IP),
+                    "Port": str(handle.getinfo(pycurl.PRIMARY_PORT)),
+                    "Speed": handle.getinfo(pycurl.SPEED_DOWNLOAD),
+                    "Bytes": int(handle.getinfo(pycurl.SIZE_DOWNLOAD)),
+                    "Url": handle.getinfo(pycurl.EFFECTIVE_URL),
+                    "TotalTime": handle.getinfo(pycurl.TOTAL_TIME),
+                    "SetupTime": handle.getinfo(pycurl.STARTTRANSFER_TIME),
+                }
+                handle.close()
+                on_done(metrics, err_code, started, None)
+            if not queued:
+                return
+
+    def stop(self):
+        for handle in self.running.keys():
+            self.multi.remove_handle(handle)
+            handle.close()
+        self.running = {}
+        self.loop.cancel(self.timer)
+        self.timer = None
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Single-threaded event loop of the multi-homing experiment.
+
+The loop waits on ZeroMQ sockets and plain file descriptors (the output pipes
+of fping and curl, the sockets of the downloads) with a zmq.Poller and runs
+timers kept in a heap. Handlers are plain callables run in the loop's thread,
+so the experiment state can be kept in ordinary dicts and lists without any
+locking or IPC.
+"""
+import ctypes
+import ctypes.util
+import heapq
+import itertools
+import os
+import time
+import traceback
+import zmq
+
+CLOCK_MONOTONIC = 1
+
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+_librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+_clock_gettime = _librt.clock_gettime
+_clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+
+def monotonic():
+    """Seconds of CLOCK_MONOTONIC (arbitrary origin, never jumps with the wall clock)."""
+    t = timespec()
+    if _clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return t.tv_sec + t.tv_nsec * 1e-9
+
+
+class EventLoop(object):
+    def __init__(self):
+        self.poller = zmq.Poller()
+        self.handlers = {}
+        self.timers = []  # Heap of [when, sequence, callback, args]
+        self.sequence = itertools.count()
+        self.running = False
+
+    def time(self):
+        """Current time of the loop (seconds since the epoch)."""
+        return time.time()
+
+    def monotonic(self):
+        """Monotonic time of the loop (arbitrary origin), for durations that
+           must not jump when the wall clock is stepped."""
+        return monotonic()
+
+    def wait_time(self, when):
+        """Seconds to wait (in real time) until time when of the loop."""
+        return when - self.time()
+
+    def add_handler(self, source, events, callback, *args):
+        """Call callback(revents, *args) whenever source (socket or fd) is ready
+           for events (zmq.POLLIN and/or zmq.POLLOUT). Replaces the handler
+           already added for source."""
+        self.poller.register(source, events)
+        self.handlers[source] = (callback, args)
+
+    def remove_handler(self, source):
+        if source in self.handlers:
+            self.poller.unregister(source)
+            del self.handlers[source]
+
+    def add_reader(self, source, callback, *args):
+        """Call callback(*args) whenever source (socket or fd) is readable."""
+        self.add_handler(source, zmq.POLLIN, lambda revents: callback(*args))
+
+    def remove_reader(self, source):
+        self.remove_handler(source)
+
+    def call_at(self, when, callback, *args):
+        """Call callback(*args) at time when. Returns a handle for cancel()."""
+        timer = [when, next(self.sequence), callback, args]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.time() + delay, callback, *args)
+
+    def cancel(self, timer):
+        # Cancelled timers stay in the heap and are skipped when they are due
+        if timer is not None:
+            timer[2] = None
+
+    def stop(self):
+        self.running = False
+
+    def run_handler(self, callback, args):
+        # A failing handler (e.g. a malformed message) must not stop the
+        # experiment on the other interfaces
+        try:
+            callback(*args)
+        except Exception:
+            traceback.print_exc()
+
+    def run(self):
+        """Run until stop() is called."""
+        self.running = True
+        while self.running:
+            timeout = None
+            if self.timers:
+                timeout = max(0, int(self.wait_time(self.timers[0][0]) * 1000))
+            if self.handlers or timeout is not None:
+                events = self.poller.poll(timeout)
+            else:
+                break  # Nothing left to wait for
+
+            for source, revents in events:
+                if source in self.handlers:
+                    callback, args = self.handlers[source]
+                    self.run_handler(callback, (revents,) + args)
+
+            now = self.time()
+            while self.running and self.timers and self.timers[0][0] <= now:
+                when, _, callback, args = heapq.heappop(self.timers)
+                if callback is not None:
+                    self.run_handler(callback, args)
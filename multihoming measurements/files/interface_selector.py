@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Selection of the interface used by the dynamic execution of the curl actions.
+
+The selector is fed by the probes (probe_update, after a reply was added to the
+RTT/RSSI windows of an interface) and by the downloads (download_update). The
+policies that only depend on the probes score an interface when it is updated
+and the best interface is kept, so select() does not compute anything. The
+bandit policies treat the interfaces as arms rewarded by the download speed
+and choose at select() time.
+
+Policies (the "selector" config option):
+    min_mean_rtt   lowest mean RTT of the window (the original selection)
+    min_ewma_rtt   lowest EWMA of the RTT
+    rssi_weighted  lowest mean RTT, increased by RSSI_WEIGHT per dB of mean
+                   RSSI below RSSI_REFERENCE
+    ucb            UCB1 on the download speed (normalized by the fastest seen)
+    thompson       Gaussian Thompson sampling on the normalized download speed
+
+Only interfaces with at least one RTT measurement are selected. The bandits
+first try every such interface that has no download yet, lowest mean RTT first.
+When the prober of an interface is stopped, reset() forgets its probes, so it
+is not selected again before new replies arrive (its downloads are kept).
+"""
+import math
+import random
+import time
+
+DEFAULT_POLICY = "min_mean_rtt"
+
+# RSSI (dBm) from which the RTT is not penalized and penalty per dB below it
+RSSI_REFERENCE = -75.0
+RSSI_WEIGHT = 0.02
+
+
+class Arm(object):
+    """Probe windows and download statistics of an interface."""
+    def __init__(self, name, rtts, rssis):
+        self.name = name
+        self.rtts = rtts
+        self.rssis = rssis
+        self.downloads = 0
+        self.speedSum = 0.0
+        self.speedSquares = 0.0
+
+    def mean_speed(self):
+        return self.speedSum / self.downloads
+
+    def speed_variance(self):
+        return max(0.0, self.speedSquares / self.downloads - self.mean_speed() ** 2)
+
+
+###############################################################################
+# Policies depending on the probes: score(arm) returns the score of an arm with
+# probes (lower is better) and why(arm, score) the reason of a choice.
+
+class MinMeanRtt(object):
+    def score(self, arm):
+        return arm.rtts.mean()
+
+    def why(self, arm, score):
+        return "lowest mean RTT {:.2f} ms".format(score)
+
+
+class MinEwmaRtt(object):
+    def score(self, arm):
+        return arm.rtts.ewma
+
+    def why(self, arm, score):
+        return "lowest RTT EWMA {:.2f} ms".format(score)
+
+
+class RssiWeighted(object):
+    def score(self, arm):
+        rssi = arm.rssis.mean() if len(arm.rssis) else RSSI_REFERENCE
+        return arm.rtts.mean() * (1 + RSSI_WEIGHT * max(0.0, RSSI_REFERENCE - rssi))
+
+    def why(self, arm, score):
+        return "lowest RSSI weighted RTT {:.2f} ms (mean RTT {:.2f} ms, mean RSSI {})".format(
+            score, arm.rtts.mean(), arm.rssis.mean() if len(arm.rssis) else None)
+
+
+###############################################################################
+# Bandit policies: choose(arms, plays, fastest) returns the chosen arm among arms
+# that all have downloads, its score (higher is better) and the reason.
+
+class Ucb(object):
+    def choose(self, arms, plays, fastest):
+        scores = [(arm.mean_speed() / fastest + math.sqrt(2 * math.log(plays) / arm.downloads), arm) for arm in arms]
+        score, arm = max(scores, key=lambda x: x[0])
+        return arm, score, "highest UCB {:.3f} (mean speed {:.0f} over {} downloads)".format(
+            score, arm.mean_speed(), arm.downloads)
+
+
+class Thompson(object):
+    def choose(self, arms, plays, fastest):
+        samples = []
+        for arm in arms:
+            # Unknown spread after a single download
+            sigma = math.sqrt(arm.speed_variance()) / fastest if arm.downloads > 1 else 1.0
+            samples.append((random.gauss(arm.mean_speed() / fastest, sigma / math.sqrt(arm.downloads)), arm))
+        score, arm = max(samples, key=lambda x: x[0])
+        return arm, score, "highest sampled speed {:.3f} (mean speed {:.0f} over {} downloads)".format(
+            score, arm.mean_speed(), arm.downloads)
+
+
+POLICIES = {
+    "min_mean_rtt": MinMeanRtt,
+    "min_ewma_rtt": MinEwmaRtt,
+    "rssi_weighted": RssiWeighted,
+    "ucb": Ucb,
+    "thompson": Thompson,
+}
+
+
+###############################################################################
+
+class InterfaceSelector(object):
+    def __init__(self, policy, interfacesMap):
+        if policy not in POLICIES:
+            raise ValueError("Unknown selector policy {}, expected one of {}".format(policy, sorted(POLICIES)))
+        self.policyName = policy
+        self.policy = POLICIES[policy]()
+        self.arms = dict((ifname, Arm(ifname, value['rtts'], value['rssis']))
+                         for ifname, value in interfacesMap.iteritems())
+        # Score of the arms with probes and the best one (probe policies)
+        self.scores = {}
+        self.best = None
+        self.fastest = 0.0
+
+    def probe_update(self, ifname):
+        arm = self.arms[ifname]
+        if not len(arm.rtts):
+            return
+        if hasattr(self.policy, 'score'):
+            self.scores[ifname] = self.policy.score(arm)
+            self.best = min(self.scores, key=self.scores.get)
+        else:
+            self.scores[ifname] = arm.rtts.mean()
+
+    def reset(self, ifname):
+        """Forget the probes of an interface whose prober was stopped."""
+        arm = self.arms[ifname]
+        arm.rtts.clear()
+        arm.rssis.clear()
+        self.scores.pop(ifname, None)
+        if self.best == ifname:
+            self.best = min(self.scores, key=self.scores.get) if self.scores else None
+
+    def download_update(self, ifname, speed):
+        arm = self.arms[ifname]
+        arm.downloads += 1
+        arm.speedSum += speed
+        arm.speedSquares += speed * speed
+        self.fastest = max(self.fastest, speed)
+
+    def select(self):
+        """Returns the selected interface (None if no interface has probes) and
+           the decision: policy, reason, scores and decision latency (s)."""
+        started = time.time()
+        selected, score, reason = None, None, "no RTT data"
+        if self.scores:
+            if hasattr(self.policy, 'score'):
+                selected = self.best
+                score = self.scores[selected]
+                reason = self.policy.why(self.arms[selected], score)
+            else:
+                untried = [ifname for ifname in self.scores if not self.arms[ifname].downloads]
+                if untried or not self.fastest:
+                    selected = min(untried or self.scores, key=self.scores.get)
+                    score = self.scores[selected]
+                    reason = "no download yet, lowest mean RTT {:.2f} ms".format(score)
+                else:
+                    arms = [self.arms[ifname] for ifname in self.scores]
+                    plays = sum(arm.downloads for arm in arms)
+                    arm, score, reason = self.policy.choose(arms, plays, self.fastest)
+                    selected = arm.name
+
+        decision = {
+            "Policy": self.policyName,
+            "Selected": selected,
+            "Score": score,
+            "Reason": reason,
+            "Scores": dict(self.scores),
+            "DecisionLatency": time.time() - started,
+        }
+        return selected, decision
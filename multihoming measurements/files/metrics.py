@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Counters, gauges and histograms of the experiment.
+
+Every metric is declared once with its type and help text and then updated
+with optional labels (e.g. interface=op0). Histograms count the observations
+per bucket (cumulative upper bounds, as Prometheus does) and keep their count,
+sum, minimum and maximum.
+
+The metrics can be read as a dictionary (snapshot(), written as JSON by
+save_snapshot()) or in the Prometheus text format (text()), which serve() makes
+available over HTTP on a local port. The HTTP server runs in its own thread,
+so the metrics are updated under a lock.
+"""
+import BaseHTTPServer
+import json
+import os
+import shutil
+import threading
+
+# Upper bounds of the histogram buckets
+MS_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+SECONDS_BUCKETS = [0.0001, 0.001, 0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 300]
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+def label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, value) for key, value in labels) + "}"
+
+
+class Metrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (kind, help, buckets); values: name -> {labels: value or Histogram}
+        self.declared = {}
+        self.values = {}
+        self.server = None
+
+    def declare(self, name, kind, help, buckets=None):
+        """kind is "counter", "gauge" or "histogram" (with buckets)."""
+        self.declared[name] = (kind, help, buckets)
+        self.values[name] = {}
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[name][key] = self.values[name].get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            histogram = self.values[name].get(key)
+            if histogram is None:
+                histogram = self.values[name][key] = Histogram(self.declared[name][2])
+            histogram.observe(value)
+
+    def snapshot(self):
+        snapshot = {}
+        with self.lock:
+            for name, values in sorted(self.values.items()):
+                for labels, value in values.items():
+                    if isinstance(value, Histogram):
+                        value = {"count": value.count, "sum": value.sum, "min": value.min, "max": value.max,
+                                 "buckets": [[bound, count] for bound, count in value.cumulative()]}
+                    snapshot[name + label_text(labels)] = value
+        return snapshot
+
+    def text(self):
+        """The metrics in the Prometheus text format."""
+        lines = []
+        with self.lock:
+            for name, values in sorted(self.values.items()):
+                kind, help, _ = self.declared[name]
+                lines.append("# HELP {} {}".format(name, help))
+                lines.append("# TYPE {} {}".format(name, kind))
+                for labels, value in sorted(values.items()):
+                    if not isinstance(value, Histogram):
+                        lines.append("{}{} {}".format(name, label_text(labels), value))
+                        continue
+                    for bound, count in value.cumulative():
+                        lines.append("{}_bucket{} {}".format(name, label_text(labels + (("le", bound),)), count))
+                    lines.append("{}_bucket{} {}".format(name, label_text(labels + (("le", "+Inf"),)), value.count))
+                    lines.append("{}_sum{} {}".format(name, label_text(labels), value.sum))
+                    lines.append("{}_count{} {}".format(name, label_text(labels), value.count))
+        return "\n".join(lines) + "\n"
+
+    def save_snapshot(self, fileName, spooldir, extra):
+        """Write the snapshot (and the extra keys) as JSON to fileName, through spooldir
+           so that the file is replaced as a whole."""
+        snapshot = dict(extra)
+        snapshot["Metrics"] = self.snapshot()
+        spoolfile = os.path.join(spooldir, os.path.basename(fileName))
+        with open(spoolfile, 'w') as f:
+            json.dump(snapshot, f, sort_keys=True)
+        shutil.move(spoolfile, fileName)
+
+    def serve(self, port):
+        """Serve the text format on http://127.0.0.1:port/metrics in a thread."""
+        metrics = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.text()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Writer of the experiment records (one JSON object per line) to the result file.
+
+Records are collected into batches in the event loop; a batch is handed to a
+writer thread when it reaches batchSize bytes or flushInterval seconds after
+its first record. At most maxPending batches wait for the thread: when the disk
+is slower than the experiment, write() blocks until a batch was written, so the
+memory used stays bounded however long the experiment runs.
+
+The file being written is kept in spooldir, so that the (continuously
+synchronized) results directory only receives complete files. The records are
+split into files named after the result file (results.txt -> results.1.txt,
+results.2.txt, ...): a file is complete after about rotateSize bytes or
+rotateInterval seconds, whichever comes first, and is then moved to the results
+directory, so that a crash only loses the records of the current file. With
+both set to 0 the single result file is moved there by close(). With compress
+the files are gzipped (.gz).
+"""
+import gzip
+import json
+import os
+import Queue
+import shutil
+import threading
+import traceback
+
+from event_loop import monotonic
+
+BATCH_SIZE = 64 * 1024
+FLUSH_INTERVAL = 5.0
+MAX_PENDING = 16
+ROTATE_SIZE = 1024 * 1024
+ROTATE_INTERVAL = 300.0
+
+
+class ResultWriter(object):
+    def __init__(self, loop, resultfile, spooldir, batchSize=BATCH_SIZE, flushInterval=FLUSH_INTERVAL,
+                 rotateSize=ROTATE_SIZE, rotateInterval=ROTATE_INTERVAL, compress=False, maxPending=MAX_PENDING):
+        self.loop = loop
+        self.resultfile = resultfile
+        self.spooldir = spooldir
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.rotateSize = rotateSize
+        self.rotateInterval = rotateInterval
+        self.compress = compress
+
+        self.batch = []
+        self.batchBytes = 0
+        self.timer = None
+        self.records = 0
+
+        # Batches waiting for the writer thread, None stops it
+        self.queue = Queue.Queue(maxPending)
+        self.part = 0
+        self.file = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        if not os.path.isdir(spooldir):
+            os.makedirs(spooldir)
+        self.thread.start()
+
+    def write(self, msg):
+        line = json.dumps(msg) + '\n'
+        self.batch.append(line)
+        self.batchBytes += len(line)
+        self.records += 1
+        if self.batchBytes >= self.batchSize:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.loop.call_later(self.flushInterval, self.flush)
+
+    def flush(self):
+        """Hand the current batch to the writer thread (blocks while maxPending batches are waiting)."""
+        self.loop.cancel(self.timer)
+        self.timer = None
+        if self.batch:
+            self.queue.put(''.join(self.batch))
+            self.batch = []
+            self.batchBytes = 0
+
+    def pending(self):
+        """Number of batches waiting for the writer thread."""
+        return self.queue.qsize()
+
+    def close(self):
+        """Write all records and move the last file to the results directory."""
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+    # Writer thread
+    def part_name(self):
+        name = self.resultfile
+        if self.rotateSize or self.rotateInterval:
+            root, ext = os.path.splitext(name)
+            name = "{}.{}{}".format(root, self.part, ext)
+        if self.compress:
+            name += ".gz"
+        return name
+
+    def open_part(self):
+        self.part += 1
+        self.spoolfile = os.path.join(self.spooldir, os.path.basename(self.part_name()))
+        if self.compress:
+            self.file = gzip.open(self.spoolfile, 'wb')
+        else:
+            self.file = open(self.spoolfile, 'wb')
+        self.written = 0
+        self.opened = monotonic()
+
+    def close_part(self):
+        self.file.close()
+        self.file = None
+        shutil.move(self.spoolfile, self.part_name())
+
+    def run(self):
+        while True:
+            try:
+                if self.file is not None and self.rotateInterval:
+                    # The current file is complete after rotateInterval seconds even without more records
+                    data = self.queue.get(timeout=max(0, self.opened + self.rotateInterval - monotonic()))
+                else:
+                    data = self.queue.get()
+            except Queue.Empty:
+                try:
+                    self.close_part()
+                except Exception:
+                    traceback.print_exc()
+                    self.file = None
+                continue
+            try:
+                if data is None:
+                    if self.file is None and not self.part:
+                        self.open_part()  # The result file is written even without records
+                    if self.file is not None:
+                        self.close_part()
+                    return
+                if self.file is None:
+                    self.open_part()
+                self.file.write(data)
+                self.written += len(data)
+                if self.rotateSize and self.written >= self.rotateSize:
+                    self.close_part()
+            except Exception:
+                # Keep draining the queue so that the experiment is not blocked
+                traceback.print_exc()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Sliding window of the latest measurements (RTT or RSSI) of an interface.
+
+The values are kept in a fixed-size array used as a ring buffer. The sum and
+sum of squares are updated as values enter and leave the window, and the
+minimum and maximum are kept in monotonic queues, so adding a value and
+reading the mean, variance, minimum or maximum are all O(1). The sums are
+recomputed from the array every time the ring wraps, so that rounding errors
+do not accumulate. An exponentially weighted moving average (EWMA) of all the
+values is kept as well.
+"""
+from array import array
+from collections import deque
+import math
+
+# Weight of a new value in the EWMA
+EWMA_ALPHA = 0.2
+
+
+class Window(object):
+    def __init__(self, size, alpha=EWMA_ALPHA):
+        self.size = size
+        self.alpha = alpha
+        self.clear()
+
+    def clear(self):
+        """Forget all the values."""
+        self.values = array('d', [0.0] * self.size)
+        self.count = 0  # Values added so far
+        self.sum = 0.0
+        self.squares = 0.0
+        self.ewma = None
+        # (index, value) of the candidates for the minimum/maximum
+        self.minimums = deque()
+        self.maximums = deque()
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def __iter__(self):
+        """Values from the latest to the oldest."""
+        for i in xrange(self.count - 1, self.count - 1 - len(self), -1):
+            yield self.values[i % self.size]
+
+    def add(self, value):
+        value = float(value)
+        position = self.count % self.size
+        if self.count >= self.size:
+            old = self.values[position]
+            self.sum -= old
+            self.squares -= old * old
+        self.values[position] = value
+        self.sum += value
+        self.squares += value * value
+        self.count += 1
+        if position == self.size - 1:
+            self.sum = math.fsum(self.values)
+            self.squares = math.fsum(x * x for x in self.values)
+
+        self.ewma = value if self.ewma is None else self.alpha * value + (1 - self.alpha) * self.ewma
+
+        first = self.count - self.size  # Index of the oldest value in the window
+        for queue, better in ((self.minimums, lambda a, b: a <= b), (self.maximums, lambda a, b: a >= b)):
+            while queue and better(value, queue[-1][1]):
+                queue.pop()
+            queue.append((self.count - 1, value))
+            if queue[0][0] < first:
+                queue.popleft()
+
+    def mean(self):
+        """Mean of the window, -1 if it is empty."""
+        if not self.count:
+            return -1
+        return self.sum / len(self)
+
+    def variance(self):
+        if not self.count:
+            return -1
+        return max(0.0, self.squares / len(self) - (self.sum / len(self)) ** 2)
+
+    def min(self):
+        return self.minimums[0][1] if self.count else None
+
+    def max(self):
+        return self.maximums[0][1] if self.count else None
+
+    def percentile(self, p):
+        """Value at percentile p (0-100, nearest rank), None if it is empty."""
+        if not self.count:
+            return None
+        values = sorted(self)
+        rank = max(1, int(math.ceil(p / 100.0 * len(values))))
+        return values[min(rank, len(values)) - 1]
@@ -13,22 +13,29 @@ This script takes a list of interfaces and runs the experiments on all those
 interfaces. The idea is to measure RTT on all available interfaces and ultimately
 be able to select which interface to use for outgoing traffic.
 
-The script will run forever on all specified interfaces.
+The script will run on all specified interfaces until all curl actions are
+executed. Metadata, probing and curl actions are all handled by one event loop
+(event_loop.py) in a single process.
 All default values are configurable from the scheduler.
 """
 import zmq
 import json
 import sys
-from multiprocessing import Process, Manager
 import subprocess
 import netifaces
 import re
 import time
 import signal
+import os
 import monroe_exporter
-import io
-from subprocess import check_output, CalledProcessError
-import datetime
+import functools
+from event_loop import EventLoop
+from rtt_window import Window
+from interface_selector import InterfaceSelector, DEFAULT_POLICY
+from curl_engine import create_downloader
+from result_writer import ResultWriter
+from action_scheduler import ActionScheduler
+from metrics import Metrics, MS_BUCKETS, SECONDS_BUCKETS
 
 # Configuration
 DEBUG = False
@@ -36,8 +43,7 @@ CONFIGFILE = '/monroe/config'
 CURL_CONFIGFILE = '/opt/monroe/curl_config'
 
 # Default values (overwritable from the scheduler)
-# Can only be updated from the main thread and ONLY before any
-# other processes are started
+# Can only be updated before the event loop is started
 EXPCONFIG = {
         "guid": "no.guid.in.config.file",  # Should be overridden by scheduler
         "zmqport": "tcp://172.17.0.1:5556",
@@ -45,23 +51,39 @@ EXPCONFIG = {
         "modem_metadata_topic": "MONROE.META.DEVICE.MODEM",
         "pingTarget": "195.251.209.199",  # default ping target (swn.uom.gr)
         "interval": 5000,  # time in milliseconds between successive packets
+        "fping": "fping",  # fping command (e.g. a stand-in for testing)
         "dataversion": 2,
         "dataid": "MONROE.EXP.UOMPING.PING",
         "dataidCurl": "MONROE.EXP.UOMPING.CURL",
+        "dataidSelection": "MONROE.EXP.UOMPING.SELECTION",
+        "selector": DEFAULT_POLICY,  # Interface selection policy (see interface_selector.py)
         "meta_grace": 120,  # Grace period to wait for interface metadata
         "ifup_interval_check": 5,  # Interval to check if interface is up
         "export_interval": 5.0,
         "verbosity": 0,  # 0 = "Mute", 1=error, 2=Information, 3=verbose
         "resultdir": "/monroe/results/",
         "resultfile": "/monroe/results/results.txt",
+        "result_spooldir": "/tmp/uomping/",  # Where the result file is written until it is complete
+        "result_batch_size": 64*1024,  # Bytes of records written at once
+        "result_flush_interval": 5.0,  # Maximum time in seconds records wait to be written
+        "result_rotate_size": 1024*1024,  # Start a new result file after this many bytes (0 = no size limit)
+        "result_rotate_interval": 300.0,  # or after this many seconds (0 = none, single file if both are 0)
+        "result_compress": False,  # Gzip the result files
         "modeminterfacename": "InternalInterface",
         "interfacenames": ["op0", "op1"],  # Interfaces to run the experiment on
         "interfaces_without_metadata": ["eth0", "wlan0"],  # Manual metadata on these IF
         "size": 3*1024,  # The maximum size in Kbytes to download
-        "time": 3600  # The maximum time in seconds for a download
+        "time": 3600,  # The maximum time in seconds for a download
+        "curl_engine": "pycurl",  # "pycurl" (in process, if installed) or "cli" (curl command)
+        "curl_keepalive": False,  # Reuse the connections across repetitions (pycurl only)
+        "curl_parallel": True,  # Run the dynamic and static executions at the same time
+        "metrics_interval": 60.0,  # Time in seconds between metrics snapshots (0 = none)
+        "metrics_file": "metrics.json",  # Snapshot file in the results directory
+        "metrics_port": 0  # Local port of the Prometheus text endpoint (0 = none)
         }
 
 # Sample curl experiment config file. Will be overwritten by the configuration file.
+# An action with "Every" (seconds) and "Count" is executed Count times, Every seconds apart.
 CURL_EXPCONFIG = {
     "Actions": [
         { "Time": 10, "Repetitions": 2, "Url": "http://www.google.com/" },
@@ -71,69 +93,208 @@ CURL_EXPCONFIG = {
     ]
 }
 
-# What to save from curl
-CURL_METRICS = ('{ '
-                '"Host": "%{remote_ip}", '
-                '"Port": "%{remote_port}", '
-                '"Speed": %{speed_download}, '
-                '"Bytes": %{size_download}, '
-                '"Url": "%{url_effective}", '
-                '"TotalTime": %{time_total}, '
-                '"SetupTime": %{time_starttransfer} '
-                '}')
-
 # The side of the sliding window that will store the latest RTT measurements
 WINDOW_SIZE = 10
 
-# Starting datetime - helps in keeping track of the relative execution times for the curl experiment
-START_DATETIME = datetime.datetime.now()
-
-def run_ping_exp(my_interface_map, expconfig, log_list):
-    global FPING_PROCESS
-
+# Starting time - the times of the curl actions are relative to it
+START_TIME = time.time()
+
+# Regexp to parse fping ouput (one line per reply)
+FPING_REPLY = re.compile(r'^\[(?P<ts>[0-9]+\.[0-9]+)\] (?P<host>[^ ]+) : \[(?P<seq>[0-9]+)\], (?P<bytes>\d+) bytes, (?P<rtt>[0-9]+(?:\.[0-9]+)?) ms \(.*\)$')
+
+# Time in seconds after the next probe is due before a missing reply is reported as lost
+FPING_GRACE = 0.5
+
+# A reply whose send time is in the future or older than this many seconds (the
+# wall clock was stepped between the reply and its reading) does not move the
+# probe schedule
+FPING_MAX_AGE = 5.0
+
+# Counters and histograms of the hot paths (see metrics.py)
+METRICS = Metrics()
+METRICS.declare("uomping_probes_total", "counter", "Probes by interface and result (reply or lost)")
+METRICS.declare("uomping_probe_rtt_ms", "histogram", "RTT of the probe replies in ms", MS_BUCKETS)
+METRICS.declare("uomping_probe_jitter_seconds", "histogram",
+                "Deviation of the send times of consecutive replies from the probe interval", SECONDS_BUCKETS)
+METRICS.declare("uomping_probe_handling_seconds", "histogram",
+                "Time spent handling a read of the fping output", SECONDS_BUCKETS)
+METRICS.declare("uomping_fping_starts_total", "counter", "fping processes started")
+METRICS.declare("uomping_fping_restarts_total", "counter", "fping processes restarted after they exited")
+METRICS.declare("uomping_probe_stops_total", "counter", "Probers stopped because an interface went down")
+METRICS.declare("uomping_metadata_messages_total", "counter", "Metadata messages received")
+METRICS.declare("uomping_metadata_lag_seconds", "histogram",
+                "Time between the Timestamp of a metadata message and its reception", SECONDS_BUCKETS)
+METRICS.declare("uomping_downloads_total", "counter", "Downloads by interface and curl error code")
+METRICS.declare("uomping_curl_setup_seconds", "histogram", "Time until the first byte of a download",
+                SECONDS_BUCKETS)
+METRICS.declare("uomping_curl_download_seconds", "histogram", "Time from the first to the last byte of a download",
+                SECONDS_BUCKETS)
+METRICS.declare("uomping_action_lag_seconds", "histogram", "Scheduling lag of the curl actions", SECONDS_BUCKETS)
+METRICS.declare("uomping_selection_seconds", "histogram", "Decision latency of the interface selection",
+                SECONDS_BUCKETS)
+METRICS.declare("uomping_postponed_selections_total", "counter", "Selections postponed for lack of RTT data")
+METRICS.declare("uomping_writer_pending_batches", "gauge", "Batches waiting for the writer thread")
+METRICS.declare("uomping_writer_records", "gauge", "Records written since the start")
+
+
+class FpingProber(object):
+    """One long-lived fping in loop mode, driven by the event loop.
+
+       Calls on_probe with the reply match (see FPING_REPLY) of every probe or
+       None for a probe without a reply. fping only prints the replies, so a
+       probe is lost when a later sequence number is replied first or when no
+       reply arrives within an interval (plus FPING_GRACE) after the next probe
+       was due. If fping exits it is reaped and restarted after an interval.
+       stop() terminates and reaps fping. name labels the metrics of the prober.
+
+       The due times of the probes follow fping: every reply moves the
+       schedule to its send time (ts - rtt), so a drift of fping's sends or
+       its startup delay does not turn the replies into losses. The schedule
+       is kept on the monotonic clock of the loop, a step of the wall clock
+       does not make probes overdue.
+    """
+    def __init__(self, loop, cmd, interval, on_probe, name=None):
+        self.loop = loop
+        self.cmd = cmd
+        self.interval = interval
+        self.on_probe = on_probe
+        self.name = name
+        self.popen = None
+        self.timer = None
+
+    def start(self):
+        self.popen = subprocess.Popen(self.cmd, stdout=subprocess.PIPE)
+        METRICS.inc("uomping_fping_starts_total", interface=self.name)
+        self.fd = self.popen.stdout.fileno()
+        self.anchor = self.loop.monotonic()  # Monotonic time at which probe 0 was (or would have been) sent
+        self.expected = 0  # Next fping sequence number to report
+        self.pending = ''
+        self.loop.add_reader(self.fd, self.handle_output)
+        self.schedule_overdue()
+
+    def is_running(self):
+        return self.popen is not None or self.timer is not None
+
+    def overdue(self):
+        """Monotonic time at which the expected probe is lost."""
+        return self.anchor + (self.expected + 1) * self.interval + FPING_GRACE
+
+    def schedule_overdue(self):
+        self.loop.cancel(self.timer)
+        self.timer = self.loop.call_later(max(0, self.overdue() - self.loop.monotonic()), self.handle_overdue)
+
+    def handle_overdue(self):
+        if self.loop.monotonic() < self.overdue():  # The wall clock of the timer was stepped
+            self.schedule_overdue()
+            return
+        self.expected += 1
+        self.schedule_overdue()
+        self.on_probe(None)
+
+    def handle_output(self):
+        started = time.time()
+        data = os.read(self.fd, 4096)
+        if not data:  # fping exited
+            self.reap()
+            self.timer = self.loop.call_later(self.interval, self.restart)
+            self.on_probe(None)
+            return
+        lines = (self.pending + data).split('\n')
+        self.pending = lines.pop()
+        # fping prints the times of the loop's clock, converted to the monotonic clock
+        now = self.loop.monotonic()
+        offset = now - self.loop.time()
+        for line in lines:
+            m = FPING_REPLY.match(line)
+            if m is None:
+                continue
+            seq = int(m.group('seq'))
+            # Resynchronise the schedule with the send time of the reply, even
+            # for a reply already reported as lost, so that the next ones are not
+            sent = float(m.group('ts')) - float(m.group('rtt')) / 1000.0 + offset
+            if now - FPING_MAX_AGE <= sent <= now:
+                self.anchor = sent - seq * self.interval
+            if seq < self.expected:
+                continue  # Already reported as lost
+            lost = seq - self.expected
+            self.expected = seq + 1
+            for _ in range(lost):
+                self.on_probe(None)
+            self.on_probe(m)
+        self.schedule_overdue()
+        METRICS.observe("uomping_probe_handling_seconds", time.time() - started, interface=self.name)
+
+    def restart(self):
+        self.timer = None
+        METRICS.inc("uomping_fping_restarts_total", interface=self.name)
+        self.start()
+
+    def reap(self):
+        self.loop.cancel(self.timer)
+        self.timer = None
+        if self.popen is not None:
+            self.loop.remove_reader(self.fd)
+            self.popen.stdout.close()
+            if self.popen.poll() is None:
+                self.popen.terminate()
+            self.popen.wait()
+            self.popen = None
+
+    def stop(self):
+        self.reap()
+
+
+def run_ping_exp(loop, my_interface_map, expconfig, result_writer, on_reply=None):
+    """Start probing the interface. Returns the (started) prober.
+
+       on_reply() is called after the RTT and RSSI of a reply are added to the windows.
+    """
     meta_info = my_interface_map['meta_info']
     rtts = my_interface_map['rtts']
     rssis = my_interface_map['rssis']
-    
-    # Set some variables for saving data every export_interval
-    monroe_exporter.initalize(expconfig['export_interval'],
-                              expconfig['resultdir'])
 
     ifname = meta_info[expconfig["modeminterfacename"]]
     interval = float(expconfig['interval']/1000.0)
     pingTarget = expconfig['pingTarget']
-    cmd = ["fping",
+    # A single fping in loop mode sends a packet every interval until it is terminated
+    cmd = [expconfig.get('fping', "fping"),
            "-I", ifname,
            "-D",
-           "-c", "1",
+           "-l",
+           "-p", str(int(expconfig['interval'])),
            pingTarget]
-    # Regexp to parse fping ouput from command
-    r = re.compile(r'^\[(?P<ts>[0-9]+\.[0-9]+)\] (?P<host>[^ ]+) : \[(?P<seq>[0-9]+)\], (?P<bytes>\d+) bytes, (?P<rtt>[0-9]+(?:\.[0-9]+)?) ms \(.*\)$')
-
-    # This is the inner loop where we wait for output from fping
-    # This will run until we get a interface hickup, where the process will be
-    # killed from parent process.
-    seq = 0
-    while True:
-        popen = subprocess.Popen(cmd,
-                                 stdout=subprocess.PIPE,
-                                 bufsize=1)
-        output = popen.stdout.readline()
-        m = r.match(output)
+
+    seq = [0]
+    # fping sequence number and send time of the previous reply, for the jitter
+    previous = [None, None]
+
+    # Called by the prober for every packet
+    def report(m):
         if m is not None:  # We could send and got a reply
             # keys are defined in regexp compilation. Nice!
             exp_result = m.groupdict()
+
+            fpingSeq = int(exp_result['seq'])
+            sent = float(exp_result['ts']) - float(exp_result['rtt']) / 1000.0
+            if previous[0] is not None and fpingSeq > previous[0]:  # Not the first reply of a new fping
+                METRICS.observe("uomping_probe_jitter_seconds",
+                                abs(sent - previous[1] - (fpingSeq - previous[0]) * interval), interface=ifname)
+            previous[:] = [fpingSeq, sent]
+            METRICS.inc("uomping_probes_total", interface=ifname, result="reply")
+            METRICS.observe("uomping_probe_rtt_ms", float(exp_result['rtt']), interface=ifname)
             
             # Add RTT and RSSI values to the relevant lists (aka windows)
-            add_value(rtts, float(exp_result['rtt']))
-            add_value(rssis, meta_info["RSSI"])
+            rtts.add(float(exp_result['rtt']))
+            rssis.add(meta_info["RSSI"])
+            if on_reply is not None:
+                on_reply()
             
             msg = {
                             'Bytes': int(exp_result['bytes']),
                             'Host': exp_result['host'],
                             'Rtt': float(exp_result['rtt']),
-                            'AvgRtt': calc_avg(rtts),
-                            'SequenceNumber': int(seq),
+                            'AvgRtt': rtts.mean(),
+                            'SequenceNumber': int(seq[0]),
                             'Timestamp': float(exp_result['ts']),
                             "Guid": expconfig['guid'],
                             "DataId": expconfig['dataid'],
@@ -143,13 +304,14 @@ def run_ping_exp(my_interface_map, expconfig, log_list):
                             "Iccid": meta_info["ICCID"],
                             "Operator": meta_info["Operator"],
                             "Rssi": meta_info["RSSI"],
-                            "AvgRssi": calc_avg(rssis),
+                            "AvgRssi": rssis.mean(),
                   }
 
         else:  # We lost the interface or did not get a reply
+            METRICS.inc("uomping_probes_total", interface=ifname, result="lost")
             msg = {
                             'Host': pingTarget,
-                            'SequenceNumber': int(seq),
+                            'SequenceNumber': int(seq[0]),
                             'Timestamp': time.time(),
                             "Guid": expconfig['guid'],
                             "DataId": expconfig['dataid'],
@@ -165,170 +327,198 @@ def run_ping_exp(my_interface_map, expconfig, log_list):
         if not DEBUG:
             # We have already initalized the exporter with the export dir
             monroe_exporter.save_output(msg)
-            log_list.append(unicode(json.dumps(msg) + '\n'))
-            # with io.open(expconfig['resultfile'], 'a') as f:
-            #    f.write(unicode(json.dumps(msg) + '\n'))
-
-        seq += 1
-        # Sleep for the predefined interval and re-execute loop
-        time.sleep(interval)
-    # Cleanup
-    if expconfig['verbosity'] > 1:
-        print "Cleaning up fping process"
-    popen.stdout.close()
-    popen.terminate()
-    popen.kill()
-
-def run_curl_exp(interfacesMap, expconfig, curl_config, log_list):
-    # Create a local copy of the actions key of the config dictionary
-    # The local copy will be changed and then re-assigned to the multiprocessing
-    # proxy so that the shared data structure is updated
-    local_actions = curl_config['Actions']
-    
-    # Find next action. If no action is found action will be None
-    action = find_next_action(local_actions, expconfig)
+            result_writer.write(msg)
 
-    while action is not None:
-        selectedInterface = None
-        minRtt = -1
-        
-        # Loop through all available interface, calculate the average RTT for each and
-        # find the interface with the smallest RTT. Only consider interfaces with at least
-        # one measurement
-        for interface, value in interfacesMap.iteritems():
-            interfaceAvg = calc_avg(interfacesMap[interface]['rtts'])
-            if interfaceAvg > -1:
-                if selectedInterface is None:
-                    selectedInterface = interface
-                    minRtt = interfaceAvg
-                elif interfaceAvg < minRtt:
-                    selectedInterface = interface
-                    minRtt = calc_avg(interfacesMap[interface]['rtts'])
-
-            if selectedInterface is None and expconfig['verbosity'] > 1:
-                print "No RTT data. Curl action aborted"
-                return
+        seq[0] += 1
 
-        if expconfig['verbosity'] > 1:
-            print "Selected interface is " + selectedInterface
-       
-        executeAction(action, selectedInterface, expconfig, log_list, True)
-        
-        for interface, value in interfacesMap.iteritems():
-            selectedInterface = interface
-            break;
-        
-        executeAction(action, selectedInterface, expconfig, log_list, False)
-        
-        # Mark action as executed
-        action['IsExecuted'] = True
-        # Re-assign the dictionary to the proxy
-        curl_config['Actions'] = local_actions
-        # Re-assign the actions dictionary to the local variable (not sure if it is necessary)       
-        local_actions = curl_config['Actions']
-        
-        # Get the next action
-        action = find_next_action(local_actions, expconfig)
+    prober = FpingProber(loop, cmd, interval, report, ifname)
+    prober.start()
+    return prober
 
-def executeAction(action, selectedInterface, expconfig, log_list, dynamicSelection):
-    meta_info = interfacesMap[selectedInterface]['meta_info']
-    rssis = interfacesMap[selectedInterface]['rssis']
-    rtts = interfacesMap[selectedInterface]['rtts']
 
-    ifname = meta_info[expconfig["modeminterfacename"]]
-    interval = float(expconfig['interval']/1000.0)
+def run_downloads(downloader, url, devices, repetitions, on_result, on_done):
+    """Download url for every repetition (ifname, dynamicSelection, i) one after the other.
 
-    cmd = ["curl",
-           "-o", "/dev/null",  # to not output filecontents on stdout
-           "--fail",  # to get the curl exit code 22 for http failures
-           "--insecure",  # to allow selfsigned certificates
-           "--raw",
-           "--silent",
-           "--write-out", "{}".format(CURL_METRICS),
-           "--interface", "{}".format(ifname),
-           "--max-time", "{}".format(expconfig['time']),
-           # "--range", "0-{}".format(expconfig['size'] - 1),
-           "{}".format(action['Url'])]
-
-    # Safeguard to always have a defined output variable
-    output = None
-    
-    # Iterate over the number of repetitions for the current action
-    for i in range(0, action['Repetitions']):
-        err_code = 0
-        try:
-            start_curl = time.time()
+       The downloads use the network interface devices[ifname]. on_result(repetition,
+       metrics, err_code, started, error) is called after every download and
+       on_done() after the last one.
+    """
+    repetitions = list(repetitions)
+
+    def next_download():
+        if not repetitions:
+            on_done()
+            return
+        repetition = repetitions.pop(0)
+
+        def done(metrics, err_code, started, error):
             try:
-                output = check_output(cmd)
-            except CalledProcessError as e:
-                    err_code = e.returncode # AEL get the error code here
-                    output = e.output
-                    # if e.returncode == 28:  # time-limit exceeded
-                    #     if expconfig['verbosity'] > 2:
-                    #         print ("Exceding timelimit {}, "
-                    #                "saving what we have").format(expconfig['time'])
-                    #     output = e.output
-                    # else:
-                    #     raise e
-            # Clean away leading and trailing whitespace
-            output = output.strip(' \t\r\n\0')
-            # Convert to JSON
-            msg = json.loads(output)
-            msg.update({
-                "ErrorCode": err_code,
-                "Guid": expconfig['guid'],
-                "DataId": expconfig['dataidCurl'],
-                "DataVersion": expconfig['dataversion'],
-                "NodeId": expconfig['nodeid'],
-                "Timestamp": start_curl,
-                "Iccid": meta_info["ICCID"],
-                "Operator": meta_info["Operator"],
-                "DownloadTime": msg["TotalTime"] - msg["SetupTime"],
-                "SequenceNumber": i
-            })
-            
-            if dynamicSelection:
-                msg.update({ "DynamicSelection": True })
-            else:
-                msg.update({ "DynamicSelection": False })
-            
-            if expconfig['verbosity'] > 2:
-                print msg
-            if not DEBUG:
-                monroe_exporter.save_output(msg, expconfig['resultdir'])
-                log_list.append(unicode(json.dumps(msg) + '\n'))
-        except Exception as e:
-            if expconfig['verbosity'] > 0:
-                print ("Execution or parsing failed for "
-                       "command : {}, "
-                       "output : {}, "
-                       "error: {}").format(cmd, output, e)
+                on_result(repetition, metrics, err_code, started, error)
+            finally:
+                next_download()
+
+        downloader.download(devices[repetition[0]], url, done)
+
+    next_download()
 
-def metadata(meta_ifinfo, ifname, expconfig):
-    """Seperate process that attach to the ZeroMQ socket as a subscriber.
+def run_curl_exp(action, lag, done, interfacesMap, selector, downloader, expconfig, result_writer):
+    """Execute an action, started lag seconds after it was due (see action_scheduler.py).
 
-        Will listen forever to messages with topic defined in topic and update
-        the meta_ifinfo dictionary (a Manager dict).
+       Returns False if the action cannot be executed yet, otherwise done() is
+       called once all its downloads have finished.
+    """
+    # The selector only considers interfaces with at least one RTT measurement
+    selectedInterface, decision = selector.select()
+    METRICS.observe("uomping_selection_seconds", decision['DecisionLatency'])
+
+    # Only the decisions are saved, a postponed action is retried until one is
+    # made and its wait is part of the scheduling lag of the saved decision
+    if selectedInterface is None:
+        METRICS.inc("uomping_postponed_selections_total")
+        if expconfig['verbosity'] > 1:
+            print "No RTT data. Curl action postponed"
+        return False
+    save_decision(decision, action, lag, expconfig, result_writer)
+
+    if expconfig['verbosity'] > 1:
+        print "Selected interface is {} ({})".format(selectedInterface, decision['Reason'])
+
+    for interface, value in interfacesMap.iteritems():
+        staticInterface = interface
+        break;
+
+    # The repetitions over the selected interface (dynamic execution) and over the
+    # first interface (static execution). They run at the same time unless both
+    # executions use the same interface, then the static one follows.
+    dynamic = [(selectedInterface, True, i) for i in range(action['Repetitions'])]
+    static = [(staticInterface, False, i) for i in range(action['Repetitions'])]
+    if expconfig['curl_parallel'] and selectedInterface != staticInterface:
+        executions = [dynamic, static]
+    else:
+        executions = [dynamic + static]
+    METRICS.observe("uomping_action_lag_seconds", lag)
+
+    def on_result(repetition, metrics, err_code, start_curl, error):
+        ifname, dynamicSelection, i = repetition
+        msg = save_curl_output(metrics, err_code, start_curl, i, interfacesMap[ifname]['meta_info'], expconfig,
+                               result_writer, dynamicSelection, error)
+        if msg is not None and err_code == 0:
+            selector.download_update(ifname, msg['Speed'])
+
+    pending = [len(executions)]
+
+    def on_done():
+        pending[0] -= 1
+        if not pending[0]:
+            done()
+
+    devices = dict((ifname, interfacesMap[ifname]['meta_info'][expconfig["modeminterfacename"]])
+                   for ifname in (selectedInterface, staticInterface))
+    for repetitions in executions:
+        run_downloads(downloader, action['Url'], devices, repetitions, on_result, on_done)
+    return True
+
+def save_curl_output(metrics, err_code, start_curl, i, meta_info, expconfig, result_writer, dynamicSelection, error=None):
+    """Save the CURL_METRICS of the i-th repetition of a download. Returns the saved record (None if it failed)."""
+    ifname = meta_info[expconfig["modeminterfacename"]]
+    METRICS.inc("uomping_downloads_total", interface=ifname, error=err_code)
+    if metrics is None:
+        if expconfig['verbosity'] > 0:
+            print "Parsing failed for {}".format(error)
+        return None
+    try:
+        msg = dict(metrics)
+        msg.update({
+            "ErrorCode": err_code,
+            "Guid": expconfig['guid'],
+            "DataId": expconfig['dataidCurl'],
+            "DataVersion": expconfig['dataversion'],
+            "NodeId": expconfig['nodeid'],
+            "Timestamp": start_curl,
+            "Iccid": meta_info["ICCID"],
+            "Operator": meta_info["Operator"],
+            "DownloadTime": msg["TotalTime"] - msg["SetupTime"],
+            "SequenceNumber": i
+        })
+        if err_code == 0:
+            METRICS.observe("uomping_curl_setup_seconds", msg["SetupTime"], interface=ifname)
+            METRICS.observe("uomping_curl_download_seconds", msg["DownloadTime"], interface=ifname)
+        
+        if dynamicSelection:
+            msg.update({ "DynamicSelection": True })
+        else:
+            msg.update({ "DynamicSelection": False })
+        
+        if expconfig['verbosity'] > 2:
+            print msg
+        if not DEBUG:
+            monroe_exporter.save_output(msg, expconfig['resultdir'])
+            result_writer.write(msg)
+        return msg
+    except Exception as e:
+        if expconfig['verbosity'] > 0:
+            print ("Saving failed for "
+                   "metrics : {}, "
+                   "error: {}").format(metrics, e)
+        return None
+
+def save_decision(decision, action, lag, expconfig, result_writer):
+    """Save the interface selection of an action with its reason and latency and the scheduling lag."""
+    msg = dict(decision)
+    msg.update({
+        "SchedulingLag": lag,
+        "Guid": expconfig['guid'],
+        "DataId": expconfig['dataidSelection'],
+        "DataVersion": expconfig['dataversion'],
+        "NodeId": expconfig['nodeid'],
+        "Timestamp": time.time(),
+        "Url": action['Url']
+    })
+    if expconfig['verbosity'] > 2:
+        print msg
+    if not DEBUG:
+        result_writer.write(msg)
+
+def subscribe_metadata(loop, context, interfacesMap, expconfig):
+    """Attach to the ZeroMQ socket as the subscriber of all interfaces.
+
+        Whenever the socket is readable, every message with topic defined in
+        topic is decoded once and the keys that changed are updated in the
+        meta_info dictionary of its interface. Returns the socket.
     """
-    context = zmq.Context()
     socket = context.socket(zmq.SUB)
     socket.connect(expconfig['zmqport'])
     socket.setsockopt(zmq.SUBSCRIBE, expconfig['modem_metadata_topic'])
     # End Attach
-    while True:
-        data = socket.recv()
-        try:
-            ifinfo = json.loads(data.split(" ", 1)[1])
-            if (expconfig["modeminterfacename"] in ifinfo and
-                    ifinfo[expconfig["modeminterfacename"]] == ifname):
-                # In place manipulation of the reference variable
-                for key, value in ifinfo.iteritems():
-                    meta_ifinfo[key] = value
-        except Exception as e:
-            if expconfig['verbosity'] > 0:
-                print ("Cannot get modem metadata in http container"
-                       "error : {} , {}").format(e, expconfig['guid'])
-            pass
+
+    # Interface name in the metadata -> meta_info of the interface
+    meta_infos = dict((ifname, value['meta_info']) for ifname, value in interfacesMap.iteritems())
+
+    def receive():
+        while True:
+            try:
+                data = socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            METRICS.inc("uomping_metadata_messages_total")
+            try:
+                ifinfo = json.loads(data.split(" ", 1)[1])
+                meta_info = meta_infos.get(ifinfo.get(expconfig["modeminterfacename"]))
+                if meta_info is not None:
+                    if "Timestamp" in ifinfo:
+                        METRICS.observe("uomping_metadata_lag_seconds", time.time() - ifinfo["Timestamp"],
+                                        interface=ifinfo[expconfig["modeminterfacename"]])
+                    for key, value in ifinfo.iteritems():
+                        if meta_info.get(key) != value:
+                            meta_info[key] = value
+            except Exception as e:
+                if expconfig['verbosity'] > 0:
+                    print ("Cannot get modem metadata in http container"
+                           "error : {} , {}").format(e, expconfig['guid'])
+                pass
+
+    loop.add_reader(socket, receive)
+    return socket
 
 
 # Helper functions could be moved to monroe_utils
@@ -357,47 +547,6 @@ def add_manual_metadata_information(info, ifname, expconfig):
     info["Timestamp"] = time.time()
 
 
-def create_meta_process(ifname, expconfig):
-    """Create a meta process and a shared dict for modem metadata state."""
-    meta_info = Manager().dict()
-    process = Process(target=metadata,
-                      args=(meta_info, ifname, expconfig, ))
-    process.daemon = True
-    return (meta_info, process)
-
-
-def create_ping_exp_process(my_interface_map, expconfig, log_list):
-    """This create a ping experiment thread."""
-    process = Process(target=run_ping_exp, args=(my_interface_map, expconfig, log_list, ))
-    process.daemon = True
-    return process
-
-def create_curl_exp_process(interfaces_map, expconfig, curlconfig, log_list):
-    """This create a curl experiment thread."""
-    process = Process(target=run_curl_exp, args=(interfaces_map, expconfig, curlconfig, log_list, ))
-    process.daemon = True
-    return process
-
-def any_meta_dead(expconfig, interfacesMap):
-    """Is any meta process not running?"""
-    ifnames = expconfig['interfacenames'] # List of interfaces to check
-
-    for ifname in ifnames:
-        if not interfacesMap[ifname]['meta_process'].is_alive():
-            return True
-    return False
-
-def start_dead_meta(expconfig, interfacesMap):
-    """Start meta processes that are not running"""
-    ifnames = expconfig['interfacenames'] # List of interfaces to check
-
-    for ifname in ifnames:
-        if not interfacesMap[ifname]['meta_process'].is_alive():
-            interfacesMap[ifname]['meta_info'], interfacesMap[ifname]['meta_process'] = create_meta_process(ifname, expconfig)
-            interfacesMap[ifname]['meta_process'].start()
-            if interfacesMap[ifname]['ping_exp_process'].is_alive():  # Clean up the exp_thread
-                interfacesMap[ifname]['ping_exp_process'].terminate()
-
 def add_ifs_metadata(expconfig, interfacesMap):
     """Add metadata to all applicable interfaces"""
     ifnames = expconfig['interfacenames'] # List of interfaces to check
@@ -414,96 +563,93 @@ def all_ifs_are_up(expconfig, interfacesMap):
     ifnames = expconfig['interfacenames'] # List of interfaces to check
     for ifname in ifnames:
         # Do we have the interfaces up ?
-        if not (check_if(ifname) and check_meta(interfacesMap[ifname]['meta_info'], meta_grace, expconfig)):    
+        if not (check_if(ifname) and check_meta(interfacesMap[ifname]['meta_info'], expconfig['meta_grace'], expconfig)):
             return False
     return True
 
 def all_exp_completed(expconfig, interfacesMap):
-    """Check if all exp processes have completed"""
+    """Check if all exp probers have stopped"""
     ifnames = expconfig['interfacenames'] # List of interfaces to check
 
     for ifname in ifnames:
-        if interfacesMap[ifname]['ping_exp_process'].is_alive():
+        if interfacesMap[ifname]['ping_exp'] is not None:
             return False
     return True
     
-def start_all_exp(expconfig, interfacesMap):
-    """Start all exp processes. If any is still running kill it first"""
+def start_all_exp(loop, expconfig, interfacesMap, selector, result_writer):
+    """Start the probers of all interfaces that are up"""
     ifnames = expconfig['interfacenames'] # List of interfaces to check
     
     for ifname in ifnames:
         # Do we have the interfaces up ?
-        if (check_if(ifname) and check_meta(interfacesMap[ifname]['meta_info'], meta_grace, expconfig)):
+        if (check_if(ifname) and check_meta(interfacesMap[ifname]['meta_info'], expconfig['meta_grace'], expconfig)):
             # We are all good
             if expconfig['verbosity'] > 2:
                 print "Interface {} is up".format(ifname)
-            if interfacesMap[ifname]['ping_exp_process'].is_alive():
-                interfacesMap[ifname]['ping_exp_process'].terminate()
-            interfacesMap[ifname]['ping_exp_process'].start()
-
-def recreate_all_exp(expconfig, interfacesMap, log_list):
-    """Recreate all experiment processes"""
+            if interfacesMap[ifname]['ping_exp'] is not None:
+                interfacesMap[ifname]['ping_exp'].stop()
+            interfacesMap[ifname]['ping_exp'] = run_ping_exp(loop, interfacesMap[ifname], expconfig, result_writer,
+                                                          functools.partial(selector.probe_update, ifname))
+
+def recreate_all_exp(expconfig, interfacesMap, selector):
+    """Stop all experiment probers, they are started again once all interfaces are up.
+       The selector forgets the probes of the stopped interfaces."""
     ifnames = expconfig['interfacenames'] # List of interfaces to check
-    if_without_metadata = expconfig['interfaces_without_metadata']
-    
-    meta_grace = expconfig['meta_grace']
+
     for ifname in ifnames:
-        if interfacesMap[ifname]['ping_exp_process'].is_alive():
+        if interfacesMap[ifname]['ping_exp'] is not None:
             if expconfig['verbosity'] > 2:
                 print ("Interface {} is down and "
                        "experiment are running").format(ifname)
             # Interfaces down and we are running
-            interfacesMap[ifname]['ping_exp_process'].terminate()
-        interfacesMap[ifname]['ping_exp_process'] = create_ping_exp_process(interfacesMap[ifname], expconfig, log_list)
+            interfacesMap[ifname]['ping_exp'].stop()
+            selector.reset(ifname)
+        interfacesMap[ifname]['ping_exp'] = None
 
-def add_value(window, value):
-    """Add new value to a window"""
-    if len(window) < WINDOW_SIZE:
-        window.insert(0, value)
-    else:
-        window.pop()
-        window.insert(0, value)
-
-def calc_avg(window):
-    """Calculate average for the given window"""
-    runningSum = 0.0
-    for x in window:
-        runningSum += x
-    if len(window) > 0:
-        return runningSum / len(window)
-    return -1
-
-def find_next_action(curl_actions, expconfig):
-    currentTime = datetime.datetime.now()
-    
-    if expconfig['verbosity'] > 1:
-        for action in curl_actions:
-            print action['Time']
-            print action['Repetitions']
-            print action['Url']
-            print action['IsExecuted']
-            print '------------------'
-    
-    # Find the first action with a Time less than or equal to the current time
-    for action in curl_actions:
-        # Convert relative action time to absolute based on the START_DATETIME set at the
-        # experiment start
-        eventTime = START_DATETIME + datetime.timedelta(0, action['Time'])
-        if not action['IsExecuted'] and eventTime <= currentTime:
-            return action;
-    
-    return None
+def control(loop, expconfig, interfacesMap, selector, result_writer):
+    """Periodic check of the interfaces."""
+    add_ifs_metadata(expconfig, interfacesMap)
 
-def all_actions_executed(curl_actions):
-    # Check if all actions are executed
-    for action in curl_actions:
-        if not action['IsExecuted']:
-            return False;
+    if all_ifs_are_up(expconfig, interfacesMap):
+        if all_exp_completed(expconfig, interfacesMap):
+            if expconfig['verbosity'] > 2:
+                print "Starting all exp"
+            start_all_exp(loop, expconfig, interfacesMap, selector, result_writer)
+    else:
+        if expconfig['verbosity'] > 2:
+            print "Recreating all exp"
+        for ifname, value in interfacesMap.iteritems():
+            if value['ping_exp'] is not None:
+                METRICS.inc("uomping_probe_stops_total", interface=ifname)
+        recreate_all_exp(expconfig, interfacesMap, selector)
+
+    loop.call_later(expconfig['ifup_interval_check'], control, loop, expconfig, interfacesMap, selector,
+                    result_writer)
+
+def save_metrics(expconfig, result_writer):
+    """Write a snapshot of the metrics to the metrics file in the results directory."""
+    METRICS.set("uomping_writer_pending_batches", result_writer.pending())
+    METRICS.set("uomping_writer_records", result_writer.records)
+    extra = {
+        "Guid": expconfig['guid'],
+        "NodeId": expconfig['nodeid'],
+        "Timestamp": time.time(),
+        "Uptime": time.time() - START_TIME
+    }
+    try:
+        METRICS.save_snapshot(os.path.join(expconfig['resultdir'], expconfig['metrics_file']),
+                              expconfig['result_spooldir'], extra)
+    except Exception as e:
+        if expconfig['verbosity'] > 0:
+            print "Cannot save the metrics {}".format(e)
 
-    return True
+def report_metrics(loop, expconfig, result_writer):
+    """Periodic snapshot of the metrics."""
+    save_metrics(expconfig, result_writer)
+    loop.call_later(expconfig['metrics_interval'], report_metrics, loop, expconfig, result_writer)
 
 if __name__ == '__main__':
-    """The main thread control the processes (experiment/metadata)."""
+    """The main function sets up the event loop that handles metadata, probing and curl actions."""
     
     if not DEBUG:
         import monroe_exporter
@@ -517,21 +663,12 @@ if __name__ == '__main__':
             
         # Try to get the curl experiment config
         try:
-            curl_config = Manager().dict()
             with open(CURL_CONFIGFILE) as curl_configfd:
                 CURL_EXPCONFIG = json.load(curl_configfd)
         except Exception as e:
             print "Cannot retrieve expconfig {}".format(e)
             raise e
-        
-        if EXPCONFIG['verbosity'] > 1:
-            print "Falsifying..."
 
-        for action in CURL_EXPCONFIG['Actions']:
-            action['IsExecuted'] = False
-
-        curl_config.update(CURL_EXPCONFIG)
-        
     else:
         # We are in debug state always put out all information
         EXPCONFIG['verbosity'] = 3
@@ -557,72 +694,80 @@ if __name__ == '__main__':
     if EXPCONFIG['verbosity'] > 2:
         print EXPCONFIG
 
-    # Create a shared list to store logs
-    log_list = Manager().list()
-
+    # Set some variables for saving data every export_interval
+    monroe_exporter.initalize(EXPCONFIG['export_interval'],
+                              EXPCONFIG['resultdir'])
+
+    loop = EventLoop()
+
+    # Writes the records to the result file in batches
+    result_writer = ResultWriter(loop, EXPCONFIG['resultfile'], EXPCONFIG['result_spooldir'],
+                                 batchSize=EXPCONFIG['result_batch_size'],
+                                 flushInterval=EXPCONFIG['result_flush_interval'],
+                                 rotateSize=EXPCONFIG['result_rotate_size'],
+                                 rotateInterval=EXPCONFIG['result_rotate_interval'],
+                                 compress=EXPCONFIG['result_compress'])
+    context = zmq.Context()
     interfacesMap = {}
     
     for ifname in ifnames:
         # Create a map to hold information relevant to this interface
         interfacesMap[ifname] = {}
-        # Create a process for getting the metadata
-        interfacesMap[ifname]['meta_info'], interfacesMap[ifname]['meta_process'] = create_meta_process(ifname, EXPCONFIG)
-        interfacesMap[ifname]['meta_process'].start()
+        # Metadata of the interface
+        interfacesMap[ifname]['meta_info'] = {}
 
-        # Create an experiment script
-        interfacesMap[ifname]['ping_exp_process'] = create_ping_exp_process(interfacesMap[ifname], EXPCONFIG, log_list)
+        # The prober is started once all interfaces are up
+        interfacesMap[ifname]['ping_exp'] = None
         
         # Initialize value windows
-        interfacesMap[ifname]['rtts'] = Manager().list()
-        interfacesMap[ifname]['rssis'] = Manager().list()
-    
-    curl_exp_process = create_curl_exp_process(interfacesMap, EXPCONFIG, curl_config, log_list)
-    
-    # Control the processes
-    while True:
-        # If any of the meta is dead restart it and terminate all possible processes that may be still running
-        if any_meta_dead(EXPCONFIG, interfacesMap):
-            if EXPCONFIG['verbosity'] > 2:
-                print "Any meta dead"
-            for ifname in ifnames:
-                if not interfacesMap[ifname]['meta_process'].is_alive():
-                    interfacesMap[ifname]['meta_info'], interfacesMap[ifname]['meta_process'] = create_meta_process(ifname, expconfig)
-                    interfacesMap[ifname]['meta_process'].start()
-                if interfacesMap[ifname]['ping_exp_process'].is_alive():  # Clean up the exp_thread
-                    interfacesMap[ifname]['ping_exp_process'].terminate()
-                
-                interfacesMap[ifname]['ping_exp_process'] = create_ping_exp_process(interfacesMap[ifname], EXPCONFIG)
-            if curl_exp_process.is_alive():
-                curl_exp_process.terminate()
-            curl_exp_process = create_curl_exp_process(interfacesMap, EXPCONFIG, curl_config, log_list)
-
-        add_ifs_metadata(EXPCONFIG, interfacesMap)
-
-        if all_ifs_are_up(EXPCONFIG, interfacesMap):
-            if all_exp_completed(EXPCONFIG, interfacesMap):
-                if EXPCONFIG['verbosity'] > 2:
-                    print "Starting all exp"
-                start_all_exp(EXPCONFIG, interfacesMap)
-        else:
-            if EXPCONFIG['verbosity'] > 2:
-                print "Recreating all exp"
-            recreate_all_exp(EXPCONFIG, interfacesMap, log_list)
+        interfacesMap[ifname]['rtts'] = Window(WINDOW_SIZE)
+        interfacesMap[ifname]['rssis'] = Window(WINDOW_SIZE)
 
-        if not curl_exp_process.is_alive():
-            curl_exp_process = create_curl_exp_process(interfacesMap, EXPCONFIG, curl_config, log_list)
-            curl_exp_process.start()
-        
-        if all_actions_executed(curl_config['Actions']):
-            break
-        else:
-            time.sleep(ifup_interval_check)
-            
-    for ifname in ifnames:
-        interfacesMap[ifname]['meta_process'].terminate()
-        interfacesMap[ifname]['ping_exp_process'].terminate()
-    curl_exp_process.terminate()
-    
-    # Output log list entries to file
-    with io.open(EXPCONFIG['resultfile'], 'w') as f:
-        for log in log_list:
-            f.write(log)
+    # One subscription for the metadata of all interfaces
+    meta_socket = subscribe_metadata(loop, context, interfacesMap, EXPCONFIG)
+
+    # Selects the interface of the dynamic execution, fed by the probes and the downloads
+    try:
+        selector = InterfaceSelector(EXPCONFIG['selector'], interfacesMap)
+    except ValueError as e:
+        print e
+        raise e
+
+    # Runs the downloads of the curl actions
+    downloader = create_downloader(loop, EXPCONFIG)
+
+    # Executes the curl actions at their times, the experiment ends after the last one
+    def run_action(action, lag, done):
+        return run_curl_exp(action, lag, done, interfacesMap, selector, downloader, EXPCONFIG, result_writer)
+
+    try:
+        scheduler = ActionScheduler(loop, CURL_EXPCONFIG['Actions'], START_TIME, run_action, loop.stop,
+                                    retry=ifup_interval_check)
+    except ValueError as e:
+        print e
+        raise e
+
+    # Terminating the container stops the loop through the finally clause, so
+    # that fping and curl are terminated and reaped as well
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        if EXPCONFIG['metrics_port']:
+            METRICS.serve(EXPCONFIG['metrics_port'])
+        if EXPCONFIG['metrics_interval']:
+            loop.call_later(EXPCONFIG['metrics_interval'], report_metrics, loop, EXPCONFIG, result_writer)
+        loop.call_later(0, control, loop, EXPCONFIG, interfacesMap, selector, result_writer)
+        loop.run()
+    finally:
+        recreate_all_exp(EXPCONFIG, interfacesMap, selector)
+        downloader.stop()
+        meta_socket.close()
+        context.term()
+        result_writer.close()
+        # The last snapshot covers the whole experiment
+        if EXPCONFIG['metrics_interval']:
+            save_metrics(EXPCONFIG, result_writer)
+        METRICS.stop()
+
+    if EXPCONFIG['verbosity'] > 1 and scheduler.lagCount:
+        print "Scheduling lag of the curl actions: mean {:.3f} s, max {:.3f} s".format(scheduler.mean_lag(),
+                                                                                       scheduler.lagMax)
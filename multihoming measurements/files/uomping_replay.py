@@ -0,0 +1,523 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Replay harness of the multi-homing experiment, to measure scheduler and
+selector changes offline without modems.
+
+The RTT, RSSI and download speed of every interface come from a trace: the
+records of an earlier run (a results file such as results28972.txt, the
+interfaces being the ones of its ping records) or synthetic random walks
+(--synthetic N, reproducible with --seed). The harness runs the code of
+uomping_experiment.py on fake interfaces named as in the trace:
+    probes      run_ping_exp starts this script as its fping command, which
+                prints the replies (and losses) of the trace
+    metadata    a local ZeroMQ publisher sends the RSSI of the trace to
+                subscribe_metadata
+    downloads   run_curl_exp downloads over the loopback interface from a
+                local HTTP server that replays the setup time and speed of the
+                trace for the interface
+    actions     one action every --action-interval seconds, scheduled by the
+                ActionScheduler and selected by the --selector policy
+The event loop runs on a virtual clock --speedup times faster than real time,
+and the trace is looked up at virtual times, so a run replays the same
+conditions whatever the speedup (only the measured overhead depends on the
+machine).
+
+At the end a report (also written to replay.json in the output directory)
+gives the throughput (probes, records and downloads per real second), the
+selection quality (how often the interface with the best speed in the trace
+was selected, the mean regret and the speed of the dynamic and static
+executions) and the overhead (CPU time, probe handling time, decision latency
+and scheduling lag).
+
+    python uomping_replay.py --trace results28972.txt --speedup 10
+    python uomping_replay.py --synthetic 3 --duration 1800 --selector ucb
+"""
+import argparse
+import BaseHTTPServer
+import bisect
+import functools
+import json
+import os
+import random
+import resource
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import types
+import zmq
+
+# The replay writes its records with the result writer only, the MONROE
+# exporter (not installed outside the MONROE containers) is replaced by a stub
+monroe_exporter = types.ModuleType("monroe_exporter")
+monroe_exporter.initalize = lambda interval, resultdir: None
+monroe_exporter.save_output = lambda msg, resultdir=None: None
+sys.modules["monroe_exporter"] = monroe_exporter
+
+from uomping_experiment import (EXPCONFIG, WINDOW_SIZE, METRICS, run_ping_exp, run_curl_exp, subscribe_metadata)
+from event_loop import EventLoop
+from rtt_window import Window
+from interface_selector import InterfaceSelector, DEFAULT_POLICY
+from curl_engine import create_downloader
+from result_writer import ResultWriter
+from action_scheduler import ActionScheduler
+
+SYNTHETIC_DURATION = 600
+SYNTHETIC_BYTES = 200000
+# Interval in seconds between the download samples of a synthetic trace
+SYNTHETIC_DOWNLOAD_INTERVAL = 10
+
+# Size of the chunks sent by the HTTP server
+CHUNK_SIZE = 16 * 1024
+
+
+class VirtualLoop(EventLoop):
+    """Event loop whose time runs speedup times faster than real time."""
+    def __init__(self, speedup, start=None, realStart=None):
+        super(VirtualLoop, self).__init__()
+        self.speedup = float(speedup)
+        self.realStart = time.time() if realStart is None else realStart
+        self.start = self.realStart if start is None else start
+
+    def time(self):
+        return self.start + (time.time() - self.realStart) * self.speedup
+
+    def monotonic(self):
+        # The fake fping prints virtual times, the durations are measured in the same time
+        return self.time()
+
+    def wait_time(self, when):
+        return (when - self.time()) / self.speedup
+
+    def real_time(self, when):
+        """Real time at which the loop reaches time when."""
+        return self.realStart + (when - self.start) / self.speedup
+
+
+###############################################################################
+# Traces: {"Duration": seconds, "Interfaces": {ifname: {"Operator", "Iccid",
+#   "Pings": [[offset, rtt (None if lost), rssi], ...],
+#   "Downloads": [[offset, speed, setup time, bytes], ...]}}}
+# with the offsets in seconds from the start of the trace, in time order.
+
+def load_trace(fileName):
+    """Trace of the ping and curl records of a results file."""
+    records = []
+    with open(fileName) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    if not records:
+        raise ValueError("No records in {}".format(fileName))
+    start = min(record['Timestamp'] for record in records)
+    end = max(record['Timestamp'] for record in records)
+
+    interfaces = {}
+    operators = {}  # The curl records only have the operator of the interface
+    for record in sorted(records, key=lambda record: record['Timestamp']):
+        if record['DataId'] == EXPCONFIG['dataid'] and 'Interface' in record:
+            interface = interfaces.setdefault(record['Interface'], {"Operator": record['Operator'],
+                                                                    "Iccid": record['Iccid'],
+                                                                    "Pings": [], "Downloads": []})
+            operators[record['Operator']] = interface
+            rssi = record.get('Rssi', interface['Pings'][-1][2] if interface['Pings'] else -80)
+            interface['Pings'].append([record['Timestamp'] - start, record.get('Rtt'), rssi])
+    for record in sorted(records, key=lambda record: record['Timestamp']):
+        if record['DataId'] == EXPCONFIG['dataidCurl'] and record['ErrorCode'] == 0 \
+                and record['Operator'] in operators:
+            operators[record['Operator']]['Downloads'].append(
+                [record['Timestamp'] - start, record['Speed'], record['SetupTime'], record['Bytes']])
+
+    for ifname, interface in interfaces.items():
+        if not interface['Downloads']:
+            raise ValueError("No successful download over {} in {}".format(ifname, fileName))
+    return {"Duration": end - start, "Interfaces": interfaces}
+
+
+def synthetic_trace(count, duration, interval, seed):
+    """Trace of count interfaces whose RTT and RSSI follow random walks around
+       levels that change from time to time. The download speed falls with
+       the RTT and with a weak RSSI."""
+    rnd = random.Random(seed)
+    interfaces = {}
+    for i in range(count):
+        level = rnd.uniform(40, 200)
+        rtt = level
+        rssi = rnd.uniform(-95, -60)
+        loss = rnd.uniform(0.0, 0.1)
+        pings = []
+        downloads = []
+        offset = 0.0
+        nextDownload = 0.0
+        while offset < duration:
+            if rnd.random() < interval / 120.0:  # A new level about every two minutes
+                level = rnd.uniform(40, 200)
+            rtt = max(5.0, rtt + 0.3 * (level - rtt) + rnd.gauss(0, level * 0.05))
+            rssi = min(-50.0, max(-110.0, rssi + rnd.gauss(0, 1)))
+            pings.append([offset, None if rnd.random() < loss else round(rtt, 1), int(rssi)])
+            if offset >= nextDownload:
+                speed = 2e7 / rtt * (1 + (rssi + 75) / 50.0) * rnd.uniform(0.8, 1.2)
+                downloads.append([offset, max(1000.0, speed), 3 * rtt / 1000.0 + rnd.uniform(0, 0.1),
+                                  SYNTHETIC_BYTES])
+                nextDownload += SYNTHETIC_DOWNLOAD_INTERVAL
+            offset += interval
+        interfaces["op{}".format(i)] = {"Operator": "Operator{}".format(i), "Iccid": "iccid{}".format(i),
+                                        "Pings": pings, "Downloads": downloads}
+    return {"Duration": float(duration), "Interfaces": interfaces}
+
+
+def sample(samples, offset, duration):
+    """The sample in effect at offset (the trace repeats after duration)."""
+    offset = offset % duration if duration else offset
+    i = bisect.bisect_right([s[0] for s in samples], offset) - 1
+    return samples[max(i, 0)]
+
+
+###############################################################################
+# The fping command of the replay: "uomping_replay.py fping <trace file> <start>
+# <real start> <speedup> <real time it was spawned>" followed by the fping
+# arguments (see run_ping_exp)
+
+def replay_fping(args):
+    traceFile, start, realStart, speedup = args[0], float(args[1]), float(args[2]), float(args[3])
+    spawned = float(args[4])
+    fpingArgs = args[5:]
+    ifname = fpingArgs[fpingArgs.index('-I') + 1]
+    interval = float(fpingArgs[fpingArgs.index('-p') + 1]) / 1000.0
+    host = fpingArgs[-1]
+    with open(traceFile) as f:
+        trace = json.load(f)
+    pings = trace['Interfaces'][ifname]['Pings']
+    loop = VirtualLoop(speedup, start, realStart)
+
+    # The probes are due from the time fping was started, as for the real fping
+    # (at high speedups the start of Python takes several probe intervals)
+    first = loop.start + (spawned - loop.realStart) * loop.speedup
+    seq = 0
+    while True:
+        sent = first + seq * interval
+        _, rtt, _ = sample(pings, sent - start, trace['Duration'])
+        if rtt is not None:
+            received = sent + rtt / 1000.0
+            time.sleep(max(0, loop.real_time(received) - time.time()))
+            sys.stdout.write("[{:.6f}] {} : [{}], 84 bytes, {} ms ({} avg, 0% loss)\n".format(
+                received, host, seq, rtt, rtt))
+            sys.stdout.flush()
+        seq += 1
+        time.sleep(max(0, loop.real_time(first + seq * interval) - time.time()))
+
+
+def fping_command(outdir, traceFile, loop):
+    """Script running replay_fping, as run_ping_exp only takes the name of the fping command."""
+    command = os.path.join(outdir, "fping")
+    with open(command, 'w') as f:
+        f.write('#!/bin/sh\nexec "{}" "{}" fping "{}" {!r} {!r} {!r} "$(date +%s.%N)" "$@"\n'.format(
+            sys.executable, os.path.abspath(__file__), traceFile, loop.start, loop.realStart, loop.speedup))
+    os.chmod(command, 0755)
+    return command
+
+
+###############################################################################
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def serve_downloads(loop, trace):
+    """Local HTTP server of the downloads: GET /<ifname> answers with the
+       setup time, size and speed of the trace for ifname at the time of the
+       loop. Returns the server, running in a thread."""
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            ifname = self.path.split('?')[0].strip('/')
+            interface = trace['Interfaces'].get(ifname)
+            if interface is None:
+                self.send_error(404)
+                return
+            _, speed, setup, size = sample(interface['Downloads'], loop.time() - loop.start, trace['Duration'])
+            time.sleep(setup / loop.speedup)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            chunk = '\0' * CHUNK_SIZE
+            started = time.time()
+            sent = 0
+            while sent < size:
+                data = chunk[:size - sent]
+                self.wfile.write(data)
+                sent += len(data)
+                time.sleep(max(0, started + sent / (speed * loop.speedup) - time.time()))
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class ReplayDownloader(object):
+    """Downloads over the loopback interface from the local HTTP server, which
+       plays the part of the interface."""
+    def __init__(self, downloader, port):
+        self.downloader = downloader
+        self.port = port
+
+    def download(self, ifname, url, on_done):
+        self.downloader.download("lo", "http://127.0.0.1:{}/{}".format(self.port, ifname), on_done)
+
+    def stop(self):
+        self.downloader.stop()
+
+
+class RecordingWriter(object):
+    """Writes the records with the result writer and keeps the (loop time,
+       record) of the selections and downloads for the report."""
+    def __init__(self, loop, result_writer):
+        self.loop = loop
+        self.result_writer = result_writer
+        self.probes = 0
+        self.selections = []
+        self.downloads = []
+
+    def write(self, msg):
+        if msg['DataId'] == EXPCONFIG['dataid']:
+            self.probes += 1
+        elif msg['DataId'] == EXPCONFIG['dataidSelection']:
+            self.selections.append((self.loop.time(), msg))
+        elif msg['DataId'] == EXPCONFIG['dataidCurl']:
+            self.downloads.append((self.loop.time(), msg))
+        self.result_writer.write(msg)
+
+
+def publish_metadata(loop, socket, trace, expconfig, interval):
+    """Publish the metadata of all interfaces, with the RSSI of the trace."""
+    for ifname, interface in trace['Interfaces'].iteritems():
+        _, _, rssi = sample(interface['Pings'], loop.time() - loop.start, trace['Duration'])
+        info = {
+            expconfig['modeminterfacename']: ifname,
+            "Operator": interface['Operator'],
+            "ICCID": interface['Iccid'],
+            "RSSI": rssi,
+            "Timestamp": time.time()
+        }
+        socket.send("{} {}".format(expconfig['modem_metadata_topic'], json.dumps(info)))
+    loop.call_later(interval, publish_metadata, loop, socket, trace, expconfig, interval)
+
+
+def start_probes(loop, interfacesMap, selector, expconfig, result_writer):
+    """Start the probers once the metadata of all interfaces has arrived."""
+    if not all("Operator" in value['meta_info'] for value in interfacesMap.itervalues()):
+        loop.call_later(1, start_probes, loop, interfacesMap, selector, expconfig, result_writer)
+        return
+    for ifname, value in interfacesMap.iteritems():
+        value['ping_exp'] = run_ping_exp(loop, value, expconfig, result_writer,
+                                         functools.partial(selector.probe_update, ifname))
+
+
+###############################################################################
+
+def mean(values):
+    return sum(values) / len(values) if values else None
+
+
+def histogram_mean(snapshot, name):
+    count = total = 0
+    for key, value in snapshot.iteritems():
+        if key == name or key.startswith(name + "{"):
+            count += value['count']
+            total += value['sum']
+    return total / count if count else None
+
+
+def selection_quality(trace, loop, recorder, snapshot):
+    """How the selected interfaces compare with the best interface of the trace."""
+    choices = {}
+    matches = 0
+    regrets = []
+    for when, msg in recorder.selections:
+        selected = msg['Selected']
+        choices[selected] = choices.get(selected, 0) + 1
+        speeds = dict((ifname, sample(interface['Downloads'], when - loop.start, trace['Duration'])[1])
+                      for ifname, interface in trace['Interfaces'].iteritems())
+        best = max(speeds.itervalues())
+        if speeds[selected] == best:
+            matches += 1
+        regrets.append((best - speeds[selected]) / best)
+
+    # Speeds as in the trace (the downloads are speedup times faster)
+    dynamic = [msg['Speed'] / loop.speedup for _, msg in recorder.downloads
+               if msg['DynamicSelection'] and msg['ErrorCode'] == 0]
+    static = [msg['Speed'] / loop.speedup for _, msg in recorder.downloads
+              if not msg['DynamicSelection'] and msg['ErrorCode'] == 0]
+    decisions = len(recorder.selections)
+    return {
+        "Decisions": decisions,
+        "Postponed": snapshot.get("uomping_postponed_selections_total", 0),
+        "Choices": choices,
+        "BestSelected": float(matches) / decisions if decisions else None,
+        "MeanRegret": mean(regrets),
+        "DynamicSpeed": mean(dynamic),
+        "StaticSpeed": mean(static),
+        "DynamicGain": mean(dynamic) / mean(static) - 1 if dynamic and static else None,
+        "FailedDownloads": len([msg for _, msg in recorder.downloads if msg['ErrorCode'] != 0])
+    }
+
+
+def frange(start, stop, step):
+    value = start
+    while value < stop:
+        yield value
+        value += step
+
+
+def ParseCommandLine():
+    parser = argparse.ArgumentParser(description="Replay of the multi-homing experiment on fake interfaces.")
+    traces = parser.add_mutually_exclusive_group(required=True)
+    traces.add_argument('--trace', help='Results file to replay')
+    traces.add_argument('--synthetic', help='Number of synthetic interfaces', type=int)
+    parser.add_argument('--duration', help='Virtual duration in seconds (default: the trace duration)', type=float)
+    parser.add_argument('--seed', help='Seed of the synthetic trace and of the selection', type=int, default=0)
+    parser.add_argument('--speedup', help='Speed of the virtual clock (default 10)', type=float, default=10.0)
+    parser.add_argument('--selector', help='Selection policy (default {})'.format(DEFAULT_POLICY),
+                        default=DEFAULT_POLICY)
+    parser.add_argument('--interval', help='Probe interval in ms (default 5000)', type=int, default=5000)
+    parser.add_argument('--action-interval', help='Seconds between the curl actions (default 30)', type=float,
+                        default=30.0)
+    parser.add_argument('--repetitions', help='Repetitions of every action (default 3)', type=int, default=3)
+    parser.add_argument('--curl-engine', help='"pycurl" or "cli" (default pycurl)', default="pycurl")
+    parser.add_argument('--zmqport', help='Metadata endpoint (default inproc://uomping-replay)',
+                        default="inproc://uomping-replay")
+    parser.add_argument('--output', help='Output directory (default: a new temporary directory)')
+    return parser.parse_args()
+
+
+def main():
+    args = ParseCommandLine()
+    random.seed(args.seed)
+    outdir = args.output or tempfile.mkdtemp(prefix="uomping-replay-")
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = synthetic_trace(args.synthetic, args.duration or SYNTHETIC_DURATION, args.interval / 1000.0,
+                                args.seed)
+    duration = args.duration or trace['Duration']
+    traceFile = os.path.join(outdir, "trace.json")
+    with open(traceFile, 'w') as f:
+        json.dump(trace, f)
+
+    loop = VirtualLoop(args.speedup)
+    expconfig = dict(EXPCONFIG)
+    expconfig.update({
+        "guid": "replay",
+        "zmqport": args.zmqport,
+        "interval": args.interval,
+        "fping": fping_command(outdir, traceFile, loop),
+        "selector": args.selector,
+        "resultdir": outdir,
+        "resultfile": os.path.join(outdir, "results.txt"),
+        "result_spooldir": os.path.join(outdir, "spool"),
+        "interfacenames": sorted(trace['Interfaces']),
+        "interfaces_without_metadata": [],
+        "time": 60,
+        "curl_engine": args.curl_engine
+    })
+
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.bind(expconfig['zmqport'])
+    server = serve_downloads(loop, trace)
+
+    result_writer = ResultWriter(loop, expconfig['resultfile'], expconfig['result_spooldir'])
+    recorder = RecordingWriter(loop, result_writer)
+    interfacesMap = {}
+    for ifname in expconfig['interfacenames']:
+        interfacesMap[ifname] = {'meta_info': {}, 'ping_exp': None,
+                                 'rtts': Window(WINDOW_SIZE), 'rssis': Window(WINDOW_SIZE)}
+    meta_socket = subscribe_metadata(loop, context, interfacesMap, expconfig)
+    selector = InterfaceSelector(expconfig['selector'], interfacesMap)
+    downloader = ReplayDownloader(create_downloader(loop, expconfig), server.server_address[1])
+
+    actions = [{"Time": t, "Repetitions": args.repetitions, "Url": "http://replay/"}
+               for t in frange(args.action_interval, duration, args.action_interval)]
+
+    def run_action(action, lag, done):
+        return run_curl_exp(action, lag, done, interfacesMap, selector, downloader, expconfig, recorder)
+
+    scheduler = ActionScheduler(loop, actions, loop.start, run_action, loop.stop, retry=1.0)
+    # Actions still waiting (e.g. without any probe reply) do not extend the run
+    loop.call_at(loop.start + duration + args.action_interval, loop.stop)
+
+    started = time.time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        loop.call_later(0, publish_metadata, loop, publisher, trace, expconfig, 5.0)
+        loop.call_later(0, start_probes, loop, interfacesMap, selector, expconfig, recorder)
+        loop.run()
+    finally:
+        for value in interfacesMap.itervalues():
+            if value['ping_exp'] is not None:
+                value['ping_exp'].stop()
+        downloader.stop()
+        meta_socket.close()
+        publisher.close()
+        context.term()
+        server.shutdown()
+        result_writer.close()
+    elapsed = time.time() - started
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = used.ru_utime - usage.ru_utime + used.ru_stime - usage.ru_stime
+
+    snapshot = METRICS.snapshot()
+    report = {
+        "Trace": args.trace or "synthetic({}, seed {})".format(args.synthetic, args.seed),
+        "Interfaces": expconfig['interfacenames'],
+        "Selector": expconfig['selector'],
+        "Speedup": args.speedup,
+        "VirtualDuration": loop.time() - loop.start,
+        "RealDuration": elapsed,
+        "Throughput": {
+            "Probes": recorder.probes,
+            "ProbesPerSecond": recorder.probes / elapsed,
+            "Records": result_writer.records,
+            "RecordsPerSecond": result_writer.records / elapsed,
+            "Downloads": len(recorder.downloads),
+            "DownloadsPerSecond": len(recorder.downloads) / elapsed
+        },
+        "Selection": selection_quality(trace, loop, recorder, snapshot),
+        "Overhead": {
+            "CpuSeconds": cpu,
+            "CpuPerProbe": cpu / recorder.probes if recorder.probes else None,
+            "ChildCpuSeconds": children.ru_utime + children.ru_stime,
+            "ProbeHandling": histogram_mean(snapshot, "uomping_probe_handling_seconds"),
+            "DecisionLatency": histogram_mean(snapshot, "uomping_selection_seconds"),
+            "MeanSchedulingLag": scheduler.mean_lag(),
+            "MaxSchedulingLag": scheduler.lagMax
+        },
+        "Output": outdir
+    }
+    with open(os.path.join(outdir, "replay.json"), 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print json.dumps(report, indent=2, sort_keys=True)
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "fping":
+        replay_fping(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Tests of FpingProber with a stand-in fping on the loopback.
+
+The stand-in (this script run with "fping" as first argument) prints a reply
+for every probe in the fping -D -l output format. Its sends can slip (every
+cycle takes the interval plus a slip, as an fping scheduling each send from
+the previous one) and its clock can be stepped, as the wall clock of the node.
+
+The tests are kept out of files/, which is copied into the experiment image.
+The MONROE exporter is replaced by a stub, the tests are skipped without the
+other dependencies of the experiment (Python 2, zmq, netifaces).
+
+    python tests/test_fping_prober.py
+"""
+import os
+import sys
+import time
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "files"))
+
+STANDIN_RTT = 5.0  # ms
+# Shorter than the one of the experiment, so that a drift turns into losses within seconds
+TEST_GRACE = 0.1
+
+try:
+    if "monroe_exporter" not in sys.modules:
+        monroe_exporter = types.ModuleType("monroe_exporter")
+        monroe_exporter.initalize = lambda interval, resultdir: None
+        monroe_exporter.save_output = lambda msg, resultdir=None: None
+        sys.modules["monroe_exporter"] = monroe_exporter
+    import uomping_experiment
+    from event_loop import EventLoop
+except (ImportError, SyntaxError):
+    uomping_experiment = None
+    EventLoop = object
+
+
+def standin_fping(args):
+    """fping -p <ms> ... host, printing one reply per probe. The slip of every
+       cycle is given in seconds as "--slip <seconds>", a step of the clock as
+       "--step <time of the step> <seconds>"."""
+    interval = float(args[args.index('-p') + 1]) / 1000.0
+    slip = float(args[args.index('--slip') + 1]) if '--slip' in args else 0.0
+    stepAt, step = (float(args[args.index('--step') + 1]), float(args[args.index('--step') + 2])) \
+        if '--step' in args else (None, 0.0)
+    seq = 0
+    while True:
+        time.sleep(STANDIN_RTT / 1000.0)
+        now = time.time()
+        if stepAt is not None and now >= stepAt:
+            now += step
+        sys.stdout.write("[{:.6f}] 127.0.0.1 : [{}], 84 bytes, {} ms ({} avg, 0% loss)\n".format(
+            now, seq, STANDIN_RTT, STANDIN_RTT))
+        sys.stdout.flush()
+        seq += 1
+        time.sleep(interval + slip - STANDIN_RTT / 1000.0)
+
+
+class SteppedLoop(EventLoop):
+    """Event loop whose wall clock is stepped by step seconds at time stepAt."""
+    def __init__(self, stepAt, step):
+        super(SteppedLoop, self).__init__()
+        self.stepAt = stepAt
+        self.step = step
+
+    def time(self):
+        now = time.time()
+        return now + self.step if now >= self.stepAt else now
+
+
+@unittest.skipIf(uomping_experiment is None, "experiment dependencies missing")
+class FpingProberTest(unittest.TestCase):
+    def setUp(self):
+        self.grace = uomping_experiment.FPING_GRACE
+        uomping_experiment.FPING_GRACE = TEST_GRACE
+
+    def tearDown(self):
+        uomping_experiment.FPING_GRACE = self.grace
+
+    def probe(self, loop, duration, interval, extra):
+        probes = []
+        cmd = [sys.executable, os.path.abspath(__file__), "fping", "-I", "lo", "-D", "-l",
+               "-p", str(int(interval * 1000))] + extra + ["127.0.0.1"]
+        prober = uomping_experiment.FpingProber(loop, cmd, interval, probes.append)
+        prober.start()
+        started = time.time()
+        end = loop.monotonic() + duration
+
+        def stop():
+            if loop.monotonic() >= end:
+                loop.stop()
+            else:
+                loop.call_later(0.05, stop)
+        stop()
+        try:
+            loop.run()
+        finally:
+            prober.stop()
+        return probes, time.time() - started
+
+    def check(self, probes, sends):
+        replies = [m for m in probes if m is not None]
+        seqs = [int(m.group('seq')) for m in replies]
+        self.assertEqual(seqs, list(range(len(seqs))))
+        # The last probe can still be in flight at the end
+        self.assertTrue(len(replies) >= sends - 1, "{} replies for {} sends".format(len(replies), sends))
+        self.assertEqual(len(probes), len(replies), "{} probes reported lost".format(len(probes) - len(replies)))
+
+    def test_drift(self):
+        # Every 100 ms cycle slips 20 ms: after 10 probes the sends are a whole interval plus the grace late
+        probes, elapsed = self.probe(EventLoop(), 3.0, 0.1, ["--slip", "0.02"])
+        self.check(probes, int(elapsed / 0.12))
+
+    def test_clock_step(self):
+        # The wall clock (of the loop and of fping) jumps forward by a minute after 1 s
+        stepAt = time.time() + 1.0
+        probes, elapsed = self.probe(SteppedLoop(stepAt, 60.0), 2.0, 0.1, ["--step", repr(stepAt), "60.0"])
+        self.check(probes, int(elapsed / 0.1))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "fping":
+        standin_fping(sys.argv[2:])
+    else:
+        unittest.main()
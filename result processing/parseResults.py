@@ -1,65 +1,72 @@
 #!/usr/bin/python
 
-import json
 import sys
 import time
 import io
 import datetime
 import argparse
+import shutil
+import tempfile
+import glob
+import os
+import multiprocessing
+import resultStats
+
+# Size of the write buffers of the output and of the section files
+BUFFER_SIZE = 1024 * 1024
 
 ###############################################################################
 def ParseCommandLine():
     parser = argparse.ArgumentParser(description = "Monroe UomPing experiment result processing.")
-    parser.add_argument('-i', '--input', help = 'Input file', required = True)
+    inputs = parser.add_mutually_exclusive_group(required = True)
+    inputs.add_argument('-i', '--input', help = 'Input file', required = False)
+    inputs.add_argument('-b', '--batch', help = 'Directories (their results*.txt[.gz] files) or glob patterns of result files, summarized in a single table', required = False, nargs = '+')
     parser.add_argument('-o', '--output', help = 'Output file', required = True)
-    
-    
+    parser.add_argument('-w', '--workers', help = 'Number of processes parsing result files in batch mode (default = number of cores)', required = False, default = multiprocessing.cpu_count(), type = int)
+
+
     args = parser.parse_args()
     return args
-    
-###############################################################################
 
-if __name__ == '__main__':
-    args = ParseCommandLine()
-    
-#    args.input
+###############################################################################
+# The input is read once and every line is decoded once. The output has three sections (dynamic curl, static curl and
+# ping AvgRtt rows): the dynamic rows are written directly to the output, the static and ping rows go to temporary
+# files which are appended to the output at the end.
 
+def ProcessResultFile(args):
     speedSumDynamic = 0
     lineNumDynamic = 0
     speedSumStatic = 0
     lineNumStatic = 0
-    
-    # Output log list entries to file
-    with io.open(args.input, 'r') as inputFile, io.open(args.output, 'w') as outputFile:
-        outputFile.write(unicode("Timestamp, Url, Operator, Speed\n"))
-
-        for line in inputFile:
-            jsonLine = json.loads(line)
-            if jsonLine["DataId"] == "MONROE.EXP.UOMPING.CURL":
+
+    skipped = {'lines': 0, 'files': 0}
+    with io.open(args.output, 'wb', BUFFER_SIZE) as outputFile, \
+            tempfile.TemporaryFile(bufsize = BUFFER_SIZE) as staticFile, \
+            tempfile.TemporaryFile(bufsize = BUFFER_SIZE) as pingFile:
+        outputFile.write(b"Timestamp, Url, Operator, Speed\n")
+
+        for jsonLine in resultStats.ResultRecords(args.input, skipped):
+            if jsonLine["DataId"] == resultStats.CURL_DATA_ID:
+                row = u"%s, %s, %s, %s, %s\n" % (jsonLine["Timestamp"], jsonLine["Url"], jsonLine["Speed"], jsonLine["Operator"], jsonLine["DynamicSelection"])
                 if jsonLine["DynamicSelection"]:
-                    outputFile.write( unicode(str(jsonLine["Timestamp"]) + ", " + jsonLine["Url"] + ", " + str(jsonLine["Speed"]) + ", " + jsonLine["Operator"] + ", " + str(jsonLine["DynamicSelection"]) + "\n" ) )                
+                    outputFile.write(row.encode('utf-8'))
                     speedSumDynamic += jsonLine["Speed"]
                     lineNumDynamic += 1
-
-        inputFile.seek(0)
-
-        for line in inputFile:
-            jsonLine = json.loads(line)
-            if jsonLine["DataId"] == "MONROE.EXP.UOMPING.CURL":
-                if not jsonLine["DynamicSelection"]:
-                    outputFile.write( unicode(str(jsonLine["Timestamp"]) + ", " + jsonLine["Url"] + ", " + str(jsonLine["Speed"]) + ", " + jsonLine["Operator"] + ", " + str(jsonLine["DynamicSelection"]) + "\n" ) )
+                else:
+                    staticFile.write(row.encode('utf-8'))
                     speedSumStatic += jsonLine["Speed"]
                     lineNumStatic += 1
-                    
-        inputFile.seek(0)
-
-        outputFile.write(unicode("\n\n\nTimestamp, Operator, AvgRtt"))
-        for line in inputFile:
-            found = False
-            jsonLine = json.loads(line)
-            if jsonLine["DataId"] == "MONROE.EXP.UOMPING.PING" and "AvgRtt" in jsonLine:
-                outputFile.write( unicode(str(jsonLine["Timestamp"]) + ", " + jsonLine["Operator"] + ", " + str(jsonLine["AvgRtt"]) + "\n") )
-                    
+
+            elif jsonLine["DataId"] == resultStats.PING_DATA_ID and "AvgRtt" in jsonLine:
+                pingFile.write((u"%s, %s, %s\n" % (jsonLine["Timestamp"], jsonLine["Operator"], jsonLine["AvgRtt"])).encode('utf-8'))
+
+        staticFile.seek(0)
+        shutil.copyfileobj(staticFile, outputFile, BUFFER_SIZE)
+
+        outputFile.write(b"\n\n\nTimestamp, Operator, AvgRtt")
+        pingFile.seek(0)
+        shutil.copyfileobj(pingFile, outputFile, BUFFER_SIZE)
+
     if lineNumDynamic > 0 :
         print "Average speed dynamic = " + str(speedSumDynamic / lineNumDynamic) + " bytes/sec"
     else:
@@ -69,3 +76,63 @@ if __name__ == '__main__':
         print "Average speed static = " + str(speedSumStatic / lineNumStatic) + " bytes/sec"
     else:
         print "No static data"
+
+    PrintSkipped(skipped)
+
+# Lines and files that could not be read, the results only cover the rest
+def PrintSkipped(skipped):
+    if skipped['lines'] or skipped['files']:
+        print "Skipped: " + str(skipped['lines']) + " lines, " + str(skipped['files']) + " files not read to the end"
+
+###############################################################################
+# Batch mode: the result files are parsed in parallel, their statistics are merged (see resultStats.py) and written as
+# one summary table.
+
+# Result files of a directory: results.txt, its rotated parts (results.<n>.txt) and the gzipped ones
+RESULT_FILE_PATTERNS = ['results*.txt', 'results*.txt.gz']
+
+def ResultFiles(patterns):
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            directoryPatterns = [os.path.join(pattern, filePattern) for filePattern in RESULT_FILE_PATTERNS]
+        else:
+            directoryPatterns = [pattern]
+        for filePattern in directoryPatterns:
+            files.update(fileName for fileName in glob.glob(filePattern) if os.path.isfile(fileName))
+    return sorted(files)
+
+
+def ProcessResultSet(args):
+    files = ResultFiles(args.batch)
+    if not files:
+        print "No result files"
+        sys.exit()
+
+    stats = {'speed': {}, 'rtt': {}, 'skipped': {'lines': 0, 'files': 0}}
+    if args.workers > 1 and len(files) > 1:
+        pool = multiprocessing.Pool(min(args.workers, len(files)))
+        # imap returns the statistics in file order, so the merged sums do not depend on which worker ends first
+        for fileStats in pool.imap(resultStats.ParseResultFile, files):
+            resultStats.MergeStats(stats, fileStats)
+        pool.close()
+        pool.join()
+    else:
+        for fileName in files:
+            resultStats.MergeStats(stats, resultStats.ParseResultFile(fileName))
+
+    with io.open(args.output, 'w') as outputFile:
+        resultStats.WriteSummary(stats, outputFile)
+
+    print "Result files: " + str(len(files))
+    PrintSkipped(stats['skipped'])
+
+###############################################################################
+
+if __name__ == '__main__':
+    args = ParseCommandLine()
+
+    if args.batch:
+        ProcessResultSet(args)
+    else:
+        ProcessResultFile(args)
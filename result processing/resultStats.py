@@ -0,0 +1,205 @@
+#!/usr/bin/python
+
+# Statistics of uomping result files that can be computed per file and merged.
+#
+# Every value distribution is kept in a LogHistogram: the counts of logarithmic buckets (each bucket spans a relative
+# width of 2 * ALPHA) plus the exact count, sum, minimum and maximum. Merging two histograms adds the bucket counts, so
+# per-file statistics merge into per-node, per-operator and per-URL ones without keeping the values. The memory only
+# grows with the logarithm of the value range, and the percentiles are within ALPHA (relative) of the exact ones.
+
+import gzip
+import io
+import math
+import sys
+import zlib
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+CURL_DATA_ID = "MONROE.EXP.UOMPING.CURL"
+PING_DATA_ID = "MONROE.EXP.UOMPING.PING"
+
+# Relative accuracy of the percentiles
+ALPHA = 0.01
+
+# Percentiles of the summary table
+PERCENTILES = [50, 90, 99]
+
+# Key of the rows that aggregate all nodes/operators/URLs
+ALL = "*"
+
+###############################################################################
+
+class LogHistogram(object):
+    def __init__(self, alpha = ALPHA):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.logGamma = math.log(self.gamma)
+
+        # bucket index -> count, values <= 0 are counted separately
+        self.buckets = {}
+        self.nonPositive = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def Add(self, value):
+        if value > 0:
+            index = int(math.ceil(math.log(value) / self.logGamma))
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+        else:
+            self.nonPositive += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def Merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.nonPositive += other.nonPositive
+        self.count += other.count
+        self.sum += other.sum
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def Mean(self):
+        return self.sum / self.count if self.count else None
+
+    # Value at percentile p (0-100)
+    def Percentile(self, p):
+        if not self.count:
+            return None
+        rank = p / 100.0 * (self.count - 1)
+        if rank < self.nonPositive:
+            return self.min
+        seen = self.nonPositive
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+
+###############################################################################
+# Result files are plain or gzipped (.gz, written by the experiment with result_compress)
+
+def OpenResultFile(fileName):
+    if fileName.endswith(".gz"):
+        return io.BufferedReader(gzip.open(fileName, 'rb'))
+    return io.open(fileName, 'rb')
+
+
+# Decoded records of a result file. Lines that are not records are skipped and counted in skipped['lines']; a
+# warning names the file and the first skipped line. A file that cannot be read to the end (e.g. a truncated .gz) is
+# counted in skipped['files'] after its readable records.
+def ResultRecords(fileName, skipped):
+    firstSkipped = None
+    lines = 0
+    try:
+        with OpenResultFile(fileName) as inputFile:
+            for lineNumber, line in enumerate(inputFile, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    record["DataId"]
+                except (ValueError, KeyError, TypeError):
+                    lines += 1
+                    if firstSkipped is None:
+                        firstSkipped = lineNumber
+                    continue
+                yield record
+    except (IOError, EOFError, zlib.error) as error:
+        skipped['files'] += 1
+        sys.stderr.write("%s: not read to the end: %s\n" % (fileName, error))
+    if lines:
+        skipped['lines'] += lines
+        sys.stderr.write("%s: %d lines are not result records, skipped (first at line %d)\n" % (fileName, lines, firstSkipped))
+
+
+###############################################################################
+# Statistics of one result file:
+#   'speed': (node, operator, url, dynamic selection) -> LogHistogram of the curl speeds
+#   'rtt': (node, operator) -> LogHistogram of the ping RTTs
+#   'skipped': {'lines', 'files'} lines and files that could not be read (see ResultRecords)
+
+def ParseResultFile(fileName):
+    stats = {'speed': {}, 'rtt': {}, 'skipped': {'lines': 0, 'files': 0}}
+    for jsonLine in ResultRecords(fileName, stats['skipped']):
+        if jsonLine["DataId"] == CURL_DATA_ID and "Speed" in jsonLine:
+            key = (jsonLine.get("NodeId"), jsonLine.get("Operator"), jsonLine.get("Url"), bool(jsonLine.get("DynamicSelection")))
+            stats['speed'].setdefault(key, LogHistogram()).Add(jsonLine["Speed"])
+        elif jsonLine["DataId"] == PING_DATA_ID and "Rtt" in jsonLine:
+            key = (jsonLine.get("NodeId"), jsonLine.get("Operator"))
+            stats['rtt'].setdefault(key, LogHistogram()).Add(jsonLine["Rtt"])
+    return stats
+
+
+# Merge the statistics of a file into the overall ones
+def MergeStats(total, stats):
+    for counter, value in stats['skipped'].items():
+        total['skipped'][counter] += value
+    for table in ('speed', 'rtt'):
+        for key, histogram in stats[table].items():
+            if key in total[table]:
+                total[table][key].Merge(histogram)
+            else:
+                total[table][key] = histogram
+    return total
+
+
+# Add the rows aggregating over nodes and operators (ALL keys)
+def RollUp(stats):
+    speed = {}
+    for (node, operator, url, dynamic), histogram in stats['speed'].items():
+        for key in [(node, operator, url), (node, ALL, url), (ALL, operator, url), (ALL, ALL, url), (ALL, ALL, ALL)]:
+            speed.setdefault(key + (dynamic,), LogHistogram()).Merge(histogram)
+
+    rtt = {}
+    for (node, operator), histogram in stats['rtt'].items():
+        for key in [(node, operator), (node, ALL), (ALL, operator), (ALL, ALL)]:
+            rtt.setdefault(key, LogHistogram()).Merge(histogram)
+    return speed, rtt
+
+
+###############################################################################
+
+def FormatValue(value):
+    return "" if value is None else "%.1f" % value
+
+
+def HistogramColumns(histogram):
+    if histogram is None:
+        histogram = LogHistogram()
+    return [str(histogram.count), FormatValue(histogram.Mean())] + [FormatValue(histogram.Percentile(p)) for p in PERCENTILES]
+
+
+# Sort the ALL rows after the rows of the single nodes/operators
+def RowOrder(key):
+    return [(part == ALL, part) for part in key]
+
+
+# Write the summary table: speed per node/operator/URL for dynamic and static selection and the gain of the dynamic
+# selection (relative difference of the mean speeds), then the RTT per node/operator.
+def WriteSummary(stats, outputFile):
+    speed, rtt = RollUp(stats)
+
+    columns = ["Count", "Mean"] + ["P%d" % p for p in PERCENTILES]
+    outputFile.write(u", ".join(["Node", "Operator", "Url"] + ["Dynamic " + column for column in columns] + ["Static " + column for column in columns] + ["Gain"]) + u"\n")
+    for key in sorted(set(key[:3] for key in speed), key = RowOrder):
+        dynamic, static = speed.get(key + (True,)), speed.get(key + (False,))
+        gain = ""
+        if dynamic is not None and static is not None and static.Mean():
+            gain = "%+.1f%%" % (100.0 * (dynamic.Mean() / static.Mean() - 1))
+        outputFile.write(u", ".join([unicode(part) for part in key] + HistogramColumns(dynamic) + HistogramColumns(static) + [gain]) + u"\n")
+
+    outputFile.write(u"\n\n\n" + u", ".join(["Node", "Operator"] + ["Rtt " + column for column in columns]) + u"\n")
+    for key in sorted(rtt, key = RowOrder):
+        outputFile.write(u", ".join([unicode(part) for part in key] + HistogramColumns(rtt[key])) + u"\n")